@@ -0,0 +1,512 @@
+# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:light
+#     text_representation:
+#       extension: .py
+#       format_name: light
+#       format_version: '1.5'
+#       jupytext_version: 1.13.7
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# # Replay Buffer Benchmark Documentation
+# *Version:* `1.0` *(Jupytext, time measurements, logger)*
+
+# <a name="ToC"></a>
+# # Table of Content
+#
+# - [Notebook Description](#0)
+# - [General Settings](#1)
+#     - [Paths](#1-1)
+#     - [Notebook Functionality and Appearance](#1-2)
+#     - [External Libraries](#1-3)
+#     - [Internal Code](#1-4)
+#     - [Constants](#1-5)
+# - [Analysis](#2)
+#     - [Uniform Sampling](#2-1)
+#     - [Segment Trees](#2-2)
+#     - [Batched Adding](#2-3)
+#     - [Rank-Based Prioritization](#2-4)
+#     - [Observation Codecs](#2-5)
+#     - [Sharded Prioritization](#2-6)
+#     - [Alias Table Sampling](#2-7)
+#     - [K-ary Priority Tree](#2-8)
+# - [Final Timestamp](#3)
+
+# <a name="0"></a>
+# # Notebook Description
+# [ToC](#ToC)
+
+# This notebook serves for measuring the latency of the replay buffers' operations (src/data/replay_buffer.py) for
+# different buffer sizes.
+#
+# For general description, please see the *README.md* file.
+
+# <a name="1"></a>
+# # GENERAL SETTINGS
+# [ToC](#ToC)
+# General settings for the notebook (paths, python libraries, own code, notebook constants).
+#
+# > *NOTE: All imports and constants for the notebook settings shoud be here. Nothing should be imported in the analysis section.*
+
+# <a name="1-1"></a>
+# ### Paths
+# [ToC](#ToC)
+#
+# Adding paths that are necessary to import code from within the repository.
+
+import sys
+import os
+sys.path+=[os.path.join(os.getcwd(), ".."), os.path.join(os.getcwd(), "../..")] # one and two up
+
+# <a name="1-2"></a>
+# ### Notebook Functionality and Appearance
+# [ToC](#ToC)
+# Necessary libraries for notebook functionality:
+# - A button for hiding/showing the code. By default it is deactivated and can be activated by setting CREATE_BUTTON constant to True.
+# > **NOTE: This way, using the function, the button works only in active notebook. If the functionality needs to be preserved in html export, then the code has to be incluced directly into notebook.**
+# - Set notebook width to 100%.
+# - Notebook data frame setting for better visibility.
+# - Initial timestamp setting and logging the start of the execution.
+
+from src.utils.notebook_support_functions import create_button, get_notebook_name
+from src.utils.logger import Logger
+from src.utils.envs import Envs
+from pandas import options
+from IPython.display import display, HTML
+
+# > Constants for overall behaviour.
+
+LOGGER_CONFIG_NAME = "logger_file_console" # default
+PYTHON_CONFIG_NAME = "python_repo" # default
+CREATE_BUTTON = False
+ADDAPT_WIDTH = False
+NOTEBOOK_NAME = get_notebook_name()
+
+options.display.max_rows = 500
+options.display.max_columns = 500
+envs = Envs()
+envs.set_logger(LOGGER_CONFIG_NAME)
+envs.set_config(PYTHON_CONFIG_NAME)
+Logger().start_timer(f"NOTEBOOK; Notebook name: {NOTEBOOK_NAME}")
+if CREATE_BUTTON:
+    create_button()
+if ADDAPT_WIDTH:
+    display(HTML("<style>.container { width:100% !important; }</style>")) # notebook width
+
+# <a name="1-3"></a>
+# ### External Libraries
+# [ToC](#ToC)
+
+from itertools import product
+from threading import Event, Thread
+from time import perf_counter, sleep
+from numpy import zeros, arange, full, tile, uint8, float16, float32
+from numpy.random import choice, default_rng
+from pandas import DataFrame
+
+# <a name="1-4"></a>
+# ### Internal Code
+# [ToC](#ToC)
+# Code, libraries, classes, functions from within the repository.
+
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, ReplayBufferDataTypes, SAMPLING_MODES, \
+    PRIORITY_SAMPLING_MODES
+from src.data.alias_table import AliasTable
+from src.data.observation_codec import ObservationCodec
+from src.data.rank_based_replay_buffer import RankBasedPrioritizedReplayBuffer
+from src.data.sharded_replay_buffer import ShardedPrioritizedReplayBuffer
+from src.data.segment_tree import SumSegmentTreeNumpy, MinSegmentTreeNumpy, PriorityTreeNumpy, KaryPriorityTreeNumpy
+from src.external.segment_tree import SumSegmentTree, MinSegmentTree
+
+# <a name="1-5"></a>
+# ### Constants
+# [ToC](#ToC)
+# Constants for the notebook.
+#
+# > *NOTE: Please use all letters upper.*
+
+# #### General Constants
+# [ToC](#ToC)
+
+# from src.constants.global_constants import *  # Remember to import only the constants in use
+N_ROWS_TO_DISPLAY = 2
+FIGURE_SIZE_SETTING = {"autosize": False, "width": 2200, "height": 750}
+
+# #### Constants for Setting Automatic Run
+# [ToC](#ToC)
+
+
+
+# #### Notebook Specific Constants
+# [ToC](#ToC)
+
+STATE_DIM = 8
+ACTIONS_DIM = 1
+N_ACTIONS = 4
+BATCH_SIZE = 64
+BUFFER_SIZES = [2**10, 2**14, 2**17, 2**20]
+N_REPEATS = 200
+TREE_CAPACITIES = [2**10, 2**14, 2**17, 2**20]
+N_ENVS = [1, 8, 64, 256]
+ALPHA = 0.6
+BETA = 0.4
+MERGE_EVERY = [1, 8, 32]
+FRAME_SHAPE = (84, 84)
+FRAMES_BUFFER_SIZE = 2**12
+CODECS = {
+    "float32": ObservationCodec(float32),
+    "float16": ObservationCodec(float16),
+    "uint8": ObservationCodec(uint8),
+    "uint8 + zlib (16 frames)": ObservationCodec(uint8, chunk_size=16),
+    "uint8 + zlib (64 frames)": ObservationCodec(uint8, chunk_size=64),
+}
+N_SHARDS = [1, 4, 16]
+N_ACTORS = 4
+ACTOR_STEP_S = 1e-4
+BRANCHINGS = [2, 4, 16, 32]
+
+
+# +
+def measure_latency(function, n_repeats=N_REPEATS):
+    """
+    Measures mean latency of the function call in microseconds.
+    """
+    start = perf_counter()
+    for _ in range(n_repeats):
+        function()
+    return (perf_counter() - start) / n_repeats * 1e6
+
+
+def fill_buffer(memory, buffer_size):
+    """
+    Fills the buffer completely with dummy transitions.
+    """
+    state = zeros(STATE_DIM)
+    for i in range(buffer_size):
+        memory.add(state, i % N_ACTIONS, 0., state, False)
+# -
+
+# <a name="2"></a>
+# # ANALYSIS
+# [ToC](#ToC)
+
+# <a name="2-1"></a>
+# ## Uniform Sampling
+# [ToC](#ToC)
+#
+# Latency of `ReplayBuffer.sample` in microseconds for each sampling mode compared with the index sampling of the
+# original implementation alone. The original *numpy.random.choice* without replacement permutes the whole filled
+# range, the buffer's modes depend only on the batch size and stay flat as the buffer grows.
+
+# +
+results = []
+for buffer_size in BUFFER_SIZES:
+    results.append({
+        "BUFFER SIZE": buffer_size, "SAMPLING": "numpy.random.choice",
+        "LATENCY [us]": measure_latency(lambda: choice(buffer_size, size=BATCH_SIZE, replace=False), n_repeats=10)
+    })
+    for sampling in SAMPLING_MODES:
+        memory = ReplayBuffer(
+            state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size, batch_size=BATCH_SIZE,
+            n_actions=N_ACTIONS, sampling=sampling, seed=0
+        )
+        fill_buffer(memory, buffer_size)
+        results.append({
+            "BUFFER SIZE": buffer_size, "SAMPLING": sampling, "LATENCY [us]": measure_latency(memory.sample)
+        })
+
+DataFrame(results).pivot(index="BUFFER SIZE", columns="SAMPLING", values="LATENCY [us]")
+# -
+
+# <a name="2-2"></a>
+# ## Segment Trees
+# [ToC](#ToC)
+#
+# Latency in microseconds of the operations of the original list-based trees (src/external/segment_tree.py, unmodified
+# OpenAI baselines code) and the NumPy array-backed trees (src/data/segment_tree.py). Sum and min are measured on a
+# range which is not the whole array, so the tree has to be traversed. The single-leaf operations of the original trees
+# work on Python floats and are not slower, the NumPy trees pay off with the batch operations used by the prioritized
+# buffer - setting BATCH SIZE leaves and finding BATCH SIZE prefix sums, which the original trees do one by one.
+
+# +
+results = []
+rng = default_rng(0)
+for capacity in TREE_CAPACITIES:
+    for sum_tree_class, min_tree_class in [(SumSegmentTree, MinSegmentTree), (SumSegmentTreeNumpy, MinSegmentTreeNumpy)]:
+        sum_tree = sum_tree_class(capacity)
+        min_tree = min_tree_class(capacity)
+        for i, (sum_value, min_value) in enumerate(rng.random((capacity, 2))):
+            sum_tree[i] = sum_value
+            min_tree[i] = min_value
+        total = sum_tree.sum()
+        batch_indices = rng.integers(0, capacity, size=BATCH_SIZE)
+        batch_values = rng.random(BATCH_SIZE)
+        batch_prefixsums = rng.random(BATCH_SIZE) * total
+        if sum_tree_class is SumSegmentTree:
+            def set_batch():
+                for index, value in zip(batch_indices, batch_values):
+                    sum_tree[index] = value
+
+            def find_prefixsum_idx_batch():
+                return [sum_tree.find_prefixsum_idx(prefixsum) for prefixsum in batch_prefixsums]
+        else:
+            def set_batch():
+                sum_tree.update_batch(batch_indices, batch_values)
+
+            def find_prefixsum_idx_batch():
+                return sum_tree.find_prefixsum_idx_batch(batch_prefixsums)
+        results.append({
+            "CAPACITY": capacity,
+            "TREE": sum_tree_class.__name__,
+            "SET [us]": measure_latency(lambda: sum_tree.__setitem__(capacity // 3, 0.5)),
+            "GET [us]": measure_latency(lambda: sum_tree[capacity // 3]),
+            "SUM [us]": measure_latency(lambda: sum_tree.sum(1, capacity - 1)),
+            "MIN [us]": measure_latency(lambda: min_tree.min(1, capacity - 1)),
+            "FIND PREFIXSUM IDX [us]": measure_latency(lambda: sum_tree.find_prefixsum_idx(total / 3)),
+            "SET BATCH [us]": measure_latency(set_batch),
+            "FIND PREFIXSUM IDX BATCH [us]": measure_latency(find_prefixsum_idx_batch),
+        })
+
+DataFrame(results).set_index(["CAPACITY", "TREE"])
+# -
+
+# <a name="2-3"></a>
+# ## Batched Adding
+# [ToC](#ToC)
+#
+# Throughput of adding the transitions of N parallel environments in thousands of transitions per second, either one
+# by one with `add` or all at once with `add_batch`.
+
+# +
+results = []
+for buffer_class, kwargs in [(ReplayBuffer, {}), (PrioritizedReplayBuffer, {"alpha": ALPHA})]:
+    for n_envs in N_ENVS:
+        memory = buffer_class(
+            state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=BUFFER_SIZES[-1], batch_size=BATCH_SIZE,
+            n_actions=N_ACTIONS, **kwargs
+        )
+        states = zeros((n_envs, STATE_DIM))
+        actions = arange(n_envs) % N_ACTIONS
+        rewards = zeros(n_envs)
+        dones = full(n_envs, False)
+
+        def add_one_by_one():
+            for i in range(n_envs):
+                memory.add(states[i], actions[i], rewards[i], states[i], dones[i])
+
+        for method, function in [
+            ("add", add_one_by_one), ("add_batch", lambda: memory.add_batch(states, actions, rewards, states, dones))
+        ]:
+            results.append({
+                "BUFFER": buffer_class.__name__, "N ENVS": n_envs, "METHOD": method,
+                "THROUGHPUT [k/s]": n_envs / measure_latency(function) * 1e3
+            })
+
+DataFrame(results).pivot(index=["BUFFER", "N ENVS"], columns="METHOD", values="THROUGHPUT [k/s]")
+# -
+
+# <a name="2-4"></a>
+# ## Rank-Based Prioritization
+# [ToC](#ToC)
+#
+# Latency in microseconds of one learning step of the prioritized buffers - sampling the batch and updating the
+# priorities of the sampled transitions. The proportional buffer descends the segment tree, the rank-based buffer looks
+# the batch up in the precomputed strata and merges the changed transitions into its sorted order once per MERGE EVERY
+# steps.
+
+# +
+results = []
+rng = default_rng(0)
+for buffer_size in BUFFER_SIZES:
+    for buffer_class, kwargs in [(PrioritizedReplayBuffer, {})] + \
+            [(RankBasedPrioritizedReplayBuffer, {"merge_every": merge_every}) for merge_every in MERGE_EVERY]:
+        memory = buffer_class(
+            state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size, batch_size=BATCH_SIZE,
+            n_actions=N_ACTIONS, alpha=ALPHA, seed=0, **kwargs
+        )
+        memory.add_batch(zeros((buffer_size, STATE_DIM)), arange(buffer_size) % N_ACTIONS, zeros(buffer_size),
+                         zeros((buffer_size, STATE_DIM)), full(buffer_size, False))
+        memory.update_priorities(arange(buffer_size), rng.random(buffer_size))
+
+        def learning_step():
+            indices = memory.sample(BETA)[-1]
+            memory.update_priorities(indices, rng.random(BATCH_SIZE))
+
+        results.append({
+            "BUFFER SIZE": buffer_size,
+            "BUFFER": buffer_class.__name__ + (f" (merge every {kwargs['merge_every']})" if kwargs else ""),
+            "LATENCY [us]": measure_latency(learning_step)
+        })
+
+DataFrame(results).pivot(index="BUFFER SIZE", columns="BUFFER", values="LATENCY [us]")
+# -
+
+# <a name="2-5"></a>
+# ## Observation Codecs
+# [ToC](#ToC)
+#
+# Memory per transition (state and next state) and sampling latency of the buffer storing Atari-like frames (constant
+# background with a moving object) with the observation codecs. The batch is decoded into float32 in all the cases.
+
+# +
+frames = tile(full(FRAME_SHAPE, 90, dtype=uint8), (FRAMES_BUFFER_SIZE + 1, 1, 1))
+for i, frame in enumerate(frames):
+    frame[i % 80:i % 80 + 4, 40:44] = 255
+frames = frames.reshape(FRAMES_BUFFER_SIZE + 1, -1)
+
+results = []
+for codec_name, codec in CODECS.items():
+    memory = ReplayBuffer(
+        state_dim=frames.shape[1], actions_dim=ACTIONS_DIM, buffer_size=FRAMES_BUFFER_SIZE, batch_size=BATCH_SIZE,
+        n_actions=N_ACTIONS, data_types=ReplayBufferDataTypes(states=float32), observation_codec=codec
+    )
+    memory.add_batch(frames[:-1], arange(FRAMES_BUFFER_SIZE) % N_ACTIONS, zeros(FRAMES_BUFFER_SIZE), frames[1:],
+                     full(FRAMES_BUFFER_SIZE, False))
+    results.append({
+        "CODEC": codec_name,
+        "MEMORY PER TRANSITION [B]": memory.get_observation_n_bytes() / FRAMES_BUFFER_SIZE,
+        "SAMPLE LATENCY [us]": measure_latency(memory.sample)
+    })
+
+DataFrame(results).set_index("CODEC")
+# -
+
+# <a name="2-6"></a>
+# ## Sharded Prioritization
+# [ToC](#ToC)
+#
+# Latency in microseconds of one learning step (sampling and updating the priorities) of the sharded prioritized buffer
+# and the adding throughput of N ACTORS threads, each adding into its own shard after every environment step of
+# ACTOR STEP S seconds. One shard is the single locked tree. With more shards the actors and the learner lock
+# different, shallower trees, but the learner pays the fixed cost of the descent and the update once per shard in the
+# batch. The descents of the shards are done one after another in the learner's thread (SAMPLING THREADS 0) or
+# concurrently in the thread pool of the buffer (one thread per shard), where they overlap only while numpy releases the
+# GIL.
+
+# +
+results = []
+rng = default_rng(0)
+for buffer_size, n_shards, n_sampling_threads in product(BUFFER_SIZES, N_SHARDS, [0, None]):
+    memory = ShardedPrioritizedReplayBuffer(
+        state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size, batch_size=BATCH_SIZE,
+        n_actions=N_ACTIONS, alpha=ALPHA, n_shards=n_shards, seed=0, n_sampling_threads=n_sampling_threads
+    )
+    shard_size = buffer_size // n_shards
+    for shard in range(n_shards):
+        memory.add_batch(zeros((shard_size, STATE_DIM)), arange(shard_size) % N_ACTIONS, zeros(shard_size),
+                         zeros((shard_size, STATE_DIM)), full(shard_size, False), shard=shard)
+    stop = Event()
+    n_adds = [0] * N_ACTORS
+
+    def actor(actor_id):
+        state = zeros(STATE_DIM)
+        while not stop.is_set():
+            sleep(ACTOR_STEP_S)  # environment step
+            memory.add(state, 0, 0., state, False, shard=actor_id % n_shards)
+            n_adds[actor_id] += 1
+
+    def learning_step():
+        indices = memory.sample(BETA)[-1]
+        memory.update_priorities(indices, rng.random(BATCH_SIZE))
+
+    actors = [Thread(target=actor, args=(actor_id,), daemon=True) for actor_id in range(N_ACTORS)]
+    for thread in actors:
+        thread.start()
+    start = perf_counter()
+    latency = measure_latency(learning_step)
+    adds_per_second = sum(n_adds) / (perf_counter() - start)
+    stop.set()
+    for thread in actors:
+        thread.join()
+    results.append({
+        "BUFFER SIZE": buffer_size, "N SHARDS": n_shards,
+        "SAMPLING THREADS": memory._executor._max_workers if memory._executor is not None else 0,
+        "LEARNING STEP [us]": latency, "ADDS [k/s]": adds_per_second / 1e3
+    })
+
+DataFrame(results).set_index(["BUFFER SIZE", "N SHARDS", "SAMPLING THREADS"])
+# -
+
+# <a name="2-7"></a>
+# ## Alias Table Sampling
+# [ToC](#ToC)
+#
+# Latency in microseconds of sampling from static priorities. The batch of indices is drawn by BATCH SIZE descents of
+# the original SumSegmentTree (src/external/segment_tree.py) and by the alias table alone. `sample` of the prioritized
+# buffer is measured with both priority sampling modes, the difference is the tree descent, the rest (gathering the
+# batch, weights) is shared. The alias table is built again after the given fraction of the priorities changed, the
+# build latency is in milliseconds.
+
+# +
+results = []
+rng = default_rng(0)
+for buffer_size in BUFFER_SIZES:
+    priorities = rng.random(buffer_size)
+    sum_tree = SumSegmentTree(buffer_size)
+    for i, priority in enumerate(priorities):
+        sum_tree[i] = priority
+    total = sum_tree.sum()
+    alias_table = AliasTable(priorities)
+    row = {
+        "BUFFER SIZE": buffer_size,
+        "SumSegmentTree INDICES [us]": measure_latency(
+            lambda: [sum_tree.find_prefixsum_idx(bound) for bound in rng.random(BATCH_SIZE) * total], n_repeats=50
+        ),
+        "AliasTable INDICES [us]": measure_latency(lambda: alias_table.sample(rng, BATCH_SIZE)),
+    }
+    for priority_sampling in PRIORITY_SAMPLING_MODES:
+        memory = PrioritizedReplayBuffer(
+            state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size, batch_size=BATCH_SIZE,
+            n_actions=N_ACTIONS, alpha=ALPHA, seed=0, priority_sampling=priority_sampling
+        )
+        memory.add_batch(zeros((buffer_size, STATE_DIM)), arange(buffer_size) % N_ACTIONS, zeros(buffer_size),
+                         zeros((buffer_size, STATE_DIM)), full(buffer_size, False))
+        memory.update_priorities(arange(buffer_size), priorities)
+        row[f"SAMPLE {priority_sampling} [us]"] = measure_latency(lambda: memory.sample(BETA))
+    row["ALIAS BUILD [ms]"] = measure_latency(lambda: AliasTable(priorities), n_repeats=5) / 1e3
+    results.append(row)
+
+DataFrame(results).set_index("BUFFER SIZE")
+# -
+
+# <a name="2-8"></a>
+# ## K-ary Priority Tree
+# [ToC](#ToC)
+#
+# Latency in microseconds of the operations of the priority trees with different branching - 2 is the binary
+# PriorityTreeNumpy, more is KaryPriorityTreeNumpy (`tree_branching` of PrioritizedReplayBuffer). The batch of
+# BATCH SIZE prefix sums descends the tree level by level, so fewer levels mean fewer steps, each over a contiguous
+# block of children. Setting one leaf recomputes its ancestors from their blocks, one level per step.
+
+# +
+results = []
+rng = default_rng(0)
+for capacity in TREE_CAPACITIES:
+    for branching in BRANCHINGS:
+        tree = PriorityTreeNumpy(capacity) if branching == 2 else KaryPriorityTreeNumpy(capacity, branching=branching)
+        tree.update_range(0, rng.random(capacity))
+        prefixsums = rng.random(BATCH_SIZE) * tree.sum()
+        indices = rng.integers(0, capacity, size=BATCH_SIZE)
+        priorities = rng.random(BATCH_SIZE)
+        results.append({
+            "CAPACITY": capacity,
+            "BRANCHING": branching,
+            "FIND PREFIXSUM IDX BATCH [us]": measure_latency(lambda: tree.find_prefixsum_idx_batch(prefixsums)),
+            "UPDATE BATCH [us]": measure_latency(lambda: tree.update_batch(indices, priorities)),
+            "SET [us]": measure_latency(lambda: tree.__setitem__(capacity // 3, 0.5)),
+            "SUM [us]": measure_latency(lambda: tree.sum(0, capacity - 1)),
+        })
+
+DataFrame(results).set_index(["CAPACITY", "BRANCHING"])
+# -
+
+# <a name="3"></a>
+# # Final Timestamp
+# [ToC](#ToC)
+
+Logger().end_timer()
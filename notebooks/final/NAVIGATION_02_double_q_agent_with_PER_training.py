@@ -31,6 +31,7 @@
 #     - [Creating Environment](#2-2)    
 #     - [Training Agent](#2-3)
 #     - [Plotting Results](#2-4)
+#     - [Comparison of Prioritizations](#2-5)
 # - [Final Timestamp](#3)  
 
 # <a name="0"></a>
@@ -100,7 +101,7 @@ if ADDAPT_WIDTH:
 import gym
 from collections import deque
 from numpy import mean
-from typing import List
+from typing import List, Dict, Tuple
 
 from importlib import reload
 
@@ -114,7 +115,8 @@ from IPython.display import clear_output
 # Code, libraries, classes, functions from within the repository.
 
 # +
-from src.data.replay_buffer import ReplayBuffer
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from src.data.rank_based_replay_buffer import RankBasedPrioritizedReplayBuffer
 from src.models.torch_networks import QNetwork, QNetworkDropout, DuelingQNetwork, DuelingQNetworkDropout
 from src.models.agents import DQNAgent, DQNAgentPER
 
@@ -151,6 +153,7 @@ HARD_UPDATE_EVERY_STEPS = 4
 
 ALPHA = 0.2
 BETA_START = 0.6
+PRIORITIZATION = "proportional" # "proportional", "rank"
 # -
 
 # #### Notebook Specific Constants
@@ -165,6 +168,9 @@ BATCH_SIZE = 64
 
 EPS_START = 1.0
 EPS_END = 0.01
+
+COMPARISON_N_EPISODES = 1000
+COMPARISON_PRIORITIZATIONS = {"proportional": PrioritizedReplayBuffer, "rank": RankBasedPrioritizedReplayBuffer}
 # -
 
 2**14
@@ -192,6 +198,49 @@ def plot(x_data: List[int], y_data: List[float], plot_title: str, y_label: str)
     plt.show()
 
 
+def plot_comparison(x_data: List[int], y_data: Dict[str, List[float]], plot_title: str, y_label: str) -> None:
+    """
+    Creats plot with one line for each label.
+    """
+    plt.figure(figsize=(15, 6), dpi=80)
+    plt.title(plot_title)
+    plt.xlabel("Episode Number")
+    plt.ylabel(y_label)
+    for label, y_values in y_data.items():
+        plt.plot(x_data[:len(y_values)], y_values, linewidth=2, label=label)
+    plt.legend()
+    plt.show()
+
+
+def train_agent(agent: DQNAgentPER, n_episodes: int) -> Tuple[List[int], List[float]]:
+    """
+    Trains the agent with the decays of the notebook's constants, without stopping when the environment is solved.
+    Returns the episode numbers and the average scores from the last 100 episodes at them.
+    """
+    episodes_indices, avg_scores = [], []
+    scores_window = deque(maxlen=100)
+    eps = EPS_START
+    beta = BETA_START
+    for episode in range(1, n_episodes+1):
+        state, _ = env.reset()
+        score = 0
+        for step in range(max_steps_in_episode):
+            action = agent.act(state, eps)
+            next_state, reward, done = agent.step(action)
+            agent.learn(beta)
+            state = next_state
+            score = score + reward
+            if done:
+                break
+        scores_window.append(score)
+        eps = max(EPS_END, EPS_DECAY * eps)
+        beta = BETA_START + min(episode / n_episodes, 1.0) * (1.0 - BETA_START)
+        if episode % (n_episodes / 100) == 0:
+            episodes_indices.append(episode)
+            avg_scores.append(mean(scores_window))
+    return episodes_indices, avg_scores
+
+
 # <a name="2-2"></a>
 # ## Creating Environment
 # [ToC](#ToC)  
@@ -213,9 +262,15 @@ if NETWORK == "DUEL-Q":
         net = DuelingQNetworkDropout
     else:
         net = DuelingQNetwork
+replay_buffer_class = None
+if PRIORITIZATION == "proportional":
+    replay_buffer_class = PrioritizedReplayBuffer
+if PRIORITIZATION == "rank":
+    replay_buffer_class = RankBasedPrioritizedReplayBuffer
 
 # +
-agent = DQNAgentPER(env, ACTIONS_DIM, MEMORY_SIZE, BATCH_SIZE, net, GAMMA, ALPHA)
+agent = DQNAgentPER(env, ACTIONS_DIM, MEMORY_SIZE, BATCH_SIZE, net, GAMMA, ALPHA,
+                    replay_buffer_class=replay_buffer_class)
 
 agent.set_optimizing_parameters(update_every_steps=UPDATE_EVERY_STEP, hard_update_every_steps=HARD_UPDATE_EVERY_STEPS, tau=0.001)
 
@@ -296,6 +351,31 @@ plot_title = "Beta Value Evolution"
 y_label = "Beta Value"
 plot(episodes_indices, betas, plot_title, y_label)
 
+# <a name="2-5"></a>
+# ## Comparison of Prioritizations
+# [ToC](#ToC)  
+#
+# Learning curves of the proportional (PrioritizedReplayBuffer) and the rank-based (RankBasedPrioritizedReplayBuffer)
+# prioritization. Both agents are trained for COMPARISON N EPISODES with the same network and the same settings, the
+# training does not stop when the environment is solved, so the curves have the same length.
+
+# +
+comparison_avg_scores = {}
+for prioritization, comparison_buffer_class in COMPARISON_PRIORITIZATIONS.items():
+    comparison_agent = DQNAgentPER(env, ACTIONS_DIM, MEMORY_SIZE, BATCH_SIZE, net, GAMMA, ALPHA,
+                                   replay_buffer_class=comparison_buffer_class)
+    comparison_agent.set_optimizing_parameters(update_every_steps=UPDATE_EVERY_STEP,
+                                               hard_update_every_steps=HARD_UPDATE_EVERY_STEPS, tau=0.001)
+    timer.start()
+    comparison_episodes, comparison_avg_scores[prioritization] = train_agent(comparison_agent, COMPARISON_N_EPISODES)
+    print(f"## Prioritization: {prioritization}, Average Score: {comparison_avg_scores[prioritization][-1]}")
+    timer.end(prioritization)
+
+plot_title = "Average Reward from Last 100 Episodes - Proportional vs Rank-Based Prioritization"
+y_label = "Average Reward from Last 100 Episodes"
+plot_comparison(comparison_episodes, comparison_avg_scores, plot_title, y_label)
+# -
+
 # <a name="3"></a>
 # # Final Timestamp
 # [ToC](#ToC)  
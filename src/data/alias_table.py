@@ -0,0 +1,82 @@
+"""
+Alias table
+
+Walker's alias method (https://en.wikipedia.org/wiki/Alias_method) for sampling from a fixed discrete distribution in
+O(1) per sample. The distribution of n elements is split into n columns of the same mass, column i keeps the cutoff -
+the part of the column belonging to the element i - and the alias of the element filling the rest of it.
+
+The table is built by vectorized numpy in O(n log n), without the per-element loop of Vose's algorithm. The large
+columns (mass above the average) donate their surplus to the small ones in a fixed order. A large column is exhausted
+by the small column crossing the cumulative sum of the surpluses, then it becomes small itself and it is filled by the
+next large column. Donor of every column is therefore found by one searchsorted on the cumulative sums.
+
+Comparison with the tree sampling of PrioritizedReplayBuffer can be found in
+notebooks/documentation/replay_buffer_benchmark_documentation.py.
+"""
+from typing import Any
+
+from numpy import ndarray, dtype, asarray, float64, int64, ones, arange, flatnonzero, cumsum, searchsorted, minimum, \
+    where, bincount, concatenate
+from numpy.random import Generator
+
+from src.exceptions.development_exception import NoProperOptionInIf
+
+
+class AliasTable:
+    """
+    Alias table of the distribution proportional to the weights. The table is immutable, changed weights need a new
+    table.
+    """
+
+    def __init__(self, weights: ndarray[Any, dtype[Any]]) -> None:
+        """
+        :param weights: ndarray[Any, dtype[Any]]. Non-negative weights of the elements, at least one positive.
+        """
+        weights = asarray(weights, dtype=float64).reshape(-1)
+        total = weights.sum()
+        if not total > 0:
+            raise NoProperOptionInIf("Alias table needs at least one positive weight.")
+        self._size = weights.size
+        # columns of mass 1
+        scaled = weights * (self._size / total)
+        self._cutoffs = ones(self._size, dtype=float64)
+        self._aliases = arange(self._size, dtype=int64)
+
+        small = flatnonzero(scaled < 1.)
+        large = flatnonzero(scaled >= 1.)
+        # without large columns all the columns are full up to the rounding
+        if small.size == 0 or large.size == 0:
+            return
+        deficits_end = cumsum(1. - scaled[small])
+        surpluses_end = cumsum(scaled[large] - 1.)
+        # small column is filled by the first large column not exhausted before it, its start is the end of the
+        # previous small column (the very same float), so the ties agree with the exhausting columns below
+        deficits_start = concatenate(([0.], deficits_end[:-1]))
+        donors = minimum(searchsorted(surpluses_end, deficits_start, side="left"), large.size - 1)
+        self._cutoffs[small] = scaled[small]
+        self._aliases[small] = large[donors]
+        # large column is exhausted by the first small column crossing its cumulative surplus, the last one is not
+        # (up to the rounding) and keeps the whole column
+        exhausting = searchsorted(deficits_end, surpluses_end[:-1], side="right")
+        exhausted = flatnonzero(exhausting < small.size)
+        self._cutoffs[large[exhausted]] = \
+            (1. - (deficits_end[exhausting[exhausted]] - surpluses_end[exhausted])).clip(0., 1.)
+        self._aliases[large[exhausted]] = large[exhausted + 1]
+
+    def sample(self, rng: Generator, size: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Samples the elements, one uniform number gives both the column and the position in it.
+        :param rng: Generator. Random generator.
+        :param size: int. Number of the samples.
+        :return: ndarray[Any, dtype[Any]]. (size,) array of the elements.
+        """
+        positions = rng.random(size) * self._size
+        columns = minimum(positions.astype(int64), self._size - 1)
+        return where(positions - columns < self._cutoffs[columns], columns, self._aliases[columns])
+
+    def get_probabilities(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the probabilities of the elements given by the table.
+        :return: ndarray[Any, dtype[Any]]. (n,) array.
+        """
+        return (self._cutoffs + bincount(self._aliases, weights=1. - self._cutoffs, minlength=self._size)) / self._size
@@ -0,0 +1,211 @@
+"""
+Observation codec.
+
+Encoding of the observations stored by the replay buffers from src/data/replay_buffer.py. Large observations (e.g.
+Atari frames) are stored compactly and decoded only for the sampled batch:
+- uint8 storage - pixels are stored as they are, other observations are quantized linearly from [low, high] to 256
+  levels (8 times less memory than float64),
+- float16 storage - lossy cast (4 times less memory than float64),
+- per-chunk lossless compression - chunk_size consecutive slots are compressed together with zlib, which exploits the
+  redundancy of the neighbouring frames. Only the chunk being written is kept uncompressed, the sampled rows are
+  decompressed chunk by chunk.
+"""
+from typing import Any, List, Optional, Tuple
+from zlib import compress, decompress
+
+from numpy import ndarray, dtype, zeros, empty, asarray, rint, iinfo, issubdtype, integer, uint8, int64, float64, \
+    unique, frombuffer, concatenate, cumsum
+
+from src.exceptions.development_exception import NoProperOptionInIf
+
+
+class ObservationCodec:
+    """
+    Element-wise encoding of the observations into the storage data type, optionally with the compressed storage.
+    Decoded value is stored * scale + offset.
+    """
+
+    def __init__(self, storage_type: Any = float64, low: float = 0., high: Optional[float] = None, \
+                 chunk_size: Optional[int] = None, compression_level: int = 1) -> None:
+        """
+        :param storage_type: Any. Data type of the storage, e.g. uint8 or float16.
+        :param low: float. Lowest observation value of the quantization, used only if high is not None.
+        :param high: Optional[float]. If None, the observations are cast to the storage type. Otherwise, they are
+                     quantized linearly from [low, high] to all the values of the integer storage type.
+        :param chunk_size: Optional[int]. If None, the storage is not compressed. Otherwise, the number of the
+                           consecutive slots compressed together.
+        :param compression_level: int. Zlib compression level, from 1 (fastest) to 9 (smallest).
+        """
+        self.storage_type = storage_type
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        self._quantized = high is not None
+        self.scale = 1.
+        self.offset = 0.
+        if high is not None:
+            if not issubdtype(storage_type, integer) or high <= low:
+                raise NoProperOptionInIf(f"Quantization to {storage_type} from [{low}, {high}] is not possible.")
+            self._max_level = iinfo(storage_type).max
+            self.scale = (high - low) / self._max_level
+            self.offset = low
+        if chunk_size is not None and chunk_size < 1:
+            raise NoProperOptionInIf(f"Chunk size {chunk_size} is not positive.")
+
+    def is_identity(self, data_type: Any) -> bool:
+        """
+        Says if the stored observations are the decoded ones in the data type.
+        :param data_type: Any. Data type of the decoded observations.
+        :return: bool.
+        """
+        return not self._quantized and dtype(self.storage_type) == dtype(data_type)
+
+    def is_compressed(self) -> bool:
+        """
+        Says if the storage is compressed.
+        :return: bool.
+        """
+        return self.chunk_size is not None
+
+    def encode(self, observations: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Encodes the observations into the storage data type.
+        :param observations: Any. Array of the observations (any shape).
+        :return: ndarray[Any, dtype[Any]].
+        """
+        if not self._quantized:
+            return asarray(observations, dtype=self.storage_type)
+        levels = rint((asarray(observations, dtype=float64) - self.offset) / self.scale)
+        return levels.clip(0, self._max_level).astype(self.storage_type)
+
+    def decode(self, stored: ndarray[Any, dtype[Any]], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Decodes the stored observations.
+        :param stored: ndarray[Any, dtype[Any]]. Encoded observations (any shape).
+        :param data_type: Any. Data type of the decoded observations.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        observations = stored.astype(data_type, copy=False)
+        if self._quantized:
+            observations *= self.scale
+            observations += self.offset
+        return observations
+
+
+class CompressedObservationStorage:
+    """
+    Circular storage of the encoded observations compressed by chunks of the consecutive slots. It is written
+    sequentially (as the buffer's pointer moves), the chunk being written is kept uncompressed and compressed when the
+    writing moves to another chunk.
+    """
+
+    def __init__(self, buffer_size: int, state_dim: int, codec: ObservationCodec) -> None:
+        """
+        :param buffer_size: int. Number of the slots.
+        :param state_dim: int. Dimension of the observations.
+        :param codec: ObservationCodec. Codec with chunk_size.
+        """
+        self.shape = (buffer_size, state_dim)
+        self._storage_type = codec.storage_type
+        self._chunk_size = int(codec.chunk_size)  # type:ignore
+        self._compression_level = codec.compression_level
+        n_chunks = -(-buffer_size // self._chunk_size)
+        self._chunks: List[bytes] = [b""] * n_chunks
+        self._open_chunk = -1
+        self._open_rows = zeros((self._chunk_size, state_dim), dtype=self._storage_type)
+
+    def _get_chunk_length(self, chunk: int) -> int:
+        """
+        Gets the number of the slots of the chunk, the last one can be shorter.
+        :param chunk: int.
+        :return: int.
+        """
+        return min(self._chunk_size, self.shape[0] - chunk * self._chunk_size)
+
+    def _decompress(self, chunk: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Decompresses the chunk, zeros if it was never written.
+        :param chunk: int.
+        :return: ndarray[Any, dtype[Any]]. (chunk_size, state_dim) array.
+        """
+        if chunk == self._open_chunk:
+            return self._open_rows
+        if not self._chunks[chunk]:
+            return zeros((self._chunk_size, self.shape[1]), dtype=self._storage_type)
+        rows = zeros((self._chunk_size, self.shape[1]), dtype=self._storage_type)
+        length = self._get_chunk_length(chunk)
+        rows[:length] = frombuffer(decompress(self._chunks[chunk]), dtype=self._storage_type).reshape(length, -1)
+        return rows
+
+    def _close(self) -> None:
+        """
+        Compresses the chunk being written.
+        """
+        if self._open_chunk >= 0:
+            length = self._get_chunk_length(self._open_chunk)
+            self._chunks[self._open_chunk] = compress(self._open_rows[:length].tobytes(), self._compression_level)
+            self._open_chunk = -1
+
+    def write(self, start: int, rows: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Writes the encoded rows into the consecutive slots, wrapping around the end of the storage.
+        :param start: int. Slot of the first row.
+        :param rows: ndarray[Any, dtype[Any]]. (n, state_dim) array, n is at most the number of the slots.
+        """
+        position = 0
+        while position < len(rows):
+            slot = (start + position) % self.shape[0]
+            chunk, row = divmod(slot, self._chunk_size)
+            count = min(len(rows) - position, self._get_chunk_length(chunk) - row)
+            if chunk != self._open_chunk:
+                # rows of the chunk which are not overwritten are still valid transitions
+                chunk_rows = self._decompress(chunk)
+                self._close()
+                self._open_rows[:] = chunk_rows
+                self._open_chunk = chunk
+            self._open_rows[row:row + count] = rows[position:position + count]
+            position += count
+
+    def read(self, indices: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Reads the encoded rows, every chunk touched is decompressed once.
+        :param indices: ndarray[Any, dtype[Any]]. Slots (any shape).
+        :return: ndarray[Any, dtype[Any]]. (*indices.shape, state_dim) array.
+        """
+        indices = asarray(indices)
+        flat_indices = indices.reshape(-1)
+        rows = empty((flat_indices.size, self.shape[1]), dtype=self._storage_type)
+        chunks = flat_indices // self._chunk_size
+        for chunk in unique(chunks):
+            selected = chunks == chunk
+            rows[selected] = self._decompress(int(chunk))[flat_indices[selected] - chunk * self._chunk_size]
+        return rows.reshape(indices.shape + (self.shape[1],))
+
+    def get_n_bytes(self) -> int:
+        """
+        Gets the memory used by the observations.
+        :return: int.
+        """
+        return sum(len(chunk) for chunk in self._chunks) + self._open_rows.nbytes
+
+    def get_arrays(self) -> Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]]]:
+        """
+        Gets the compressed chunks as arrays for the checkpoint, the chunk being written is compressed too.
+        :return: Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]]]. Concatenated bytes of the chunks and the
+                 end of each chunk in them.
+        """
+        chunks = list(self._chunks)
+        if self._open_chunk >= 0:
+            length = self._get_chunk_length(self._open_chunk)
+            chunks[self._open_chunk] = compress(self._open_rows[:length].tobytes(), self._compression_level)
+        data = concatenate([frombuffer(chunk, dtype=uint8) for chunk in chunks])
+        return data, cumsum([len(chunk) for chunk in chunks], dtype=int64)
+
+    def set_arrays(self, data: ndarray[Any, dtype[Any]], ends: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the compressed chunks from the checkpoint arrays.
+        :param data: ndarray[Any, dtype[Any]]. Concatenated bytes of the chunks.
+        :param ends: ndarray[Any, dtype[Any]]. End of each chunk in them.
+        """
+        starts = concatenate(([0], ends[:-1]))
+        self._chunks = [data[start:end].tobytes() for start, end in zip(starts, ends)]
+        self._open_chunk = -1
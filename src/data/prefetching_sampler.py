@@ -0,0 +1,242 @@
+"""
+Prefetching sampler.
+
+Wrapper of the replay buffers from src/data/replay_buffer.py which samples the batches in a background thread. The
+thread keeps a bounded queue of batches already converted to torch tensors on the device, so the learner takes a ready
+batch instead of waiting for the sampling, and the sampling overlaps with the environment stepping and the backprop.
+
+Consistency with the concurrent use of the buffer:
+- All the buffer's operations (adding, sampling, priority updates) are done under one lock.
+- Queued batches are at most n_batches samples old - they do not contain the newest transitions and, for the
+  prioritized buffer, they are sampled with the priorities and beta valid at the time of sampling.
+- Priority updates of the slots overwritten since the batch was sampled are dropped, because they belong to transitions
+  which are not in the buffer anymore.
+- An exception raised by the sampling in the background thread stops the thread and is raised again by the next
+  sample, so the learner does not wait for a batch which never comes.
+"""
+from queue import Queue, Full
+from threading import Thread, Lock, Event
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from numpy import ndarray, dtype, asarray
+
+from src.data.replay_buffer import ReplayBuffer
+
+# how long the background thread waits before it tries again when the buffer is not filled enough or the queue is full
+WAITING_TIMEOUT = 0.01
+
+
+# pylint: disable=no-member
+class PrefetchingSampler:
+    """
+    Replay buffer wrapper sampling the batches in a background thread. It has the same interface as the wrapped buffer
+    (add, add_batch, sample, update_priorities, get_current_size, save, load, telemetry), but the batches are torch
+    tensors on the device. Indices of the prioritized buffer stay numpy array.
+    """
+
+    def __init__(self, replay_buffer: ReplayBuffer, n_batches: int, batch_size: int,
+                 device: Optional[torch.device] = None) -> None:
+        """
+        :param replay_buffer: ReplayBuffer. Wrapped buffer, ReplayBuffer, PrioritizedReplayBuffer (or their torch
+                              variants) or RankBasedPrioritizedReplayBuffer.
+        :param n_batches: int. Maximal number of the batches waiting in the queue.
+        :param batch_size: int. Size of the batch generated, the sampling starts when the buffer has at least this
+                           number of the transitions.
+        :param device: Optional[torch.device]. Device of the batches. If None, cuda:0 if available, otherwise cpu.
+        """
+        self._memory = replay_buffer
+        self._batch_size = batch_size
+        self._device = device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        # any buffer with the priorities returns the indices as the last item of the batch
+        self._prioritized = hasattr(replay_buffer, "update_priorities")
+
+        self._lock = Lock()
+        # prefetched batch and the number of the transitions added before it was sampled, or the exception of the thread
+        self._queue: Queue[Tuple[Any, Optional[int]]] = Queue(maxsize=n_batches)
+        self._sample_arguments: Tuple[Any, ...] = ()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        # number of the transitions added before the last returned batch was sampled
+        self._last_batch_n_added = 0
+
+    def add(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+            next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Adds the experience set.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        """
+        with self._lock:
+            self._memory.add(state, action, reward, next_state, done)
+
+    def add_batch(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Adds many experience sets at once.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        """
+        with self._lock:
+            self._memory.add_batch(states, actions, rewards, next_states, dones)
+
+    def get_current_size(self) -> int:
+        """
+        Gets the current size.
+        """
+        return self._memory.get_current_size()
+
+    def get_n_added(self) -> int:
+        """
+        Gets the total number of the experience sets stored in the wrapped buffer, see ReplayBuffer.get_n_added.
+        :return: int.
+        """
+        with self._lock:
+            return self._memory.get_n_added()
+
+    def sample(self, *sample_arguments: Any) -> Tuple[Any, ...]:
+        """
+        Takes the oldest prefetched batch. The background thread is started by the first call.
+        :param sample_arguments: Any. Arguments of the wrapped buffer's sample (beta for the prioritized buffer), used
+                                 for the batches sampled from now on.
+        :return: Tuple[Any, ...]. Batch of the wrapped buffer with tensors instead of numpy arrays.
+        """
+        self._sample_arguments = sample_arguments
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._prefetch, daemon=True)
+            self._thread.start()
+        batch, n_added = self._queue.get()
+        if isinstance(batch, Exception):
+            self.close()
+            raise batch
+        self._last_batch_n_added = n_added  # type:ignore
+        return batch  # type:ignore
+
+    def update_priorities(self, indices: ndarray[Any, dtype[Any]], priorities: ndarray[Any, dtype[Any]], \
+                          n_added: Optional[int] = None) -> None:
+        """
+        Updates the priorities of the last returned batch, except the slots overwritten since it was sampled.
+        :param indices: ndarray[Any, dtype[Any]]. Array of indices to be updated.
+        :param priorities: ndarray[Any, dtype[Any]]. (k, 1) array.
+        :param n_added: Optional[int]. Number of the stored experience sets (get_n_added) when the transitions were
+                        read, e.g. by get_transitions. If None, the one of the last returned batch.
+        """
+        indices = asarray(indices)
+        priorities = asarray(priorities).reshape(-1)
+        with self._lock:
+            fresh = self._memory.get_not_overwritten(indices, self._last_batch_n_added if n_added is None else n_added)
+            if fresh.any():
+                self._memory.update_priorities(indices[fresh], priorities[fresh])  # type:ignore
+
+    def get_transitions(self, indices: ndarray[Any, dtype[Any]]) -> Tuple[Any, ...]:
+        """
+        Gets the stored transitions in the slots, see ReplayBuffer.get_transitions.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: Tuple[Any, ...]. Transitions of the wrapped buffer with tensors instead of numpy arrays.
+        """
+        with self._lock:
+            return self._to_tensors(self._memory.get_transitions(indices), with_indices=False)
+
+    def get_telemetry_report(self) -> Dict[str, Any]:
+        """
+        Gets the telemetry of the wrapped buffer, see ReplayBuffer.get_telemetry_report.
+        :return: Dict[str, Any].
+        """
+        with self._lock:
+            return self._memory.get_telemetry_report()
+
+    def log_telemetry(self, reset: bool = True) -> None:
+        """
+        Logs the telemetry of the wrapped buffer, see ReplayBuffer.log_telemetry.
+        :param reset: bool. If True, the counters are reset after logging.
+        """
+        with self._lock:
+            self._memory.log_telemetry(reset)
+
+    def save(self, folder: str) -> None:
+        """
+        Saves the whole state of the wrapped buffer into the folder.
+        :param folder: str. Folder for the checkpoint.
+        """
+        with self._lock:
+            self._memory.save(folder)
+
+    def load(self, folder: str, mmap_mode: Optional[str] = None) -> None:
+        """
+        Loads the state of the wrapped buffer and drops the prefetched batches.
+        :param folder: str. Folder with the checkpoint.
+        :param mmap_mode: Optional[str]. See ReplayBuffer.load.
+        """
+        self.close()
+        self._memory.load(folder, mmap_mode)
+
+    def close(self) -> None:
+        """
+        Stops the background thread and drops the prefetched batches. The next sample starts it again.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def _to_tensors(self, batch: Tuple[Any, ...], with_indices: bool = True) -> Tuple[Any, ...]:
+        """
+        Copies the batch to tensors on the device. The copy is needed even on CPU, because the buffers reuse some of
+        the returned arrays (weights, tensors of the torch buffers) by their next sample. The indices of the prioritized
+        buffer stay numpy array.
+        :param batch: Tuple[Any, ...].
+        :param with_indices: bool. If the batch of the prioritized buffer ends with the indices.
+        :return: Tuple[Any, ...].
+        """
+        n_converted = len(batch) - 1 if self._prioritized and with_indices else len(batch)
+        return tuple(
+            item if item is None or position >= n_converted else
+            item.clone() if isinstance(item, torch.Tensor) else torch.tensor(item, device=self._device)
+            for position, item in enumerate(batch)
+        )
+
+    def _prefetch(self) -> None:
+        """
+        Body of the background thread. Samples the batches until stopped, waiting whenever the queue is full. The
+        exception of the sampling is queued instead of a batch and the thread ends.
+        """
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    if self._memory.get_current_size() < self._batch_size:
+                        batch = None
+                    else:
+                        batch = self._memory.sample(*self._sample_arguments)
+                        n_added = self._memory.get_n_added()
+                if batch is None:
+                    self._stop.wait(WAITING_TIMEOUT)
+                    continue
+                item: Tuple[Any, Optional[int]] = (self._to_tensors(batch), n_added)
+            except Exception as error:  # pylint: disable=broad-except
+                item = (error, None)
+            self._put(item)
+            if isinstance(item[0], Exception):
+                return
+
+    def _put(self, item: Tuple[Any, Optional[int]]) -> None:
+        """
+        Puts the item into the queue, waiting while it is full until stopped.
+        :param item: Tuple[Any, Optional[int]].
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=WAITING_TIMEOUT)
+                return
+            except Full:
+                pass
+# pylint: enable=no-member
@@ -0,0 +1,257 @@
+"""
+Rank-based replay buffer.
+
+Rank-based variant of the prioritized experience replay (https://arxiv.org/abs/1511.05952). Priority of the transition
+is 1 / rank, where rank is its position in the transitions sorted by the absolute TD errors, so the sampling is not
+sensitive to the outliers. The probabilities depend only on the ranks, so the batch_size strata of the same probability
+mass are precomputed for the buffer's size and the batch is sampled by vectorized lookups into the sorted order.
+
+The order is kept sorted incrementally - the transitions changed since the last merge (added or with updated priority)
+are removed from the order, sorted among themselves and merged back in, all vectorized. The merge runs once per
+merge_every samples, in between the order is only approximately sorted (changed transitions keep their old ranks, new
+transitions wait for the merge when the buffer is filling up).
+
+Comparison with the proportional variant can be found in
+notebooks/documentation/replay_buffer_benchmark_documentation.py.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from numpy import ndarray, dtype, zeros, ones, arange, float64, int64, cumsum, searchsorted, argsort, insert, \
+    maximum, flatnonzero, asarray, amax, concatenate, power
+
+from src.data.replay_buffer import ReplayBuffer
+
+
+# pylint: disable=too-many-instance-attributes
+class RankBasedPrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Numpy-based rank-based prioritized experience buffer. Drop-in replacement of PrioritizedReplayBuffer.
+    """
+
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 alpha: float, merge_every: int = 8, **kwargs: Any) -> None:
+        """
+        :param state_dim: int. Dimension of state space.
+        :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
+        :param buffer_size: int. Size of the buffer's memory.
+        :param batch_size: int. Size of the batch generated.
+        :param n_actions: int. Number of distinct actions.
+        :param alpha: float. Prioritisation alpha parameter, probability of the rank r is proportional to r ** -alpha.
+        :param merge_every: int. Number of the samples between the merges of the changed transitions into the order.
+        :param kwargs: Any. Other parameters of ReplayBuffer.
+        """
+        ReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions, **kwargs)
+
+        self._alpha = alpha
+        self._merge_every = merge_every
+        self._max_priority = 1.0
+        self._n_samples_since_merge = 0
+
+        # priorities of the slots, the first order_size items of order are the slots sorted by them (descending)
+        self._priorities = self._allocate("priorities", (buffer_size,), float64)
+        self._changed = self._allocate("changed", (buffer_size,), bool)
+        self._order = self._allocate("order", (buffer_size,), int64)
+        self._order_keys = self._allocate("order_keys", (buffer_size,), float64)
+        self._order_size = 0
+
+        # strata cached for the order's length
+        self._strata_size = -1
+        self._strata_starts = zeros(batch_size, dtype=int64)
+        self._strata_lengths = ones(batch_size, dtype=int64)
+        self._rank_probabilities = zeros(0, dtype=float64)
+        self._sampled_ranks = zeros(batch_size, dtype=int64)
+
+        self._weights = zeros((self._batch_size, 1), dtype=self._data_types.rewards)
+
+    def _store(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+               next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Stores one experience set at the pointer with the maximal priority.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        """
+        slot = self._pointer
+        super()._store(state, action, reward, next_state, done)
+        self._priorities[slot] = self._max_priority
+        self._changed[slot] = True
+
+    def _add_rows(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]], discounts: Optional[ndarray[Any, dtype[Any]]] = None) -> None:
+        """
+        Stores many experience sets at once with the maximal priority.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param discounts: Optional[ndarray[Any, dtype[Any]]]. (n,) array of the n-step discounts, if n-step buffer.
+        """
+        n_added = self._n_added
+        super()._add_rows(states, actions, rewards, next_states, dones, discounts)
+        slots = arange(max(n_added, self._n_added - self._buffer_size), self._n_added) % self._buffer_size
+        self._priorities[slots] = self._max_priority
+        self._changed[slots] = True
+
+    def _merge(self) -> None:
+        """
+        Merges the changed transitions into the sorted order and updates the cached strata for its length.
+        """
+        order = self._order[:self._order_size]
+        kept = ~self._changed[order]
+        changed_slots = flatnonzero(self._changed[:self._current_size])
+        changed_slots = changed_slots[argsort(-self._priorities[changed_slots], kind="stable")]
+        # keys are negated priorities, so the order is ascending for searchsorted
+        changed_keys = -self._priorities[changed_slots]
+        kept_keys = self._order_keys[:self._order_size][kept]
+        positions = searchsorted(kept_keys, changed_keys, side="right")
+        self._order_size = self._current_size
+        self._order[:self._order_size] = insert(order[kept], positions, changed_slots)
+        self._order_keys[:self._order_size] = insert(kept_keys, positions, changed_keys)
+        self._changed[:] = False
+        self._n_samples_since_merge = 0
+
+        if self._strata_size != self._order_size:
+            self._update_strata(self._order_size)
+
+    def _update_strata(self, size: int) -> None:
+        """
+        Precomputes the probabilities of the ranks and batch_size strata of the ranks with the same probability mass.
+        :param size: int. Number of the ranks.
+        """
+        rank_priorities = power(arange(1, size + 1, dtype=float64), -self._alpha)
+        cumulative_mass = cumsum(rank_priorities)
+        self._rank_probabilities = rank_priorities / cumulative_mass[-1]
+        bounds = searchsorted(cumulative_mass, cumulative_mass[-1] * arange(1, self._batch_size) / self._batch_size)
+        starts = concatenate(([0], bounds))
+        ends = concatenate((bounds, [size]))
+        # stratum has at least one rank (the buffer can be smaller than the batch)
+        self._strata_starts = starts.clip(0, size - 1)
+        self._strata_lengths = maximum(ends - self._strata_starts, 1)
+        self._strata_size = size
+
+    def _sample_indices(self, n_batches: int = 1) -> ndarray[Any, dtype[Any]]:
+        """
+        Samples one rank uniformly from each stratum and maps the ranks to the slots.
+        :param n_batches: int. Number of the batches, each one counts as one sample for the merging.
+        :return: ndarray[Any, dtype[Any]]. Array of indices.
+        """
+        if self._n_samples_since_merge >= self._merge_every or self._order_size == 0:
+            self._merge()
+        self._n_samples_since_merge += n_batches
+        self._sampled_ranks = (self._strata_starts + (self._rng.random((n_batches, self._batch_size)) *
+                                                      self._strata_lengths).astype(int64)).reshape(-1)
+        return self._order[self._sampled_ranks]
+
+    def _calculate_weights(self, beta: float) -> ndarray[Any, dtype[Any]]:
+        """
+        Calculates the weights of the sampled ranks.
+        NOTE: The weights of one batch are written into the preallocated array, which is reused by the next call.
+        :param beta: float. Beta parameter for calculation.
+        :return: ndarray[Any, dtype[Any]]. (number of the sampled ranks, 1) array of weights.
+        """
+        size = self._strata_size
+        max_weight = (self._rank_probabilities[-1] * size) ** (-beta)
+        weights = self._weights if len(self._sampled_ranks) == self._batch_size else \
+            zeros((len(self._sampled_ranks), 1), dtype=self._weights.dtype)
+        power(self._rank_probabilities[self._sampled_ranks] * size, -beta, out=weights[:, 0])
+        weights /= max_weight
+        return weights
+
+    # pylint: disable=arguments-differ
+    def sample(self, beta: float) -> Tuple[Any, ...]:  # type:ignore
+        """
+        Sample the batch from the buffer.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh, weights, indices),
+                 discounts follow actions_oh if n-step buffer.
+        """
+        start = self._start_timing()
+        indices = self._sample_indices()
+        batch = self._get_batch(indices) + (self._calculate_weights(beta), indices)
+        self._record_sample(start, indices, batch[-2])
+        return batch
+
+    def sample_many(self, n_batches: int, beta: float) -> Tuple[Any, ...]:  # type:ignore
+        """
+        Samples n_batches batches at once from the same order, see ReplayBuffer.sample_many.
+        :param n_batches: int. Number of the batches.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh, weights, indices),
+                 discounts follow actions_oh if n-step buffer, each of shape (n_batches, batch_size, ...).
+        """
+        start = self._start_timing()
+        indices = self._sample_indices(n_batches)
+        batch = self._get_batch(indices) + (self._calculate_weights(beta), indices)
+        self._record_sample(start, indices, batch[-2])
+        return self._split_batches(batch, n_batches)
+
+    # pylint: enable=arguments-differ
+
+    def update_priorities(self, indices: ndarray[Any, dtype[Any]], priorities: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Updates the priorities which the ranks are based on. The order is updated by the next merge.
+        :param indices: ndarray[Any, dtype[Any]]. Array of indices to be updated.
+        :param priorities: ndarray[Any, dtype[Any]]. (k, 1) array.
+        """
+        priorities = asarray(priorities, dtype=float64).reshape(-1)
+        self._priorities[indices] = priorities
+        self._changed[indices] = True
+        self._max_priority = max(self._max_priority, float(amax(priorities)))
+
+    def _get_priorities(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the priorities of the stored transitions, which the ranks are based on, for the telemetry.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._priorities[:self._current_size]
+
+    def _get_arrays(self) -> Dict[str, ndarray[Any, dtype[Any]]]:
+        """
+        Gets the storage arrays, the priorities and the order included, which have to be saved in the checkpoint.
+        :return: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        arrays = super()._get_arrays()
+        arrays["priorities"] = self._priorities
+        arrays["changed"] = self._changed
+        arrays["order"] = self._order
+        arrays["order_keys"] = self._order_keys
+        return arrays
+
+    def _set_arrays(self, arrays: Dict[str, ndarray[Any, dtype[Any]]]) -> None:
+        """
+        Sets the storage arrays loaded from the checkpoint.
+        :param arrays: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        super()._set_arrays(arrays)
+        self._priorities = arrays["priorities"]
+        self._changed = arrays["changed"]
+        self._order = arrays["order"]
+        self._order_keys = arrays["order_keys"]
+
+    def _get_scalars(self) -> Dict[str, Any]:
+        """
+        Gets the scalar state, which has to be saved in the checkpoint.
+        :return: Dict[str, Any].
+        """
+        scalars = super()._get_scalars()
+        scalars["max_priority"] = self._max_priority
+        scalars["order_size"] = self._order_size
+        scalars["n_samples_since_merge"] = self._n_samples_since_merge
+        return scalars
+
+    def _set_scalars(self, scalars: Dict[str, Any]) -> None:
+        """
+        Sets the scalar state loaded from the checkpoint.
+        :param scalars: Dict[str, Any].
+        """
+        super()._set_scalars(scalars)
+        self._max_priority = scalars["max_priority"]
+        self._order_size = scalars["order_size"]
+        self._n_samples_since_merge = scalars["n_samples_since_merge"]
+        if self._order_size:
+            self._update_strata(self._order_size)
+# pylint: enable=too-many-instance-attributes
@@ -1,13 +1,62 @@
 """
 Replay buffer.
 """
-from typing import Any, Tuple, List, Optional
+from json import dump, load
+from os import makedirs
+from os.path import join
+from time import perf_counter_ns
+from typing import Any, Tuple, Optional, NamedTuple, Dict, Union
 
-from numpy import zeros, ndarray, dtype, array
-from numpy.random import choice, uniform
+from numpy import zeros, ndarray, dtype, array, arange, minimum, power, asarray, amax, float64, \
+    array_equal, flatnonzero, memmap, save, load as load_array, fromiter, int64, stack, full, \
+    where, maximum, broadcast_to, log, errstate, argsort, tile
+from numpy.lib.stride_tricks import as_strided
+from numpy.random import default_rng, Generator, randint
 from sklearn.preprocessing import OneHotEncoder
 
-from src.external.segment_tree import SumSegmentTree, MinSegmentTree
+from src.exceptions.data_exception import MismatchedDimension
+from src.exceptions.development_exception import NoProperOptionInIf
+from src.data.segment_tree import PriorityTreeNumpy, KaryPriorityTreeNumpy, MinSegmentTreeNumpy
+from src.data.alias_table import AliasTable
+from src.data.observation_codec import ObservationCodec, CompressedObservationStorage
+from src.data.replay_buffer_telemetry import ReplayBufferTelemetry, log_report
+
+# uniform sampling modes of the replay buffer
+SAMPLING_REPLACEMENT = "replacement"  # with replacement, O(batch size)
+SAMPLING_REJECTION = "rejection"  # rejection-based without replacement, O(batch size) for buffer >> batch
+SAMPLING_MODES = [SAMPLING_REPLACEMENT, SAMPLING_REJECTION]
+PRIORITY_SAMPLING_TREE = "tree"  # stratified descent of the priority tree, O(batch size * log(buffer size))
+PRIORITY_SAMPLING_ALIAS = "alias"  # alias table of the priorities, O(batch size), rebuilt after enough changes
+PRIORITY_SAMPLING_MODES = [PRIORITY_SAMPLING_TREE, PRIORITY_SAMPLING_ALIAS]
+DEFAULT_ALIAS_REBUILD_FRACTION = 0.05
+
+# eviction policies of the full prioritized buffer
+EVICTION_FIFO = "fifo"  # the oldest transition
+EVICTION_PRIORITY = "priority"  # the lowest priority, O(log N) descent of the min aggregates of the priority tree
+EVICTION_HYBRID = "hybrid"  # the lowest priority decayed by age, O(log N) descent of a separate min tree
+EVICTION_MODES = [EVICTION_FIFO, EVICTION_PRIORITY, EVICTION_HYBRID]
+
+CHECKPOINT_STATE_FILE = "buffer_state.json"
+
+
+def create_generator(seed: Optional[int]) -> Generator:
+    """
+    Creates the random generator of a buffer. Without the seed, the generator is seeded from the global numpy random
+    state, so numpy.random.seed keeps the sampling reproducible.
+    :param seed: Optional[int]. Seed of the generator.
+    :return: Generator. Random generator.
+    """
+    return default_rng(randint(2**31 - 1) if seed is None else seed)
+
+
+class ReplayBufferDataTypes(NamedTuple):
+    """
+    Data types of the replay buffer's storage. Sampled batches are returned in the same data types.
+    """
+    states: Any = float64  # used for next states too
+    actions: Any = float64
+    rewards: Any = float64
+    dones: Any = float64
 
 
 # pylint: disable=too-many-instance-attributes
@@ -16,7 +65,12 @@ class ReplayBuffer:
     Numpy-based replay buffer.
     """
 
-    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int) -> None:
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 sampling: str = SAMPLING_REJECTION, seed: Optional[int] = None, \
+                 data_types: Optional[ReplayBufferDataTypes] = None, deduplicate_next_states: bool = False, \
+                 storage_folder: Optional[str] = None, n_step: int = 1, gamma: float = 0.99, \
+                 sequence_length: Optional[int] = None, observation_codec: Optional[ObservationCodec] = None, \
+                 telemetry: bool = False) -> None:
         """
         :param state_dim: int. Dimension of state space.
         :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
@@ -24,18 +78,95 @@ class ReplayBuffer:
         :param batch_size: int. Size of the batch generated.
         :param n_actions: int. Number of distinct actions. Used for one hot encoding equivalence for actions if
                                actions_dim equals 1.
+        :param sampling: str. Uniform sampling mode, one of SAMPLING_MODES.
+        :param seed: Optional[int]. Seed of the buffer's random generator, drawn from the numpy global random state if
+            None.
+        :param data_types: Optional[ReplayBufferDataTypes]. Data types of the storage. If None, float64 everywhere.
+        :param deduplicate_next_states: bool. If True, each observation is stored only once. Within an episode, the
+                                        next state is the state of the following slot, only terminal next states and
+                                        the next state of the newest transition are kept in a small side store.
+        :param storage_folder: Optional[str]. If None, the storage is in RAM. Otherwise, the arrays are numpy.memmap
+                               files in this folder (e.g. one of Config().get().path entries), so the buffer can be
+                               larger than RAM. The folder has to be dedicated to one buffer.
+        :param n_step: int. If larger than 1, the buffer stores n-step transitions - discounted return of the next
+                       n rewards (less if the episode ends sooner), the state n steps later for bootstrapping and its
+                       done flag. Batches then contain the discounts gamma ** n of the bootstrapped values as well.
+                       Cannot be combined with deduplicate_next_states.
+        :param gamma: float. Discount factor of the n-step returns.
+        :param sequence_length: Optional[int]. If not None, episodes are recorded and sample_sequences returns windows
+                                of this length. Cannot be combined with n-step transitions.
+        :param observation_codec: Optional[ObservationCodec]. Encoding of the stored states and next states (e.g. uint8
+                                  or float16 storage, compression), they are decoded into the data type of the states
+                                  only for the sampled batch. If None, the states are stored in their data type.
+                                  Compressed storage is kept in RAM even with storage_folder.
+        :param telemetry: bool. If True, latencies and statistics of the adding and sampling are recorded, see
+                          get_telemetry_report and src/data/replay_buffer_telemetry.py.
         """
-        self._states_buffer = zeros((buffer_size, state_dim))
-        self._actions_buffer = zeros((buffer_size, actions_dim))
-        self._rewards_buffer = zeros((buffer_size, 1))
-        self._next_states_buffer = zeros((buffer_size, state_dim))
-        self._done_buffer = zeros((buffer_size, 1))
+        if sampling not in SAMPLING_MODES:
+            raise NoProperOptionInIf(f"Sampling mode {sampling} is not one of {SAMPLING_MODES}.")
+        if n_step < 1 or (n_step > 1 and deduplicate_next_states):
+            raise NoProperOptionInIf(f"N-step {n_step} is not positive or is combined with deduplicated next states.")
+        if sequence_length is not None and (sequence_length < 1 or n_step > 1):
+            raise NoProperOptionInIf(f"Sequence length {sequence_length} is not positive or is combined with n-step.")
+
+        self._data_types = data_types or ReplayBufferDataTypes()
+        self._storage_folder = storage_folder
+        if storage_folder is not None:
+            makedirs(storage_folder, exist_ok=True)
 
         self._buffer_size = buffer_size
+        self._state_dim = state_dim
+        self._observation_codec = observation_codec or ObservationCodec(self._data_types.states)
+        self._states_buffer = self._allocate_observations("states")
+        self._actions_buffer = self._allocate("actions", (buffer_size, actions_dim), self._data_types.actions)
+        self._rewards_buffer = self._allocate("rewards", (buffer_size, 1), self._data_types.rewards)
+        self._deduplicate_next_states = deduplicate_next_states
+        self._next_states_buffer: Optional[Any] = None
+        if deduplicate_next_states:
+            # True if the next state is in the side store, not in the following slot
+            self._next_state_in_side_store = self._allocate("next_state_in_side_store", (buffer_size,), bool)
+            # encoded next states
+            self._side_next_states: Dict[int, ndarray[Any, dtype[Any]]] = {}
+            self._last_slot: Optional[int] = None
+        else:
+            self._next_states_buffer = self._allocate_observations("next_states")
+        self._done_buffer = self._allocate("dones", (buffer_size, 1), self._data_types.dones)
+
+        self._n_step = n_step
+        self._gamma = gamma
+        self._discounts_buffer: Optional[ndarray[Any, dtype[Any]]] = None
+        if n_step > 1:
+            self._discounts_buffer = self._allocate("discounts", (buffer_size, 1), self._data_types.rewards)
+            # last transitions of the running episode, not stored yet
+            self._n_step_states = zeros((n_step, state_dim), dtype=self._data_types.states)
+            self._n_step_actions = zeros((n_step, actions_dim), dtype=self._data_types.actions)
+            self._n_step_rewards = zeros(n_step, dtype=float64)
+            self._n_step_next_states = zeros((n_step, state_dim), dtype=self._data_types.states)
+            self._n_step_dones = zeros(n_step, dtype=self._data_types.dones)
+            self._n_step_pending = 0
+            # row i holds gamma ** (k - i) for the rewards k >= i, so return of each transition is one matrix product
+            exponents = arange(n_step)[None, :] - arange(n_step)[:, None]
+            self._n_step_return_weights = where(exponents >= 0, float(gamma) ** maximum(exponents, 0), 0.)
+
+        self._sequence_length = sequence_length
+        if sequence_length is not None:
+            self._episode_ids = self._allocate("episode_ids", (buffer_size,), int64)
+            self._episode_counter = 0
+            # row i are the slots of the window starting at slot i, wrapping around the end of the circular storage
+            circular_slots = arange(buffer_size + sequence_length - 1) % buffer_size
+            self._window_slots = as_strided(circular_slots, shape=(buffer_size, sequence_length),
+                                            strides=(circular_slots.itemsize, circular_slots.itemsize))
+
         self._batch_size = batch_size
+        self._n_actions = n_actions
 
         self._pointer: int = 0
         self._current_size: int = 0
+        self._n_added: int = 0  # total number of the stored experience sets, the pointer is this modulo buffer size
+
+        self._sampling = sampling
+        self._rng = create_generator(seed)
+        self._telemetry = ReplayBufferTelemetry(buffer_size) if telemetry else None
 
         self._ooh = OneHotEncoder(sparse=False)
         self._do_ooh = False
@@ -44,6 +175,29 @@ class ReplayBuffer:
             training_data: ndarray[Any, dtype[Any]] = array(list(range(n_actions))).reshape((n_actions, 1))
             self._ooh.fit(training_data)
 
+    def _allocate(self, name: str, shape: Tuple[int, ...], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Allocates zero-filled storage array, either in RAM or as a memory-mapped file in the storage folder. For the
+        memory-mapped one, the OS page cache holds the hot part and the rest lives on the disk.
+        :param name: str. Name of the array, used as file name.
+        :param shape: Tuple[int, ...]. Shape of the array.
+        :param data_type: Any. Data type of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        if self._storage_folder is None:
+            return zeros(shape, dtype=data_type)
+        return memmap(join(self._storage_folder, f"{name}.dat"), dtype=data_type, mode="w+", shape=shape)
+
+    def _allocate_observations(self, name: str) -> Any:
+        """
+        Allocates the storage of the encoded observations, compressed or array of the codec's storage type.
+        :param name: str. Name of the array, used as file name.
+        :return: Any. CompressedObservationStorage or ndarray[Any, dtype[Any]].
+        """
+        if self._observation_codec.is_compressed():
+            return CompressedObservationStorage(self._buffer_size, self._state_dim, self._observation_codec)
+        return self._allocate(name, (self._buffer_size, self._state_dim), self._observation_codec.storage_type)
+
     def add(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
             next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
         """
@@ -55,35 +209,419 @@ class ReplayBuffer:
         :param done: bool.
         :return:
         """
-        self._states_buffer[self._pointer, :] = state
+        start = self._start_timing()
+        if self._n_step > 1:
+            self._add_n_step(state, action, reward, next_state, done)
+        else:
+            self._store(state, action, reward, next_state, done)
+        if self._telemetry is not None:
+            self._telemetry.record_add(perf_counter_ns() - start)
+
+    def _store(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+               next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Stores one experience set at the pointer.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        """
+        if self._sequence_length is not None:
+            self._record_episode(state)
+        self._write_observation(self._states_buffer, state)
         self._actions_buffer[self._pointer, :] = action
         self._rewards_buffer[self._pointer, :] = reward
-        self._next_states_buffer[self._pointer, :] = next_state
+        if self._next_states_buffer is None:
+            self._add_deduplicated_next_state(next_state)
+        else:
+            self._write_observation(self._next_states_buffer, next_state)
         self._done_buffer[self._pointer, :] = done
 
         self._pointer = (self._pointer + 1) % self._buffer_size
         self._current_size = min(self._current_size + 1, self._buffer_size)
+        self._n_added += 1
+
+    def add_batch(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Adds many experience sets at once (e.g. one step of vectorized environments). Each storage array is written with
+        at most two slice copies, the second one only if the batch wraps around the end of the buffer. If the batch is
+        larger than the buffer, only its last buffer_size experience sets are kept.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        """
+        if self._n_step > 1 or self._sequence_length is not None:
+            # consecutive rows of vectorized environments belong to different episodes
+            raise NoProperOptionInIf("Batched adding is not supported by the n-step and sequence buffers.")
+        start = self._start_timing()
+        self._add_rows(states, actions, rewards, next_states, dones)
+        if self._telemetry is not None:
+            self._telemetry.record_add(perf_counter_ns() - start)
+
+    def _add_rows(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]], discounts: Optional[ndarray[Any, dtype[Any]]] = None) -> None:
+        """
+        Stores many experience sets at once, see add_batch.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param discounts: Optional[ndarray[Any, dtype[Any]]]. (n,) array of the n-step discounts, if n-step buffer.
+        """
+        n_transitions = len(states)
+        skipped = max(0, n_transitions - self._buffer_size)
+        self._pointer = (self._pointer + skipped) % self._buffer_size
+
+        self._write_observations(self._states_buffer, states, skipped)
+        self._write_rows(self._actions_buffer, actions, skipped)
+        self._write_rows(self._rewards_buffer, rewards, skipped)
+        if self._next_states_buffer is None:
+            pointer = self._pointer
+            for next_state in next_states[skipped:]:
+                self._add_deduplicated_next_state(next_state)
+                self._pointer = (self._pointer + 1) % self._buffer_size
+            self._pointer = pointer
+        else:
+            self._write_observations(self._next_states_buffer, next_states, skipped)
+        self._write_rows(self._done_buffer, dones, skipped)
+        if self._discounts_buffer is not None and discounts is not None:
+            self._write_rows(self._discounts_buffer, discounts, skipped)
+
+        self._pointer = (self._pointer + n_transitions - skipped) % self._buffer_size
+        self._current_size = min(self._current_size + n_transitions - skipped, self._buffer_size)
+        self._n_added += n_transitions
+
+    def _record_episode(self, state: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Records the episode of the experience set being added at the pointer. New episode starts after done, or
+        without it (truncation), which is recognised by the state not following the previous next state.
+        :param state: ndarray[Any, dtype[Any]].
+        """
+        if self._current_size > 0:
+            last_slot = (self._pointer - 1) % self._buffer_size
+            if self._done_buffer[last_slot, 0] or not array_equal(
+                    self._observation_codec.encode(state), self._get_next_states(array([last_slot]))[0]):
+                self._episode_counter += 1
+        self._episode_ids[self._pointer] = self._episode_counter
+
+    def _add_n_step(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+                    next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Adds the experience set to the running episode's last transitions and stores the n-step transitions which are
+        complete. The whole rest of the episode is stored when it ends - with done, or without it (truncation), which
+        is recognised by the state not following the previous next state.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        """
+        state = asarray(state, dtype=self._data_types.states)
+        if self._n_step_pending > 0 and \
+                not array_equal(state, self._n_step_next_states[self._n_step_pending - 1]):
+            self._store_n_step(self._n_step_pending)
+
+        position = self._n_step_pending
+        self._n_step_states[position] = state
+        self._n_step_actions[position] = action
+        self._n_step_rewards[position] = reward
+        self._n_step_next_states[position] = next_state
+        self._n_step_dones[position] = done
+        self._n_step_pending += 1
+
+        if done:
+            self._store_n_step(self._n_step_pending)
+        elif self._n_step_pending == self._n_step:
+            self._store_n_step(1)
+
+    def _store_n_step(self, count: int) -> None:
+        """
+        Stores the n-step transitions of the oldest pending experience sets. Returns of all of them are computed at
+        once, they all bootstrap from the newest next state.
+        :param count: int. Number of the oldest pending experience sets to store.
+        """
+        pending = self._n_step_pending
+        returns = self._n_step_return_weights[:count, :pending] @ self._n_step_rewards[:pending]
+        discounts = float(self._gamma) ** (pending - arange(count))
+        self._add_rows(
+            self._n_step_states[:count],
+            self._n_step_actions[:count],
+            returns,
+            broadcast_to(self._n_step_next_states[pending - 1], (count, self._n_step_next_states.shape[1])),
+            full(count, self._n_step_dones[pending - 1]),
+            discounts
+        )
+        for pending_array in [self._n_step_states, self._n_step_actions, self._n_step_rewards,
+                              self._n_step_next_states, self._n_step_dones]:
+            pending_array[:pending - count] = pending_array[count:pending]
+        self._n_step_pending = pending - count
+
+    def _write_rows(self, buffer: ndarray[Any, dtype[Any]], values: ndarray[Any, dtype[Any]], skipped: int) -> None:
+        """
+        Writes the rows into the storage array from the pointer on, wrapping around the end of the buffer.
+        :param buffer: ndarray[Any, dtype[Any]]. Storage array.
+        :param values: ndarray[Any, dtype[Any]]. Rows to write, one per experience set.
+        :param skipped: int. Number of the leading rows which are not written.
+        """
+        values = asarray(values).reshape(len(values), -1)[skipped:]
+        first = min(len(values), self._buffer_size - self._pointer)
+        buffer[self._pointer:self._pointer + first, :] = values[:first]
+        buffer[:len(values) - first, :] = values[first:]
+
+    def _write_observation(self, storage: Any, observation: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Encodes the observation and writes it into the storage at the pointer.
+        :param storage: Any. Storage of the observations, see _allocate_observations.
+        :param observation: ndarray[Any, dtype[Any]].
+        """
+        encoded = self._observation_codec.encode(observation)
+        if isinstance(storage, CompressedObservationStorage):
+            storage.write(self._pointer, encoded.reshape(1, -1))
+        else:
+            storage[self._pointer, :] = encoded
+
+    def _write_observations(self, storage: Any, observations: ndarray[Any, dtype[Any]], skipped: int) -> None:
+        """
+        Encodes the observations and writes them into the storage from the pointer on, see _write_rows.
+        :param storage: Any. Storage of the observations, see _allocate_observations.
+        :param observations: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param skipped: int. Number of the leading rows which are not written.
+        """
+        encoded = self._observation_codec.encode(asarray(observations).reshape(len(observations), -1)[skipped:])
+        if isinstance(storage, CompressedObservationStorage):
+            storage.write(self._pointer, encoded)
+        else:
+            self._write_rows(storage, encoded, 0)
+
+    def _read_observations(self, storage: Any, indices: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Reads the encoded observations from the storage.
+        :param storage: Any. Storage of the observations, see _allocate_observations.
+        :param indices: ndarray[Any, dtype[Any]]. Slots (any shape).
+        :return: ndarray[Any, dtype[Any]]. (*indices.shape, state_dim) array.
+        """
+        if isinstance(storage, CompressedObservationStorage):
+            return storage.read(indices)
+        return storage[indices]
+
+    def _decode(self, encoded: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Decodes the sampled observations into the data type of the states.
+        :param encoded: ndarray[Any, dtype[Any]].
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._observation_codec.decode(encoded, self._data_types.states)
 
     def sample(self) -> Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
                               ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], Optional[ndarray[Any, dtype[Any]]]]:
         """
         :return: Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
                               ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], Optional[ndarray[Any, dtype[Any]]]]:
-                 (states, actions, rewards, next_states, dons, actions_oh).
+                 (states, actions, rewards, next_states, dons, actions_oh), followed by discounts if n-step buffer.
+        """
+        start = self._start_timing()
+        indices = self._sample_uniform_indices()
+        batch = self._get_batch(indices)
+        self._record_sample(start, indices)
+        return batch
+
+    def sample_many(self, n_batches: int) -> Tuple[Any, ...]:
+        """
+        Samples n_batches batches at once, e.g. for several gradient steps per learning step. The indices of all of
+        them are drawn together and the transitions are gathered by one copy of each storage array. Each batch is
+        sampled as by sample (in the rejection mode, without replacement within the batch). The telemetry counts the
+        call as one sample.
+        :param n_batches: int. Number of the batches.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh), followed by discounts if
+                 n-step buffer, each of shape (n_batches, batch_size, ...).
+        """
+        start = self._start_timing()
+        indices = self._sample_uniform_indices(n_batches)
+        batch = self._get_batch(indices)
+        self._record_sample(start, indices)
+        return self._split_batches(batch, n_batches)
+
+    def get_transitions(self, indices: ndarray[Any, dtype[Any]]) -> Tuple[Any, ...]:
+        """
+        Gets the stored transitions in the slots, e.g. to recompute their priorities. It is not counted by the
+        telemetry.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions, smaller than get_current_size.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh), followed by discounts if
+                 n-step buffer.
+        """
+        return self._get_batch(asarray(indices))
+
+    def _split_batches(self, batch: Tuple[Any, ...], n_batches: int) -> Tuple[Any, ...]:
+        """
+        Reshapes the arrays (or tensors) gathered for many batches into (n_batches, batch_size, ...) views.
+        :param batch: Tuple[Any, ...]. Arrays with n_batches * batch_size rows, or None.
+        :param n_batches: int. Number of the batches.
+        :return: Tuple[Any, ...].
+        """
+        return tuple(
+            None if part is None else part.reshape((n_batches, self._batch_size) + tuple(part.shape[1:]))
+            for part in batch
+        )
+
+    def _start_timing(self) -> int:
+        """
+        Gets the start time of the measured operation, if the telemetry is recorded.
+        :return: int. Time in nanoseconds, 0 without the telemetry.
+        """
+        return perf_counter_ns() if self._telemetry is not None else 0
+
+    def _record_sample(self, start: int, indices: ndarray[Any, dtype[Any]], weights: Optional[Any] = None) -> None:
+        """
+        Records the sampling into the telemetry, if it is recorded.
+        :param start: int. Start time from _start_timing.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the sampled transitions.
+        :param weights: Optional[Any]. Importance sampling weights of the batch.
+        """
+        if self._telemetry is not None:
+            self._telemetry.record_sample(perf_counter_ns() - start, self._get_ages(asarray(indices)), weights)
+
+    def _get_ages(self, indices: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the ages of the transitions - the number of the transitions added after them.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        # the newest transition is in the slot before the pointer
+        return (self._pointer - 1 - indices) % self._buffer_size
+
+    def sample_sequences(self) -> Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
+                                        ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]]]:
+        """
+        Samples contiguous sequences of sequence_length transitions, starting at uniformly sampled slots. The slots are
+        taken from the strided windows over the circular storage, so nothing but the batch is copied.
+        NOTE: The steps out of the mask (after the end of the start's episode or newer than the newest transition) hold
+              arbitrary transitions and have to be ignored.
+        :return: Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
+                       ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]]]:
+                 (states, actions, rewards, next_states, dons, mask). (batch_size, sequence_length, dim) arrays and
+                 (batch_size, sequence_length) boolean mask of the steps belonging to the start's episode.
+        """
+        if self._sequence_length is None:
+            raise NoProperOptionInIf("Sequence sampling needs the buffer created with sequence_length.")
+        start = self._start_timing()
+        starts = self._sample_uniform_indices()
+        slots = self._window_slots[starts]
+        # number of transitions from the start to the newest one
+        n_available = (self._pointer - 1 - starts) % self._buffer_size + 1
+        mask = (self._episode_ids[slots] == self._episode_ids[starts, None]) & \
+               (arange(self._sequence_length)[None, :] < n_available[:, None])
+        sequences = (
+            self._decode(self._read_observations(self._states_buffer, slots)),
+            self._actions_buffer[slots],
+            self._rewards_buffer[slots],
+            self._decode(self._get_next_states(slots.reshape(-1)).reshape(slots.shape + (-1,))),
+            self._done_buffer[slots],
+            mask
+        )
+        self._record_sample(start, starts)
+        return sequences
+
+    def _add_deduplicated_next_state(self, next_state: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Stores the next state of the transition being added at the pointer (its state is already written). The next
+        state of the previous transition is dropped from the side store if it is the state being added, because then it
+        can be recovered from this slot.
+        :param next_state: ndarray[Any, dtype[Any]].
+        """
+        if self._last_slot is not None and self._next_state_in_side_store[self._last_slot] and array_equal(
+                self._side_next_states[self._last_slot],
+                self._read_observations(self._states_buffer, array([self._pointer]))[0]):
+            del self._side_next_states[self._last_slot]
+            self._next_state_in_side_store[self._last_slot] = False
+
+        self._side_next_states[self._pointer] = self._observation_codec.encode(next_state).copy()
+        self._next_state_in_side_store[self._pointer] = True
+        self._last_slot = self._pointer
+
+    def _get_next_states(self, indices: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the encoded next states of the transitions.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        if self._next_states_buffer is not None:
+            return self._read_observations(self._next_states_buffer, indices)
+        next_states = self._read_observations(self._states_buffer, (indices + 1) % self._buffer_size)
+        for position in flatnonzero(self._next_state_in_side_store[indices]):
+            next_states[position, :] = self._side_next_states[int(indices[position])]
+        return next_states
+
+    def _get_batch(self, indices: ndarray[Any, dtype[Any]]) -> Tuple[ndarray[Any, dtype[Any]], \
+            ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
+            Optional[ndarray[Any, dtype[Any]]]]:
+        """
+        Gets the transitions from the storage.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
+                              ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], Optional[ndarray[Any, dtype[Any]]]]:
+                 (states, actions, rewards, next_states, dons, actions_oh), followed by discounts if n-step buffer.
         """
-        indices = choice(self._current_size, size=self._batch_size, replace=False)
         actions = self._actions_buffer[indices, :]
         actions_ooh = None
         if self._do_ooh:
             actions_ooh = self._ooh.transform(actions)
-        return (
-            self._states_buffer[indices, :],
+        batch = (
+            self._decode(self._read_observations(self._states_buffer, indices)),
             actions,
             self._rewards_buffer[indices, :],
-            self._next_states_buffer[indices, :],
+            self._decode(self._get_next_states(indices)),
             self._done_buffer[indices, :],
             actions_ooh
         )
+        if self._discounts_buffer is not None:
+            return batch + (self._discounts_buffer[indices, :],)  # type:ignore
+        return batch
+
+    def _sample_uniform_indices(self, n_batches: int = 1) -> ndarray[Any, dtype[Any]]:
+        """
+        Samples the indices uniformly from the filled part of the buffer. Costs of the replacement and rejection modes
+        depend only on the batch size, not on the buffer size.
+        :param n_batches: int. Number of the batches, their indices are concatenated.
+        :return: ndarray[Any, dtype[Any]]. Array of indices.
+        """
+        if self._sampling == SAMPLING_REPLACEMENT:
+            return self._rng.integers(0, self._current_size, size=n_batches * self._batch_size)
+        # without replacement within each batch only, rejection is efficient only if the batch is small compared to
+        # the filled range, otherwise each batch is a prefix of a permutation of the filled range
+        if 2 * self._batch_size <= self._current_size:
+            return self._sample_rejection_indices(n_batches)
+        if self._current_size < self._batch_size:
+            raise ValueError(f"Batch of {self._batch_size} transitions without replacement cannot be sampled from "
+                             f"{self._current_size} stored ones.")
+        permutations = self._rng.permuted(tile(arange(self._current_size), (n_batches, 1)), axis=1)
+        return permutations[:, :self._batch_size].reshape(-1)
+
+    def _sample_rejection_indices(self, n_batches: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Samples the indices without replacement within each batch by redrawing the repeated ones, all the batches at
+        once. The indices are kept in the order of the drawing, the first occurrence of a repeated index stays and the
+        later ones are redrawn.
+        :param n_batches: int. Number of the batches.
+        :return: ndarray[Any, dtype[Any]]. Array of indices, the batches are concatenated.
+        """
+        indices = self._rng.integers(0, self._current_size, size=n_batches * self._batch_size)
+        # the batches are made disjoint by the offsets, so one sort finds the repeated indices of all of them
+        offsets = (arange(n_batches) * self._current_size).repeat(self._batch_size)
+        while True:
+            keys = indices + offsets
+            # stable sort puts the later occurrences of the same index after the first one
+            order = argsort(keys, kind="stable")
+            repeated = order[1:][keys[order[1:]] == keys[order[:-1]]]
+            if repeated.size == 0:
+                return indices
+            indices[repeated] = self._rng.integers(0, self._current_size, size=repeated.size)
 
     def get_current_size(self) -> int:
         """
@@ -91,6 +629,233 @@ class ReplayBuffer:
         """
         return self._current_size
 
+    def get_n_added(self) -> int:
+        """
+        Gets the total number of the experience sets stored since the creation of the buffer. The experience set number
+        t is stored in the slot t % buffer_size (unless the prioritized buffer evicts by priority).
+        :return: int.
+        """
+        return self._n_added
+
+    def get_not_overwritten(self, indices: ndarray[Any, dtype[Any]], n_added: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Says which slots still hold the experience sets they held when n_added experience sets were stored, e.g. for
+        the priority updates of a batch sampled earlier.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :param n_added: int. Value of get_n_added at the time.
+        :return: ndarray[Any, dtype[Any]]. Boolean array.
+        """
+        n_overwritten = self.get_n_added() - n_added
+        # slot of the experience set number t is t % buffer_size
+        return (asarray(indices) - n_added) % self._buffer_size >= n_overwritten
+
+    def get_observation_n_bytes(self) -> int:
+        """
+        Gets the memory used by the stored observations - states, next states and the side store of the deduplicated
+        next states.
+        :return: int.
+        """
+        n_bytes = 0
+        for storage in [self._states_buffer, self._next_states_buffer]:
+            if isinstance(storage, CompressedObservationStorage):
+                n_bytes += storage.get_n_bytes()
+            elif storage is not None:
+                n_bytes += storage.nbytes
+        if self._next_states_buffer is None:
+            n_bytes += sum(next_state.nbytes for next_state in self._side_next_states.values())
+        return n_bytes
+
+    def get_n_bytes(self) -> int:
+        """
+        Gets the memory used by the storage arrays, the observations included.
+        :return: int.
+        """
+        return self.get_observation_n_bytes() + sum(
+            storage.nbytes for name, storage in self._get_arrays().items()
+            if name not in ["states", "next_states"] and not name.startswith(("compressed_", "side_next_states"))
+        )
+
+    def get_telemetry_report(self) -> Dict[str, Any]:
+        """
+        Gets the telemetry recorded since the creation or the last reset with the current fill level, memory and
+        priorities, see src/data/replay_buffer_telemetry.py.
+        :return: Dict[str, Any].
+        """
+        if self._telemetry is None:
+            raise NoProperOptionInIf("Telemetry needs the buffer created with telemetry=True.")
+        return {
+            **self._telemetry.get_report(),
+            "size": self.get_current_size(),
+            "fill_level": self.get_current_size() / self._buffer_size,
+            "memory_bytes": self.get_n_bytes(),
+            **self._telemetry.get_priority_report(self._get_priorities())
+        }
+
+    def log_telemetry(self, reset: bool = True) -> None:
+        """
+        Logs the telemetry report by the Logger.
+        :param reset: bool. If True, the counters are reset after logging, so each report covers one period.
+        """
+        log_report(self.get_telemetry_report(), type(self).__name__)
+        if reset:
+            self._telemetry.reset()  # type:ignore
+
+    def _get_priorities(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the priorities of the stored transitions for the telemetry, none for the uniform buffer.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return zeros(0)
+
+    def _get_arrays(self) -> Dict[str, ndarray[Any, dtype[Any]]]:
+        """
+        Gets the storage arrays, which have to be saved in the checkpoint.
+        :return: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        arrays = {
+            **self._get_observation_arrays("states", self._states_buffer),
+            "actions": self._actions_buffer,
+            "rewards": self._rewards_buffer,
+            "dones": self._done_buffer
+        }
+        if self._next_states_buffer is None:
+            arrays["next_state_in_side_store"] = self._next_state_in_side_store
+            arrays["side_next_states_slots"] = fromiter(self._side_next_states.keys(), dtype=int64)
+            arrays["side_next_states"] = stack(list(self._side_next_states.values())) if self._side_next_states else \
+                zeros((0, self._state_dim), dtype=self._observation_codec.storage_type)
+        else:
+            arrays.update(self._get_observation_arrays("next_states", self._next_states_buffer))
+        if self._discounts_buffer is not None:
+            arrays["discounts"] = self._discounts_buffer
+            arrays["n_step_states"] = self._n_step_states
+            arrays["n_step_actions"] = self._n_step_actions
+            arrays["n_step_rewards"] = self._n_step_rewards
+            arrays["n_step_next_states"] = self._n_step_next_states
+            arrays["n_step_dones"] = self._n_step_dones
+        if self._sequence_length is not None:
+            arrays["episode_ids"] = self._episode_ids
+        return arrays
+
+    def _set_arrays(self, arrays: Dict[str, ndarray[Any, dtype[Any]]]) -> None:
+        """
+        Sets the storage arrays loaded from the checkpoint.
+        :param arrays: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        self._states_buffer = self._set_observation_arrays("states", self._states_buffer, arrays)
+        self._actions_buffer = arrays["actions"]
+        self._rewards_buffer = arrays["rewards"]
+        self._done_buffer = arrays["dones"]
+        if self._next_states_buffer is None:
+            self._next_state_in_side_store = arrays["next_state_in_side_store"]
+            self._side_next_states = {
+                int(slot): array(next_state)
+                for slot, next_state in zip(arrays["side_next_states_slots"], arrays["side_next_states"])
+            }
+        else:
+            self._next_states_buffer = self._set_observation_arrays("next_states", self._next_states_buffer, arrays)
+        if self._discounts_buffer is not None:
+            self._discounts_buffer = arrays["discounts"]
+            self._n_step_states = arrays["n_step_states"]
+            self._n_step_actions = arrays["n_step_actions"]
+            self._n_step_rewards = arrays["n_step_rewards"]
+            self._n_step_next_states = arrays["n_step_next_states"]
+            self._n_step_dones = arrays["n_step_dones"]
+        if self._sequence_length is not None:
+            self._episode_ids = arrays["episode_ids"]
+
+    @staticmethod
+    def _get_observation_arrays(name: str, storage: Any) -> Dict[str, ndarray[Any, dtype[Any]]]:
+        """
+        Gets the arrays of the observation storage for the checkpoint.
+        :param name: str. Name of the storage.
+        :param storage: Any. Storage of the observations, see _allocate_observations.
+        :return: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        if isinstance(storage, CompressedObservationStorage):
+            data, ends = storage.get_arrays()
+            return {f"compressed_{name}": data, f"compressed_{name}_ends": ends}
+        return {name: storage}
+
+    @staticmethod
+    def _set_observation_arrays(name: str, storage: Any, arrays: Dict[str, ndarray[Any, dtype[Any]]]) -> Any:
+        """
+        Sets the observation storage from the checkpoint arrays.
+        :param name: str. Name of the storage.
+        :param storage: Any. Storage of the observations, see _allocate_observations.
+        :param arrays: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        :return: Any. Storage of the observations.
+        """
+        if isinstance(storage, CompressedObservationStorage):
+            storage.set_arrays(arrays[f"compressed_{name}"], arrays[f"compressed_{name}_ends"])
+            return storage
+        return arrays[name]
+
+    def _get_scalars(self) -> Dict[str, Any]:
+        """
+        Gets the scalar state, which has to be saved in the checkpoint.
+        :return: Dict[str, Any].
+        """
+        scalars = {
+            "pointer": self._pointer,
+            "current_size": self._current_size,
+            "n_added": self._n_added,
+            "rng_state": self._rng.bit_generator.state
+        }
+        if self._next_states_buffer is None:
+            scalars["last_slot"] = self._last_slot
+        if self._n_step > 1:
+            scalars["n_step_pending"] = self._n_step_pending
+        if self._sequence_length is not None:
+            scalars["episode_counter"] = self._episode_counter
+        return scalars
+
+    def _set_scalars(self, scalars: Dict[str, Any]) -> None:
+        """
+        Sets the scalar state loaded from the checkpoint.
+        :param scalars: Dict[str, Any].
+        """
+        self._pointer = scalars["pointer"]
+        self._current_size = scalars["current_size"]
+        self._n_added = scalars["n_added"]
+        self._rng.bit_generator.state = scalars["rng_state"]
+        if self._next_states_buffer is None:
+            self._last_slot = scalars["last_slot"]
+        if self._n_step > 1:
+            self._n_step_pending = scalars["n_step_pending"]
+        if self._sequence_length is not None:
+            self._episode_counter = scalars["episode_counter"]
+
+    def save(self, folder: str) -> None:
+        """
+        Saves the whole state of the buffer into the folder. Each array is written as raw uncompressed .npy file, so it
+        can be loaded back memory-mapped.
+        :param folder: str. Folder for the checkpoint.
+        """
+        makedirs(folder, exist_ok=True)
+        for name, storage_array in self._get_arrays().items():
+            save(join(folder, f"{name}.npy"), storage_array)
+        with open(join(folder, CHECKPOINT_STATE_FILE), "w", encoding="utf-8") as file:
+            dump(self._get_scalars(), file)
+
+    def load(self, folder: str, mmap_mode: Optional[str] = None) -> None:
+        """
+        Loads the state of the buffer saved by save method. The buffer has to be created with the same parameters.
+        :param folder: str. Folder with the checkpoint.
+        :param mmap_mode: Optional[str]. If None, arrays are read into RAM. Otherwise, they are memory-mapped from the
+                          checkpoint files, so even a large buffer is restored in seconds. "r+" - changes are written
+                          into the checkpoint files, "c" - copy-on-write, checkpoint files stay untouched.
+        """
+        arrays = {}
+        for name, storage_array in self._get_arrays().items():
+            arrays[name] = load_array(join(folder, f"{name}.npy"), mmap_mode=mmap_mode)
+            # side store and compressed observations have variable size
+            if arrays[name].dtype != storage_array.dtype or (arrays[name].shape != storage_array.shape and
+                                                             not name.startswith(("side_next_states", "compressed_"))):
+                raise MismatchedDimension(f"Array {name} in the checkpoint does not match the buffer.")
+        self._set_arrays(arrays)
+        with open(join(folder, CHECKPOINT_STATE_FILE), "r", encoding="utf-8") as file:
+            self._set_scalars(load(file))
+
 
 # pylint: enable=too-many-instance-attributes
 
@@ -104,7 +869,13 @@ class PrioritizedReplayBuffer(ReplayBuffer):
     """
 
     def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
-                 alpha: float) -> None:
+                 alpha: float, seed: Optional[int] = None, data_types: Optional[ReplayBufferDataTypes] = None, \
+                 deduplicate_next_states: bool = False, storage_folder: Optional[str] = None, n_step: int = 1, \
+                 gamma: float = 0.99, sequence_length: Optional[int] = None, \
+                 observation_codec: Optional[ObservationCodec] = None, telemetry: bool = False, \
+                 eviction: str = EVICTION_FIFO, eviction_half_life: Optional[int] = None, \
+                 priority_sampling: str = PRIORITY_SAMPLING_TREE, \
+                 alias_rebuild_fraction: float = DEFAULT_ALIAS_REBUILD_FRACTION, tree_branching: int = 2) -> None:
         """
         :param state_dim: int. Dimension of state space.
         :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
@@ -113,8 +884,51 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         :param n_actions: int. Number of distinct actions. Used for one hot encoding equivalence for actions if
                                actions_dim equals 1.
         :param alpha: float. Prioritisation alpha parameter.
+        :param seed: Optional[int]. Seed of the buffer's random generator, drawn from the numpy global random state if
+            None.
+        :param data_types: Optional[ReplayBufferDataTypes]. Data types of the storage. If None, float64 everywhere.
+                           Weights are returned in the data type of the rewards.
+        :param deduplicate_next_states: bool. If True, each observation is stored only once.
+        :param storage_folder: Optional[str]. If None, the storage is in RAM. Otherwise, the arrays (the priority tree
+                               included) are numpy.memmap files in this folder.
+        :param n_step: int. If larger than 1, the buffer stores n-step transitions (see ReplayBuffer).
+        :param gamma: float. Discount factor of the n-step returns.
+        :param sequence_length: Optional[int]. If not None, sample_sequences returns windows of this length (uniformly
+                                sampled, without priorities).
+        :param observation_codec: Optional[ObservationCodec]. Encoding of the stored states (see ReplayBuffer).
+        :param telemetry: bool. If True, the telemetry is recorded (see ReplayBuffer).
+        :param eviction: str. Transition overwritten by the full buffer, one of EVICTION_MODES:
+                         - fifo - the oldest one,
+                         - priority - the one with the lowest priority,
+                         - hybrid - the one with the lowest priority ** alpha * 0.5 ** (age / eviction_half_life),
+                           so the old transitions need higher priorities to stay.
+                         The priority modes cannot be combined with deduplicated next states and sequences, which
+                         rely on the order of the slots.
+        :param eviction_half_life: Optional[int]. Age (number of the transitions added since) halving the priority of
+                                   the hybrid eviction. If None, buffer size.
+        :param priority_sampling: str. Sampling of the batch, one of PRIORITY_SAMPLING_MODES:
+                                  - tree - stratified descent of the priority tree, always exact,
+                                  - alias - alias table of the stored priorities, for nearly static priorities
+                                    (evaluation, offline replay). The table is rebuilt when the next batch is sampled
+                                    after alias_rebuild_fraction of the stored transitions were changed (added or
+                                    updated), until then the batches and the weights follow the old priorities and the
+                                    new transitions are not sampled.
+        :param alias_rebuild_fraction: float. Fraction of the changed transitions rebuilding the alias table, 0 rebuilds
+                                       it after every change.
+        :param tree_branching: int. Number of the children of the priority tree's nodes. 2 is the binary
+                               PriorityTreeNumpy, more is KaryPriorityTreeNumpy with fewer levels for large buffers.
         """
-        ReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions)
+        if eviction not in EVICTION_MODES:
+            raise NoProperOptionInIf(f"Eviction {eviction} is not one of {EVICTION_MODES}.")
+        if priority_sampling not in PRIORITY_SAMPLING_MODES:
+            raise NoProperOptionInIf(f"Priority sampling {priority_sampling} is not one of {PRIORITY_SAMPLING_MODES}.")
+        if eviction != EVICTION_FIFO and (deduplicate_next_states or sequence_length is not None):
+            raise NoProperOptionInIf(f"Eviction {eviction} is combined with deduplicated next states or sequences.")
+        ReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions, seed=seed,
+                              data_types=data_types, deduplicate_next_states=deduplicate_next_states,
+                              storage_folder=storage_folder, n_step=n_step, gamma=gamma,
+                              sequence_length=sequence_length, observation_codec=observation_codec,
+                              telemetry=telemetry)
 
         self._alpha = alpha
         self._tree_pointer = 0
@@ -125,104 +939,328 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         while self._tree_capacity < self._buffer_size:
             self._tree_capacity = self._tree_capacity * 2
 
-        self._sum_tree = SumSegmentTree(capacity=self._tree_capacity)
-        self._min_tree = MinSegmentTree(capacity=self._tree_capacity)
+        # one tree with both sum and min aggregates
+        self._tree_branching = tree_branching
+        nodes_shape = (2 * self._tree_capacity, 2) if tree_branching == 2 else \
+            KaryPriorityTreeNumpy.get_nodes_shape(self._tree_capacity, tree_branching)
+        self._priority_tree = self._create_priority_tree(self._allocate("priority_tree", nodes_shape, float64))
 
-    def add(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
-            next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        self._weights = zeros((self._batch_size, 1), dtype=self._data_types.rewards)
+
+        self._eviction = eviction
+        self._slot_steps: Optional[ndarray[Any, dtype[Any]]] = None
+        self._eviction_tree: Optional[MinSegmentTreeNumpy] = None
+        if eviction != EVICTION_FIFO:
+            # number of the experience set in each slot, the slots are not in the order of adding
+            self._slot_steps = self._allocate("slot_steps", (buffer_size,), int64)
+        if eviction == EVICTION_HYBRID:
+            # log(priority ** alpha) + step * log(2) / half life - the decayed priorities of all the transitions are
+            # divided by the same 2 ** (n_added / half life), so their order is given by this constant key
+            self._age_decay = log(2.) / (eviction_half_life or buffer_size)
+            self._eviction_tree = MinSegmentTreeNumpy(self._tree_capacity)
+
+        self._priority_sampling = priority_sampling
+        self._alias_rebuild_fraction = alias_rebuild_fraction
+        self._alias_table: Optional[AliasTable] = None
+        # sampling priorities the table was built from, the weights have to follow them
+        self._alias_priorities = zeros(0, dtype=float64)
+        self._alias_min_priority = 1.
+        self._n_alias_changes = 0
+
+    def _create_priority_tree(self, nodes: Optional[ndarray[Any, dtype[Any]]] = None) \
+            -> Union[PriorityTreeNumpy, KaryPriorityTreeNumpy]:
         """
-        Adds the experience set.
+        Creates the empty priority tree of the buffer's branching.
+        :param nodes: Optional[ndarray[Any, dtype[Any]]]. Preallocated array for the nodes. If None, new array.
+        :return: Union[PriorityTreeNumpy, KaryPriorityTreeNumpy].
+        """
+        if self._tree_branching == 2:
+            return PriorityTreeNumpy(capacity=self._tree_capacity, nodes=nodes)
+        return KaryPriorityTreeNumpy(capacity=self._tree_capacity, branching=self._tree_branching, nodes=nodes)
+
+    def _store(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+               next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Stores one experience set at the pointer with the maximal priority. The full buffer with the priority eviction
+        stores it into the slot of the evicted transition.
         :param state: ndarray[Any, dtype[Any]].
         :param action: ndarray[Any, dtype[Any]].
         :param reward: float.
         :param next_state: ndarray[Any, dtype[Any]].
         :param done: bool.
         """
-        super().add(state, action, reward, next_state, done)
+        if self._eviction != EVICTION_FIFO and self._current_size == self._buffer_size:
+            self._pointer = self._tree_pointer = self._find_evicted()
+        super()._store(state, action, reward, next_state, done)
 
-        self._sum_tree[self._tree_pointer] = self._max_priority ** self._alpha
-        self._min_tree[self._tree_pointer] = self._max_priority ** self._alpha
+        self._priority_tree[self._tree_pointer] = self._max_priority ** self._alpha
+        self._track_slots(array([self._tree_pointer]))
+        self._n_alias_changes += 1
         self._tree_pointer = (self._tree_pointer + 1) % self._buffer_size
 
-    def _sample_indices(self) -> List[int]:
+    def _add_rows(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]], discounts: Optional[ndarray[Any, dtype[Any]]] = None) -> None:
+        """
+        Stores many experience sets at once with the maximal priority. The full buffer with the priority eviction
+        fills the free slots first, then each experience set replaces the transition evicted for it.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param discounts: Optional[ndarray[Any, dtype[Any]]]. (n,) array of the n-step discounts, if n-step buffer.
+        """
+        n_free = self._buffer_size - self._current_size
+        if self._eviction == EVICTION_FIFO or len(states) <= n_free:
+            self._add_contiguous_rows(states, actions, rewards, next_states, dones, discounts)
+            return
+        bounds = [0, n_free] + list(range(n_free + 1, len(states) + 1))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if first >= n_free:
+                self._pointer = self._tree_pointer = self._find_evicted()
+            if last > first:
+                self._add_contiguous_rows(states[first:last], actions[first:last], rewards[first:last],
+                                          next_states[first:last], dones[first:last],
+                                          None if discounts is None else discounts[first:last])
+
+    def _add_contiguous_rows(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                             rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                             dones: ndarray[Any, dtype[Any]], discounts: Optional[ndarray[Any, dtype[Any]]] = None) \
+            -> None:
+        """
+        Stores many experience sets from the pointer on with the maximal priority. The leaves are set in the tree as (at
+        most two) contiguous ranges.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param discounts: Optional[ndarray[Any, dtype[Any]]]. (n,) array of the n-step discounts, if n-step buffer.
+        """
+        super()._add_rows(states, actions, rewards, next_states, dones, discounts)
+
+        n_transitions = len(states)
+        skipped = max(0, n_transitions - self._buffer_size)
+        self._tree_pointer = (self._tree_pointer + skipped) % self._buffer_size
+        priorities = full(n_transitions - skipped, self._max_priority ** self._alpha)
+        # contiguous leaves, split in two only if the batch wraps around the end of the buffer
+        first = min(len(priorities), self._buffer_size - self._tree_pointer)
+        self._priority_tree.update_range(self._tree_pointer, priorities[:first])
+        self._priority_tree.update_range(0, priorities[first:])
+        self._track_slots((self._tree_pointer + arange(len(priorities))) % self._buffer_size)
+        self._n_alias_changes += len(priorities)
+        self._tree_pointer = (self._tree_pointer + len(priorities)) % self._buffer_size
+
+    def _find_evicted(self) -> int:
+        """
+        Finds the slot of the transition evicted by the priority eviction, the leaves out of the buffer are infinite.
+        :return: int.
+        """
+        if self._eviction_tree is not None:
+            return self._eviction_tree.find_min_idx()
+        return self._priority_tree.find_min_idx()
+
+    def _track_slots(self, slots: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Records the newest experience sets stored into the slots for the priority eviction.
+        :param slots: ndarray[Any, dtype[Any]]. Slots in the order of adding.
+        """
+        if self._slot_steps is not None:
+            self._slot_steps[slots] = self._n_added - len(slots) + arange(len(slots))
+            self._update_eviction_keys(slots)
+
+    def _update_eviction_keys(self, slots: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the keys of the hybrid eviction from the current priorities of the slots.
+        :param slots: ndarray[Any, dtype[Any]].
+        """
+        if self._eviction_tree is not None:
+            with errstate(divide="ignore"):
+                keys = log(self._priority_tree[slots]) + self._slot_steps[slots] * self._age_decay  # type:ignore
+            self._eviction_tree.update_batch(slots, keys)
+
+    def _sample_indices(self, n_batches: int = 1) -> ndarray[Any, dtype[Any]]:
         """
         Sample the indices proportionally to the distribution of the priorities.
-        :return: List[int]. List of indices.
+
+        Stratified sampling - one upper bound is drawn from each of batch_size segments of the same mass, all the bounds
+        at once, and the tree is descended for the whole batch together.
+        :param n_batches: int. Number of the batches, each stratified separately, the tree is descended for all of them
+                          together.
+        :return: ndarray[Any, dtype[Any]]. Array of indices.
         """
-        indices = []
-        distribution_mass = self._sum_tree.sum(0, self._tree_capacity - 1) # this caused an error
-        # distribution_mass = self._sum_tree.sum(0, self._buffer_size - 1)
+        if self._priority_sampling == PRIORITY_SAMPLING_ALIAS:
+            return self._get_alias_table().sample(self._rng, n_batches * self._batch_size)
+        distribution_mass = self._priority_tree.sum(0, self._tree_capacity - 1) # this caused an error
+        # distribution_mass = self._priority_tree.sum(0, self._buffer_size - 1)
         segment_mass = distribution_mass / self._batch_size
 
-        for i in range(self._batch_size):
-            lower_segment_bound = segment_mass * i
-            upper_segment_bound = segment_mass * (i + 1)
-            upper_bound = uniform(lower_segment_bound, upper_segment_bound)
-            index = self._sum_tree.find_prefixsum_idx(upper_bound)
-            # indices.append(index) # just adding the index caused an error in a corner case
-            if index < self._buffer_size:
-                indices.append(index)
-            else:
-                indices.append(self._current_size)
+        upper_bounds = ((arange(self._batch_size) + self._rng.random((n_batches, self._batch_size))) *
+                        segment_mass).reshape(-1)
+        indices = self._priority_tree.find_prefixsum_idx_batch(upper_bounds)
+        # index out of the filled range can be found only because of the rounding in a corner case
+        return minimum(indices, self._current_size - 1)
 
-        return indices
+    def _get_alias_table(self) -> AliasTable:
+        """
+        Gets the alias table of the stored priorities, rebuilt if enough of them changed since the last build.
+        :return: AliasTable.
+        """
+        if self._alias_table is None or self._n_alias_changes > self._alias_rebuild_fraction * self._current_size:
+            self._alias_priorities = self._priority_tree[arange(self._current_size)]
+            self._alias_min_priority = float(self._alias_priorities.min())
+            self._alias_table = AliasTable(self._alias_priorities)
+            self._n_alias_changes = 0
+        return self._alias_table
 
-    def _calculate_weight(self, index: int, beta: float) -> float:
+    def _calculate_weights(self, indices: ndarray[Any, dtype[Any]], beta: float) -> ndarray[Any, dtype[Any]]:
         """
-        Calculates the weights.
-        :param index: int. Index of the experience for which it has to be calculated.
+        Calculates the weights for the whole batch. The minimum, the total and the leaf priorities are read from the
+        tree only once. The alias sampling uses the priorities of its table, which can be older than the tree.
+        NOTE: The weights of one batch are written into the preallocated array, which is reused by the next call.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the experiences for which it has to be calculated.
         :param beta: float. Beta parameter for calculation.
-        :return: float. Weight.
+        :return: ndarray[Any, dtype[Any]]. (len(indices), 1) array of weights.
         """
-        min_probability = self._min_tree.min() / self._sum_tree.sum()
+        weights = self._weights if len(indices) == self._batch_size else \
+            zeros((len(indices), 1), dtype=self._weights.dtype)
+        if self._priority_sampling == PRIORITY_SAMPLING_ALIAS:
+            # probability ratio to the least probable transition, the total mass cancels out
+            power(self._alias_priorities[indices] / self._alias_min_priority, -beta, out=weights[:, 0])
+            return weights
+
+        distribution_mass = self._priority_tree.sum()
+        min_probability = self._priority_tree.min() / distribution_mass
         max_weight = (min_probability * self._tree_capacity) ** (-beta)
 
-        experience_probability = self._sum_tree[index] / self._sum_tree.sum()
-        weight = (experience_probability * self._tree_capacity) ** (-beta)
+        experience_probabilities = self._priority_tree[indices] / distribution_mass
+        power(experience_probabilities * self._tree_capacity, -beta, out=weights[:, 0])
+        weights /= max_weight
 
-        return float(weight / max_weight)
+        return weights
 
     # pylint: disable=arguments-differ
     def sample(self, beta: float) -> Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]],  # type:ignore
                                            ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]],
-                                           Optional[ndarray[Any, dtype[Any]]], Optional[ndarray[Any, dtype[Any]]], List[
-                                               int]]:
+                                           Optional[ndarray[Any, dtype[Any]]], Optional[ndarray[Any, dtype[Any]]],
+                                           ndarray[Any, dtype[Any]]]:
         """
         Sample the batch from the buffer.
         :param beta: float. Beta parameter for calculation.
         :return: Tuple[ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], \
                               ndarray[Any, dtype[Any]], ndarray[Any, dtype[Any]], Optional[ndarray[Any, dtype[Any]]]
-                              List[int]]:
-                 (states, actions, rewards, next_states, dons, actions_oh, weights, indices).
+                              ndarray[Any, dtype[Any]]]:
+                 (states, actions, rewards, next_states, dons, actions_oh, weights, indices), discounts follow
+                 actions_oh if n-step buffer.
         """
+        start = self._start_timing()
         indices = self._sample_indices()
-        actions = self._actions_buffer[indices, :]
-        actions_ooh = None
-        if self._do_ooh:
-            actions_ooh = self._ooh.transform(actions)
-        weights: ndarray[Any, dtype[Any]] = array([self._calculate_weight(index, beta) for index in indices]).reshape(
-            (self._batch_size, 1))
-        return (
-            self._states_buffer[indices, :],
-            actions,
-            self._rewards_buffer[indices, :],
-            self._next_states_buffer[indices, :],
-            self._done_buffer[indices, :],
-            actions_ooh,
-            weights,
-            indices
-        )
+        batch = self._get_batch(indices) + (self._calculate_weights(indices, beta), indices)
+        self._record_sample(start, indices, batch[-2])
+        return batch
+
+    def sample_many(self, n_batches: int, beta: float) -> Tuple[Any, ...]:  # type:ignore
+        """
+        Samples n_batches batches at once, the tree is descended once for all of them, see ReplayBuffer.sample_many.
+        NOTE: The priorities are not updated between the batches, all of them are sampled from the same distribution.
+        :param n_batches: int. Number of the batches.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh, weights, indices),
+                 discounts follow actions_oh if n-step buffer, each of shape (n_batches, batch_size, ...).
+        """
+        start = self._start_timing()
+        indices = self._sample_indices(n_batches)
+        batch = self._get_batch(indices) + (self._calculate_weights(indices, beta), indices)
+        self._record_sample(start, indices, batch[-2])
+        return self._split_batches(batch, n_batches)
 
     # pylint: enable=arguments-differ
 
-    def update_priorities(self, indices: List[int], priorities: ndarray[Any, dtype[Any]]) -> None:
+    def update_priorities(self, indices: ndarray[Any, dtype[Any]], priorities: ndarray[Any, dtype[Any]]) -> None:
         """
-        Updates the priorities in the tree.
-        :param indices: List[int]. List of indices to be updated.
+        Updates the priorities in the tree. All the leaves are set at once and only the affected parent nodes are
+        recomputed, both sum and min in the same pass.
+        :param indices: ndarray[Any, dtype[Any]]. Array of indices to be updated.
         :param priorities: ndarray[Any, dtype[Any]]. (k, 1) array.
         """
-        for index, priority in zip(indices, priorities):
-            self._sum_tree[index] = priority ** self._alpha
-            self._min_tree[index] = priority ** self._alpha
+        priorities = asarray(priorities, dtype=float).reshape(-1)
+        self._priority_tree.update_batch(indices, priorities ** self._alpha)
+        self._update_eviction_keys(asarray(indices))
+        self._n_alias_changes += len(priorities)
+
+        self._max_priority = max(self._max_priority, float(amax(priorities)))
+
+    def _get_priorities(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the sampling priorities (priority ** alpha) of the stored transitions for the telemetry.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._priority_tree[arange(self._current_size)]
 
-            self._max_priority = max(self._max_priority, priority)
+    def _get_ages(self, indices: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the ages of the transitions, with the priority eviction from the recorded numbers of the experience sets.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        if self._slot_steps is None:
+            return super()._get_ages(indices)
+        return self._n_added - 1 - self._slot_steps[indices]
+
+    def get_not_overwritten(self, indices: ndarray[Any, dtype[Any]], n_added: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Says which slots still hold the experience sets they held when n_added experience sets were stored.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :param n_added: int. Value of get_n_added at the time.
+        :return: ndarray[Any, dtype[Any]]. Boolean array.
+        """
+        if self._slot_steps is None:
+            return super().get_not_overwritten(indices, n_added)
+        return self._slot_steps[indices] < n_added
+
+    def _get_arrays(self) -> Dict[str, ndarray[Any, dtype[Any]]]:
+        """
+        Gets the storage arrays, the priority tree included, which have to be saved in the checkpoint.
+        :return: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        arrays = super()._get_arrays()
+        arrays["priority_tree"] = self._priority_tree.get_nodes()
+        if self._slot_steps is not None:
+            arrays["slot_steps"] = self._slot_steps
+        if self._eviction_tree is not None:
+            arrays["eviction_tree"] = self._eviction_tree.get_nodes()
+        return arrays
+
+    def _set_arrays(self, arrays: Dict[str, ndarray[Any, dtype[Any]]]) -> None:
+        """
+        Sets the storage arrays, the priority tree included, loaded from the checkpoint.
+        :param arrays: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        super()._set_arrays(arrays)
+        self._priority_tree.set_nodes(arrays["priority_tree"])
+        if self._slot_steps is not None:
+            self._slot_steps = arrays["slot_steps"]
+        if self._eviction_tree is not None:
+            self._eviction_tree.get_nodes()[:] = arrays["eviction_tree"]
+        # the alias table is built again from the loaded priorities
+        self._alias_table = None
+
+    def _get_scalars(self) -> Dict[str, Any]:
+        """
+        Gets the scalar state, which has to be saved in the checkpoint.
+        :return: Dict[str, Any].
+        """
+        scalars = super()._get_scalars()
+        scalars["tree_pointer"] = self._tree_pointer
+        scalars["max_priority"] = self._max_priority
+        return scalars
+
+    def _set_scalars(self, scalars: Dict[str, Any]) -> None:
+        """
+        Sets the scalar state loaded from the checkpoint.
+        :param scalars: Dict[str, Any].
+        """
+        super()._set_scalars(scalars)
+        self._tree_pointer = scalars["tree_pointer"]
+        self._max_priority = scalars["max_priority"]
@@ -0,0 +1,137 @@
+"""
+Replay buffer telemetry.
+
+Opt-in instrumentation of the replay buffers from src/data/replay_buffer.py (created with telemetry=True). On the hot
+path, adding and sampling only update a few counters and one bincount of the sampled ages. The priority histogram,
+fill level and memory are computed only when the report is made. The report is a flat dictionary, it can be logged by
+the project's Logger with log_report.
+
+Report:
+- n_adds, add_mean_us, add_max_us - calls of add and add_batch and their latencies,
+- n_samples, sample_mean_us, sample_max_us - calls of sample and sample_sequences and their latencies,
+- sample_age_mean, sample_age_histogram, sample_age_bin_edges - age of the sampled transitions (number of the
+  transitions added after them, 0 for the newest one), histogram over [0, buffer_size), older ones (kept by the
+  priority eviction) are counted in the last bin,
+- ess_mean, ess_min - effective sample size of the importance sampling weights relative to the batch size,
+  (sum w) ** 2 / (n * sum w ** 2), 1 for the uniform weights (prioritized buffers only),
+- size, fill_level, memory_bytes - added by the buffer,
+- priority_min, priority_max, priority_histogram, priority_bin_edges - priorities of the stored transitions
+  (priority ** alpha of the proportional buffer, priorities the ranks are based on for the rank-based buffer),
+  histogram over log10 of the positive ones (prioritized buffers only).
+"""
+from typing import Any, Dict, Optional
+
+from numpy import ndarray, dtype, zeros, int64, bincount, linspace, histogram, log10, asarray, minimum
+
+from src.utils.logger import Logger
+
+N_BINS = 10
+
+
+class ReplayBufferTelemetry:
+    """
+    Counters of the buffer's operations, aggregated since the creation or the last reset.
+    """
+
+    def __init__(self, buffer_size: int, n_bins: int = N_BINS) -> None:
+        """
+        :param buffer_size: int. Size of the buffer's memory.
+        :param n_bins: int. Number of the bins of the histograms.
+        """
+        self._buffer_size = buffer_size
+        self._n_bins = n_bins
+        self._age_bin_edges = linspace(0, buffer_size, n_bins + 1)
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Resets all the counters.
+        """
+        self._n_adds = 0
+        self._add_ns = 0
+        self._add_max_ns = 0
+        self._n_samples = 0
+        self._sample_ns = 0
+        self._sample_max_ns = 0
+        self._age_counts = zeros(self._n_bins, dtype=int64)
+        self._age_sum = 0
+        self._n_weighted_samples = 0
+        self._ess_sum = 0.
+        self._ess_min = 1.
+
+    def record_add(self, duration_ns: int) -> None:
+        """
+        Records one call of add or add_batch.
+        :param duration_ns: int. Latency in nanoseconds.
+        """
+        self._n_adds += 1
+        self._add_ns += duration_ns
+        self._add_max_ns = max(self._add_max_ns, duration_ns)
+
+    def record_sample(self, duration_ns: int, ages: ndarray[Any, dtype[Any]], weights: Optional[Any] = None) -> None:
+        """
+        Records one call of sample or sample_sequences.
+        :param duration_ns: int. Latency in nanoseconds.
+        :param ages: ndarray[Any, dtype[Any]]. Ages of the sampled transitions, non-negative.
+        :param weights: Optional[Any]. Importance sampling weights of the batch (numpy array or tensor).
+        """
+        self._n_samples += 1
+        self._sample_ns += duration_ns
+        self._sample_max_ns = max(self._sample_max_ns, duration_ns)
+        self._age_counts += bincount(minimum(ages * self._n_bins // self._buffer_size, self._n_bins - 1),
+                                     minlength=self._n_bins)
+        self._age_sum += int(ages.sum())
+        if weights is not None:
+            ess = float(weights.sum()) ** 2 / (len(weights) * float((weights ** 2).sum()))
+            self._n_weighted_samples += 1
+            self._ess_sum += ess
+            self._ess_min = min(self._ess_min, ess)
+
+    def get_report(self) -> Dict[str, Any]:
+        """
+        Gets the aggregated counters.
+        :return: Dict[str, Any].
+        """
+        n_ages = int(self._age_counts.sum())
+        report: Dict[str, Any] = {
+            "n_adds": self._n_adds,
+            "add_mean_us": self._add_ns / max(self._n_adds, 1) / 1e3,
+            "add_max_us": self._add_max_ns / 1e3,
+            "n_samples": self._n_samples,
+            "sample_mean_us": self._sample_ns / max(self._n_samples, 1) / 1e3,
+            "sample_max_us": self._sample_max_ns / 1e3,
+            "sample_age_mean": self._age_sum / max(n_ages, 1),
+            "sample_age_histogram": self._age_counts.tolist(),
+            "sample_age_bin_edges": self._age_bin_edges.tolist(),
+        }
+        if self._n_weighted_samples > 0:
+            report["ess_mean"] = self._ess_sum / self._n_weighted_samples
+            report["ess_min"] = self._ess_min
+        return report
+
+    def get_priority_report(self, priorities: ndarray[Any, dtype[Any]]) -> Dict[str, Any]:
+        """
+        Gets the statistics of the priorities of the stored transitions.
+        :param priorities: ndarray[Any, dtype[Any]]. Priorities of the stored transitions.
+        :return: Dict[str, Any].
+        """
+        priorities = asarray(priorities)
+        positive = priorities[priorities > 0]
+        if positive.size == 0:
+            return {}
+        counts, edges = histogram(log10(positive), bins=self._n_bins)
+        return {
+            "priority_min": float(priorities.min()),
+            "priority_max": float(priorities.max()),
+            "priority_histogram": counts.tolist(),
+            "priority_bin_edges": (10. ** edges).tolist(),
+        }
+
+
+def log_report(report: Dict[str, Any], name: str = "Replay buffer") -> None:
+    """
+    Logs the report as one info message of the Logger.
+    :param report: Dict[str, Any]. Report of the buffer.
+    :param name: str. Name of the buffer in the message.
+    """
+    Logger().info(f"{name} telemetry; " + "; ".join(f"{key}: {value}" for key, value in report.items()))
@@ -0,0 +1,648 @@
+"""
+Segment trees
+
+NumPy array-backed segment trees used for prioritized experience replay. They are drop-in replacements of the trees in
+src/external/segment_tree.py (taken from OpenAI baselines) with the same API, but the nodes are stored in one
+contiguous array and the reduce is iterative instead of recursive. PriorityTreeNumpy fuses the sum and the min tree
+into one structure, KaryPriorityTreeNumpy is its variant with more than two contiguous children per node.
+
+Comparison of both implementations can be found in notebooks/documentation/replay_buffer_benchmark_documentation.py.
+"""
+from itertools import accumulate
+from typing import Any, Optional, List, Tuple
+
+from numpy import ndarray, dtype, full, float64, int64, arange, asarray, unique, all as np_all, add, minimum, ufunc, \
+    cumsum, searchsorted, argmin, concatenate
+
+DEFAULT_BRANCHING = 16
+
+
+class SegmentTreeNumpy:
+    """
+    Segment tree with nodes stored in a contiguous array. Node 1 is the root, children of node i are 2i and 2i + 1 and
+    the leaves are stored at positions capacity, ..., 2 * capacity - 1.
+    """
+
+    def __init__(self, capacity: int, operation: ufunc, neutral_element: float, data_type: Any = float64) -> None:
+        """
+        :param capacity: int. Total size of the array - must be a power of two.
+        :param operation: ufunc. Associative and commutative numpy ufunc for combining elements (e.g. add, minimum).
+        :param neutral_element: float. Neutral element for the operation above, e.g. 0 for add and inf for minimum.
+        :param data_type: Any. Data type of the nodes, float64 or float32.
+        """
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
+        self._capacity = capacity
+        self._depth = capacity.bit_length() - 1
+        self._operation = operation
+        self._neutral_element = neutral_element
+        self._nodes: ndarray[Any, dtype[Any]] = full(2 * capacity, neutral_element, dtype=data_type)
+
+        # shifts for getting the path from a leaf to the root
+        self._shifts: ndarray[Any, dtype[Any]] = arange(self._depth + 1, dtype=int64)
+
+    def reduce(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns result of applying the operation to a contiguous subsequence of the array
+        operation(arr[start], operation(arr[start+1], operation(... arr[end - 1]))).
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float. Result of reducing the operation over the specified range of array elements.
+        """
+        if end is None:
+            end = self._capacity
+        if end < 0:
+            end += self._capacity
+        if start == 0 and end == self._capacity:
+            return float(self._nodes[1])
+
+        # bottom-up, collecting the nodes covering the range [start, end)
+        covering_nodes: List[int] = []
+        lower = start + self._capacity
+        upper = end + self._capacity
+        while lower < upper:
+            if lower & 1:
+                covering_nodes.append(lower)
+                lower += 1
+            if upper & 1:
+                upper -= 1
+                covering_nodes.append(upper)
+            lower //= 2
+            upper //= 2
+        if not covering_nodes:
+            return self._neutral_element
+        return float(self._operation.reduce(self._nodes[covering_nodes]))
+
+    def __setitem__(self, idx: int, val: float) -> None:
+        """
+        Sets the value of the leaf. All the ancestors are recomputed at once as accumulated operation over the siblings
+        on the path to the root.
+        :param idx: int. Index of the leaf.
+        :param val: float. New value.
+        """
+        path = (idx + self._capacity) >> self._shifts
+        self._nodes[path[0]] = val
+        # operands are the leaf itself followed by the siblings of the nodes on the path
+        operands = path ^ 1
+        operands[1:] = operands[:-1]
+        operands[0] = path[0]
+        self._nodes[path] = self._operation.accumulate(self._nodes[operands])
+
+    def update_batch(self, idxs: ndarray[Any, dtype[Any]], vals: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the values of many leaves at once. All the leaves are assigned in one step and then only the parents of the
+        changed leaves are recomputed, level by level. For duplicated indices the last value wins.
+        :param idxs: ndarray[Any, dtype[Any]]. Indices of the leaves.
+        :param vals: ndarray[Any, dtype[Any]]. New values of the leaves.
+        """
+        nodes = asarray(idxs, dtype=int64).reshape(-1) + self._capacity
+        self._nodes[nodes] = asarray(vals).reshape(-1)
+        for _ in range(self._depth):
+            nodes = unique(nodes // 2)
+            self._nodes[nodes] = self._operation(self._nodes[2 * nodes], self._nodes[2 * nodes + 1])
+
+    def __getitem__(self, idx: Any) -> Any:
+        """
+        Gets the value of the leaf.
+        :param idx: Any. Index or array of indices of the leaves.
+        :return: Any. Value or array of values.
+        """
+        if isinstance(idx, ndarray):
+            assert np_all(0 <= idx) and np_all(idx < self._capacity)
+        else:
+            assert 0 <= idx < self._capacity
+        return self._nodes[self._capacity + idx]
+
+    def get_nodes(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the array of all the nodes.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._nodes
+
+
+class SumSegmentTreeNumpy(SegmentTreeNumpy):
+    """
+    Segment tree for sums.
+    """
+
+    def __init__(self, capacity: int, data_type: Any = float64) -> None:
+        """
+        :param capacity: int. Total size of the array - must be a power of two.
+        :param data_type: Any. Data type of the nodes, float64 or float32.
+        """
+        SegmentTreeNumpy.__init__(self, capacity=capacity, operation=add, neutral_element=0.0, data_type=data_type)
+
+    def sum(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns arr[start] + ... + arr[end - 1].
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float.
+        """
+        return self.reduce(start, end)
+
+    def find_prefixsum_idx(self, prefixsum: float) -> int:
+        """
+        Finds the highest index i in the array such that arr[0] + arr[1] + ... + arr[i - 1] <= prefixsum. If array
+        values are probabilities, this function allows to sample indexes according to the discrete probability
+        efficiently.
+        :param prefixsum: float. Upper bound on the sum of array prefix.
+        :return: int. Highest index satisfying the prefixsum constraint.
+        """
+        assert 0 <= prefixsum <= self.sum() + 1e-5
+        idx = 1
+        while idx < self._capacity:  # while non-leaf
+            left = self._nodes[2 * idx]
+            if left > prefixsum:
+                idx = 2 * idx
+            else:
+                prefixsum -= left
+                idx = 2 * idx + 1
+        return idx - self._capacity
+
+    def find_prefixsum_idx_batch(self, prefixsums: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Vectorized version of find_prefixsum_idx. All the prefix sums descend the tree together, one level per step.
+        :param prefixsums: ndarray[Any, dtype[Any]]. Upper bounds on the sum of array prefix.
+        :return: ndarray[Any, dtype[Any]]. Highest indices satisfying the prefixsum constraints.
+        """
+        prefixsums = asarray(prefixsums, dtype=self._nodes.dtype).copy()
+        assert np_all(0 <= prefixsums) and np_all(prefixsums <= self.sum() + 1e-5)
+        idxs: ndarray[Any, dtype[Any]] = full(prefixsums.shape, 1, dtype=int64)
+        for _ in range(self._depth):
+            left = self._nodes[2 * idxs]
+            go_right = left <= prefixsums
+            prefixsums[go_right] -= left[go_right]
+            idxs = 2 * idxs + go_right
+        return idxs - self._capacity
+
+
+class MinSegmentTreeNumpy(SegmentTreeNumpy):
+    """
+    Segment tree for minimums.
+    """
+
+    def __init__(self, capacity: int, data_type: Any = float64) -> None:
+        """
+        :param capacity: int. Total size of the array - must be a power of two.
+        :param data_type: Any. Data type of the nodes, float64 or float32.
+        """
+        SegmentTreeNumpy.__init__(self, capacity=capacity, operation=minimum, neutral_element=float("inf"),
+                                  data_type=data_type)
+
+    def min(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns min(arr[start], ..., arr[end - 1]).
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float.
+        """
+        return self.reduce(start, end)
+
+    def find_min_idx(self) -> int:
+        """
+        Finds the index of the smallest element by descending to the child holding the minimum of its parent, O(log N).
+        For the same values, the lowest index is found.
+        :return: int. Index of the smallest element.
+        """
+        idx = 1
+        while idx < self._capacity:  # while non-leaf
+            idx = 2 * idx if self._nodes[2 * idx] <= self._nodes[2 * idx + 1] else 2 * idx + 1
+        return idx - self._capacity
+
+
+class PriorityTreeNumpy:
+    """
+    Fused sum and min segment tree for priorities. Both aggregates of a node are stored side by side in one row of the
+    (2 * capacity, 2) array (column 0 sum, column 1 min), so one upward pass updates both of them and the reads of both
+    aggregates hit the same cache line.
+    """
+
+    def __init__(self, capacity: int, data_type: Any = float64, nodes: Optional[ndarray[Any, dtype[Any]]] = None) \
+            -> None:
+        """
+        :param capacity: int. Total size of the array - must be a power of two.
+        :param data_type: Any. Data type of the nodes, float64 or float32. Not used if nodes are passed.
+        :param nodes: Optional[ndarray[Any, dtype[Any]]]. Preallocated (2 * capacity, 2) array for the nodes, e.g.
+                      numpy.memmap. It is reset to the empty tree. If None, new array is allocated.
+        """
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
+        self._capacity = capacity
+        self._depth = capacity.bit_length() - 1
+        self._nodes: ndarray[Any, dtype[Any]]
+        if nodes is None:
+            self._nodes = full((2 * capacity, 2), (0.0, float("inf")), dtype=data_type)
+        else:
+            assert nodes.shape == (2 * capacity, 2), "nodes must have shape (2 * capacity, 2)."
+            self._nodes = nodes
+            self._nodes[:] = (0.0, float("inf"))
+
+        # shifts for getting the path from a leaf to the root
+        self._shifts: ndarray[Any, dtype[Any]] = arange(self._depth + 1, dtype=int64)
+
+    def _get_covering_nodes(self, start: int, end: Optional[int]) -> List[int]:
+        """
+        Gets the nodes covering the range [start, end), bottom-up.
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: List[int]. Indices of the nodes.
+        """
+        if end is None:
+            end = self._capacity
+        if end < 0:
+            end += self._capacity
+        if start == 0 and end == self._capacity:
+            return [1]
+
+        covering_nodes: List[int] = []
+        lower = start + self._capacity
+        upper = end + self._capacity
+        while lower < upper:
+            if lower & 1:
+                covering_nodes.append(lower)
+                lower += 1
+            if upper & 1:
+                upper -= 1
+                covering_nodes.append(upper)
+            lower //= 2
+            upper //= 2
+        return covering_nodes
+
+    def sum(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns arr[start] + ... + arr[end - 1].
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float.
+        """
+        return float(add.reduce(self._nodes[self._get_covering_nodes(start, end), 0]))
+
+    def min(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns min(arr[start], ..., arr[end - 1]).
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float.
+        """
+        return float(minimum.reduce(self._nodes[self._get_covering_nodes(start, end), 1], initial=float("inf")))
+
+    def __setitem__(self, idx: int, val: float) -> None:
+        """
+        Sets the priority of the leaf and updates both aggregates of all the ancestors in one pass.
+        :param idx: int. Index of the leaf.
+        :param val: float. New priority.
+        """
+        path = (idx + self._capacity) >> self._shifts
+        self._nodes[path[0]] = val
+        # operands are the leaf itself followed by the siblings of the nodes on the path
+        operands = path ^ 1
+        operands[1:] = operands[:-1]
+        operands[0] = path[0]
+        operand_values = self._nodes[operands]
+        add.accumulate(operand_values[:, 0], out=operand_values[:, 0])
+        minimum.accumulate(operand_values[:, 1], out=operand_values[:, 1])
+        self._nodes[path] = operand_values
+
+    def update_batch(self, idxs: ndarray[Any, dtype[Any]], vals: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the priorities of many leaves at once. All the leaves are assigned in one step and then only the parents of
+        the changed leaves are recomputed, level by level. For duplicated indices the last value wins.
+        :param idxs: ndarray[Any, dtype[Any]]. Indices of the leaves.
+        :param vals: ndarray[Any, dtype[Any]]. New priorities of the leaves.
+        """
+        nodes = asarray(idxs, dtype=int64).reshape(-1) + self._capacity
+        self._nodes[nodes] = asarray(vals).reshape(-1, 1)
+        for _ in range(self._depth):
+            nodes = unique(nodes // 2)
+            left = self._nodes[2 * nodes]
+            right = self._nodes[2 * nodes + 1]
+            add(left[:, 0], right[:, 0], out=left[:, 0])
+            minimum(left[:, 1], right[:, 1], out=left[:, 1])
+            self._nodes[nodes] = left
+
+    def update_range(self, start: int, vals: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the priorities of the contiguous leaves start, ..., start + len(vals) - 1. The parents of contiguous nodes
+        are contiguous as well, so each level is recomputed with slices only.
+        :param start: int. Index of the first leaf.
+        :param vals: ndarray[Any, dtype[Any]]. New priorities of the leaves.
+        """
+        vals = asarray(vals).reshape(-1, 1)
+        assert 0 <= start and start + len(vals) <= self._capacity
+        if len(vals) == 0:
+            return
+        first = start + self._capacity
+        last = first + len(vals) - 1
+        self._nodes[first:last + 1] = vals
+        for _ in range(self._depth):
+            first //= 2
+            last //= 2
+            children = self._nodes[2 * first:2 * last + 2]
+            add(children[::2, 0], children[1::2, 0], out=self._nodes[first:last + 1, 0])
+            minimum(children[::2, 1], children[1::2, 1], out=self._nodes[first:last + 1, 1])
+
+    def __getitem__(self, idx: Any) -> Any:
+        """
+        Gets the priority of the leaf.
+        :param idx: Any. Index or array of indices of the leaves.
+        :return: Any. Priority or array of priorities.
+        """
+        if isinstance(idx, ndarray):
+            assert np_all(0 <= idx) and np_all(idx < self._capacity)
+        else:
+            assert 0 <= idx < self._capacity
+        return self._nodes[self._capacity + idx, 0]
+
+    def find_prefixsum_idx(self, prefixsum: float) -> int:
+        """
+        Finds the highest index i in the array such that arr[0] + arr[1] + ... + arr[i - 1] <= prefixsum.
+        :param prefixsum: float. Upper bound on the sum of array prefix.
+        :return: int. Highest index satisfying the prefixsum constraint.
+        """
+        return int(self.find_prefixsum_idx_batch(asarray([prefixsum]))[0])
+
+    def find_prefixsum_idx_batch(self, prefixsums: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Vectorized version of find_prefixsum_idx. All the prefix sums descend the tree together, one level per step.
+        :param prefixsums: ndarray[Any, dtype[Any]]. Upper bounds on the sum of array prefix.
+        :return: ndarray[Any, dtype[Any]]. Highest indices satisfying the prefixsum constraints.
+        """
+        prefixsums = asarray(prefixsums, dtype=self._nodes.dtype).copy()
+        assert np_all(0 <= prefixsums) and np_all(prefixsums <= self._nodes[1, 0] + 1e-5)
+        idxs: ndarray[Any, dtype[Any]] = full(prefixsums.shape, 1, dtype=int64)
+        for _ in range(self._depth):
+            left = self._nodes[2 * idxs, 0]
+            go_right = left <= prefixsums
+            prefixsums[go_right] -= left[go_right]
+            idxs = 2 * idxs + go_right
+        return idxs - self._capacity
+
+    def find_min_idx(self) -> int:
+        """
+        Finds the index of the lowest priority by descending the min aggregates, O(log N). For the same priorities, the
+        lowest index is found.
+        :return: int. Index of the lowest priority.
+        """
+        idx = 1
+        while idx < self._capacity:  # while non-leaf
+            idx = 2 * idx if self._nodes[2 * idx, 1] <= self._nodes[2 * idx + 1, 1] else 2 * idx + 1
+        return idx - self._capacity
+
+    def get_nodes(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the (2 * capacity, 2) array of all the nodes.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._nodes
+
+    def set_nodes(self, nodes: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the array of all the nodes of already built tree, e.g. loaded from the checkpoint. Nodes are used as they
+        are.
+        :param nodes: ndarray[Any, dtype[Any]]. (2 * capacity, 2) array.
+        """
+        assert nodes.shape == (2 * self._capacity, 2), "nodes must have shape (2 * capacity, 2)."
+        self._nodes = nodes
+
+
+class KaryPriorityTreeNumpy:
+    """
+    Fused sum and min priority tree with branching children per node, drop-in replacement of PriorityTreeNumpy. The
+    children of a node are contiguous rows, so one level of the descent is one cumulative sum over a small block and
+    the tree is log2(branching) times shallower than the binary one (e.g. 5 instead of 17 levels for 2**17 leaves with
+    branching 16).
+
+    Levels are stored top-down in one (n_nodes, 2) array (column 0 sum, column 1 min). The top level has at most
+    branching nodes and its sum is the total. Children of the node j of a level are the nodes j * branching, ...,
+    (j + 1) * branching - 1 of the next level, the leaves are padded by the neutral elements to fill the blocks.
+    """
+
+    def __init__(self, capacity: int, branching: int = DEFAULT_BRANCHING, data_type: Any = float64, \
+                 nodes: Optional[ndarray[Any, dtype[Any]]] = None) -> None:
+        """
+        :param capacity: int. Number of the leaves.
+        :param branching: int. Number of the children of each node, at least 2.
+        :param data_type: Any. Data type of the nodes, float64 or float32. Not used if nodes are passed.
+        :param nodes: Optional[ndarray[Any, dtype[Any]]]. Preallocated array of get_nodes_shape(capacity, branching)
+                      for the nodes, e.g. numpy.memmap. It is reset to the empty tree. If None, new array is allocated.
+        """
+        assert capacity > 0 and branching >= 2, "capacity must be positive and branching at least 2."
+        self._capacity = capacity
+        self._branching = branching
+        self._level_sizes = self._get_level_sizes(capacity, branching)
+        self._offsets = [0] + list(accumulate(self._level_sizes))
+        self._nodes: ndarray[Any, dtype[Any]]
+        if nodes is None:
+            self._nodes = full((self._offsets[-1], 2), (0.0, float("inf")), dtype=data_type)
+        else:
+            assert nodes.shape == (self._offsets[-1], 2), "nodes must have shape get_nodes_shape(capacity, branching)."
+            self._nodes = nodes
+            self._nodes[:] = (0.0, float("inf"))
+        self._levels: List[ndarray[Any, dtype[Any]]] = []
+        self._set_levels()
+        self._children: ndarray[Any, dtype[Any]] = arange(branching, dtype=int64)
+
+    @staticmethod
+    def _get_level_sizes(capacity: int, branching: int) -> List[int]:
+        """
+        Gets the numbers of the nodes of the levels, top-down. The top level has at most branching nodes, each next
+        level branching times more.
+        :param capacity: int. Number of the leaves.
+        :param branching: int.
+        :return: List[int].
+        """
+        n_lower_levels = 0
+        while branching ** (n_lower_levels + 1) < capacity:
+            n_lower_levels += 1
+        top_size = -(-capacity // branching ** n_lower_levels)
+        return [top_size * branching ** level for level in range(n_lower_levels + 1)]
+
+    @staticmethod
+    def get_nodes_shape(capacity: int, branching: int = DEFAULT_BRANCHING) -> Tuple[int, int]:
+        """
+        Gets the shape of the array of all the nodes, e.g. for its preallocation.
+        :param capacity: int. Number of the leaves.
+        :param branching: int.
+        :return: Tuple[int, int].
+        """
+        return sum(KaryPriorityTreeNumpy._get_level_sizes(capacity, branching)), 2
+
+    def _set_levels(self) -> None:
+        """
+        Sets the views of the levels into the array of the nodes.
+        """
+        self._levels = [self._nodes[start:end] for start, end in zip(self._offsets[:-1], self._offsets[1:])]
+
+    def _reduce(self, start: int, end: Optional[int], column: int, operation: ufunc, neutral_element: float) -> float:
+        """
+        Reduces the range [start, end) bottom-up. The partial blocks at both ends of the range are taken from the
+        current level, the full blocks between them from their parents on the level above.
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :param column: int. Column of the aggregate, 0 sum, 1 min.
+        :param operation: ufunc. add or minimum.
+        :param neutral_element: float. Neutral element of the operation.
+        :return: float.
+        """
+        if end is None:
+            end = self._capacity
+        if end < 0:
+            end += self._capacity
+        if start == 0 and end == self._capacity:
+            return float(operation.reduce(self._levels[0][:, column]))
+        parts = []
+        lower, upper = start, end
+        depth = len(self._levels) - 1
+        while depth > 0:
+            first_full = -(-lower // self._branching) * self._branching
+            last_full = upper // self._branching * self._branching
+            if first_full >= last_full:
+                break
+            level = self._levels[depth]
+            parts += [level[lower:first_full, column], level[last_full:upper, column]]
+            lower, upper = first_full // self._branching, last_full // self._branching
+            depth -= 1
+        parts.append(self._levels[depth][lower:upper, column])
+        # one reduce of all the covering nodes
+        return float(operation.reduce(concatenate(parts), initial=neutral_element))
+
+    def sum(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns arr[start] + ... + arr[end - 1].
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float.
+        """
+        return self._reduce(start, end, 0, add, 0.0)
+
+    def min(self, start: int = 0, end: Optional[int] = None) -> float:
+        """
+        Returns min(arr[start], ..., arr[end - 1]).
+        :param start: int. Beginning of the subsequence.
+        :param end: Optional[int]. End of the subsequence (exclusive). If None, end of the array.
+        :return: float.
+        """
+        return self._reduce(start, end, 1, minimum, float("inf"))
+
+    def __setitem__(self, idx: int, val: float) -> None:
+        """
+        Sets the priority of the leaf and recomputes both aggregates of all the ancestors from their children blocks.
+        :param idx: int. Index of the leaf.
+        :param val: float. New priority.
+        """
+        assert 0 <= idx < self._capacity
+        self._levels[-1][idx] = val
+        for depth in range(len(self._levels) - 1, 0, -1):
+            idx //= self._branching
+            children = self._levels[depth][idx * self._branching:(idx + 1) * self._branching]
+            parent = self._levels[depth - 1][idx]
+            parent[0] = add.reduce(children[:, 0])
+            parent[1] = minimum.reduce(children[:, 1])
+
+    def update_batch(self, idxs: ndarray[Any, dtype[Any]], vals: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the priorities of many leaves at once. All the leaves are assigned in one step and then only the parents of
+        the changed leaves are recomputed, level by level. For duplicated indices the last value wins.
+        :param idxs: ndarray[Any, dtype[Any]]. Indices of the leaves.
+        :param vals: ndarray[Any, dtype[Any]]. New priorities of the leaves.
+        """
+        nodes = asarray(idxs, dtype=int64).reshape(-1)
+        self._levels[-1][nodes] = asarray(vals).reshape(-1, 1)
+        for depth in range(len(self._levels) - 1, 0, -1):
+            nodes = unique(nodes // self._branching)
+            children = self._levels[depth][(nodes * self._branching)[:, None] + self._children]
+            self._levels[depth - 1][nodes, 0] = children[:, :, 0].sum(axis=1)
+            self._levels[depth - 1][nodes, 1] = children[:, :, 1].min(axis=1)
+
+    def update_range(self, start: int, vals: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the priorities of the contiguous leaves start, ..., start + len(vals) - 1. The parents of contiguous nodes
+        are contiguous as well, so each level is recomputed from the reshaped blocks of its children.
+        :param start: int. Index of the first leaf.
+        :param vals: ndarray[Any, dtype[Any]]. New priorities of the leaves.
+        """
+        vals = asarray(vals).reshape(-1, 1)
+        assert 0 <= start and start + len(vals) <= self._capacity
+        if len(vals) == 0:
+            return
+        first = start
+        last = start + len(vals) - 1
+        self._levels[-1][first:last + 1] = vals
+        for depth in range(len(self._levels) - 1, 0, -1):
+            first //= self._branching
+            last //= self._branching
+            children = self._levels[depth][first * self._branching:(last + 1) * self._branching].reshape(
+                (last + 1 - first, self._branching, 2)
+            )
+            children[:, :, 0].sum(axis=1, out=self._levels[depth - 1][first:last + 1, 0])
+            children[:, :, 1].min(axis=1, out=self._levels[depth - 1][first:last + 1, 1])
+
+    def __getitem__(self, idx: Any) -> Any:
+        """
+        Gets the priority of the leaf.
+        :param idx: Any. Index or array of indices of the leaves.
+        :return: Any. Priority or array of priorities.
+        """
+        if isinstance(idx, ndarray):
+            assert np_all(0 <= idx) and np_all(idx < self._capacity)
+        else:
+            assert 0 <= idx < self._capacity
+        return self._levels[-1][idx, 0]
+
+    def find_prefixsum_idx(self, prefixsum: float) -> int:
+        """
+        Finds the highest index i in the array such that arr[0] + arr[1] + ... + arr[i - 1] <= prefixsum.
+        :param prefixsum: float. Upper bound on the sum of array prefix.
+        :return: int. Highest index satisfying the prefixsum constraint.
+        """
+        return int(self.find_prefixsum_idx_batch(asarray([prefixsum]))[0])
+
+    def find_prefixsum_idx_batch(self, prefixsums: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Vectorized version of find_prefixsum_idx. All the prefix sums descend the tree together, one level per step.
+        On each level the child is the first one of the block whose cumulative sum exceeds the prefix sum (the last one
+        if none does, as the binary tree goes right).
+        :param prefixsums: ndarray[Any, dtype[Any]]. Upper bounds on the sum of array prefix.
+        :return: ndarray[Any, dtype[Any]]. Highest indices satisfying the prefixsum constraints.
+        """
+        prefixsums = asarray(prefixsums, dtype=self._nodes.dtype).reshape(-1)
+        top_sums = cumsum(self._levels[0][:, 0])
+        assert np_all(0 <= prefixsums) and np_all(prefixsums <= top_sums[-1] + 1e-5)
+        idxs = minimum(searchsorted(top_sums, prefixsums, side="right"), len(top_sums) - 1)
+        prefixsums = prefixsums - (top_sums[idxs] - self._levels[0][idxs, 0])
+        rows = arange(len(idxs))
+        for level in self._levels[1:]:
+            blocks = level[(idxs * self._branching)[:, None] + self._children, 0]
+            block_sums = cumsum(blocks, axis=1)
+            children = minimum((block_sums <= prefixsums[:, None]).sum(axis=1), self._branching - 1)
+            prefixsums = prefixsums - (block_sums[rows, children] - blocks[rows, children])
+            idxs = idxs * self._branching + children
+        return idxs
+
+    def find_min_idx(self) -> int:
+        """
+        Finds the index of the lowest priority by descending the min aggregates. For the same priorities, the lowest
+        index is found.
+        :return: int. Index of the lowest priority.
+        """
+        idx = int(argmin(self._levels[0][:, 1]))
+        for level in self._levels[1:]:
+            idx = idx * self._branching + int(argmin(level[idx * self._branching:(idx + 1) * self._branching, 1]))
+        return idx
+
+    def get_nodes(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the array of all the nodes.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._nodes
+
+    def set_nodes(self, nodes: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Sets the array of all the nodes of already built tree, e.g. loaded from the checkpoint. Nodes are used as they
+        are.
+        :param nodes: ndarray[Any, dtype[Any]]. Array of get_nodes_shape(capacity, branching).
+        """
+        assert nodes.shape == self._nodes.shape, "nodes must have shape get_nodes_shape(capacity, branching)."
+        self._nodes = nodes
+        self._set_levels()
@@ -0,0 +1,443 @@
+"""
+Sharded prioritized replay buffer.
+
+Prioritized experience buffer split into n_shards independent PrioritizedReplayBuffer shards, each with its own
+priority tree and lock. Actor threads adding into different shards do not contend with each other, and every tree
+operation is log2(buffer_size / n_shards) deep.
+
+Global proportional sampling:
+- The batch_size stratified upper bounds are drawn over the total mass of all the shards (the sums of the trees' roots),
+  exactly as in one PrioritizedReplayBuffer, and mapped to the shards by the cumulative root sums.
+- Each shard with some of the bounds descends its own tree for all of them at once, under its own lock only. The
+  descents of the shards run concurrently in a thread pool, they overlap where numpy releases the GIL.
+- Weights use the global probabilities, so the batch is distributed as if it was sampled from one buffer.
+
+Global index of the transition is shard * shard_size + index in the shard. The sampling locks only the shards in the
+batch, the roots of the trees are read without the locks.
+The shards store the transitions as they come, so the options depending on consecutive transitions of one episode
+(n-step, deduplicated next states, sequences) are not supported.
+
+Each slot is stamped with the global number of the experience set stored in it (1 for the first one added into any
+shard), the stamp is set under the shard's lock right after the write. get_not_overwritten compares the stamps with
+get_n_added taken before the read, so the priority updates of a batch sampled earlier (prefetching sampler, priority
+refresh) skip the slots overwritten since. The telemetry (telemetry=True) is recorded by the sharded buffer itself, the
+ages of the sampled transitions come from the stamps.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from json import dump, load
+from os import makedirs
+from os.path import join
+from threading import Lock
+from time import perf_counter_ns
+from typing import Any, Dict, List, Optional, Tuple
+
+from numpy import ndarray, dtype, zeros, arange, array, asarray, concatenate, cumsum, searchsorted, minimum, \
+    flatnonzero, power, empty, float64, unique, int64, argsort, stack, save, load as load_array
+
+from src.data.replay_buffer import PrioritizedReplayBuffer, CHECKPOINT_STATE_FILE, PRIORITY_SAMPLING_TREE, \
+    create_generator
+from src.data.replay_buffer_telemetry import ReplayBufferTelemetry, log_report
+from src.exceptions.development_exception import NoProperOptionInIf
+
+DEFAULT_N_SHARDS = 4
+
+
+# pylint: disable=too-many-instance-attributes,protected-access
+class ShardedPrioritizedReplayBuffer:
+    """
+    Prioritized experience buffer split into independently locked shards. It has the interface of
+    PrioritizedReplayBuffer (add, add_batch, sample, sample_many, update_priorities, get_current_size, get_n_added,
+    get_not_overwritten, get_transitions, telemetry, save, load).
+    """
+
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 alpha: float, n_shards: int = DEFAULT_N_SHARDS, seed: Optional[int] = None, \
+                 n_sampling_threads: Optional[int] = None, **kwargs: Any) -> None:
+        """
+        :param state_dim: int. Dimension of state space.
+        :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
+        :param buffer_size: int. Size of the buffer's memory, divisible by n_shards.
+        :param batch_size: int. Size of the batch generated.
+        :param n_actions: int. Number of distinct actions.
+        :param alpha: float. Prioritisation alpha parameter.
+        :param n_shards: int. Number of the shards.
+        :param seed: Optional[int]. Seed of the buffer's random generator, the shards' generators are derived from it.
+        :param n_sampling_threads: Optional[int]. Number of the threads descending the shards' trees concurrently,
+                                   n_shards if None, 0 for the descents one after another in the calling thread.
+        :param kwargs: Any. Other parameters of PrioritizedReplayBuffer, storage_folder gets one subfolder per shard,
+                       telemetry is recorded for all the shards together.
+        """
+        if n_shards < 1 or buffer_size % n_shards != 0:
+            raise NoProperOptionInIf(f"Buffer size {buffer_size} cannot be split into {n_shards} shards.")
+        if kwargs.get("n_step", 1) > 1 or kwargs.get("deduplicate_next_states") or kwargs.get("sequence_length"):
+            raise NoProperOptionInIf("Options depending on the consecutive transitions are not supported by shards.")
+        if kwargs.get("priority_sampling", PRIORITY_SAMPLING_TREE) != PRIORITY_SAMPLING_TREE:
+            raise NoProperOptionInIf("Shards are sampled by the descents of their trees.")
+
+        self._n_shards = n_shards
+        self._shard_size = buffer_size // n_shards
+        self._batch_size = batch_size
+        self._rng = create_generator(seed)
+        storage_folder = kwargs.pop("storage_folder", None)
+        self._telemetry = ReplayBufferTelemetry(buffer_size) if kwargs.pop("telemetry", False) else None
+        self._shards: List[PrioritizedReplayBuffer] = [
+            PrioritizedReplayBuffer(state_dim, actions_dim, self._shard_size, batch_size, n_actions, alpha,
+                                    seed=int(self._rng.integers(2**32)),
+                                    storage_folder=None if storage_folder is None else join(storage_folder, str(shard)),
+                                    **kwargs)
+            for shard in range(n_shards)
+        ]
+        # the shards do not one-hot encode their parts of the batch, the whole batch is encoded once
+        self._ooh = self._shards[0]._ooh
+        self._do_ooh = self._shards[0]._do_ooh
+        for memory in self._shards:
+            memory._do_ooh = False
+        self._locks = [Lock() for _ in range(n_shards)]
+        self._round_robin_lock = Lock()
+        self._n_round_robin = 0
+        # new transitions get the maximal priority of all the shards, not only of their own one
+        self._max_priority = 1.
+        self._max_priority_lock = Lock()
+        n_sampling_threads = n_shards if n_sampling_threads is None else n_sampling_threads
+        self._executor = ThreadPoolExecutor(n_sampling_threads) if n_sampling_threads > 0 and n_shards > 1 else None
+        self._weights = zeros((batch_size, 1), dtype=self._shards[0]._data_types.rewards)
+        # global number of the experience set stored in each slot, 0 for the empty ones
+        self._slot_stamps = zeros(buffer_size, dtype=int64)
+        self._n_added = 0
+        self._n_added_lock = Lock()
+
+    def _next_shard(self, shard: Optional[int]) -> int:
+        """
+        Gets the shard for the add, the given one or the next one in the round robin.
+        :param shard: Optional[int].
+        :return: int.
+        """
+        if shard is not None:
+            return shard
+        with self._round_robin_lock:
+            self._n_round_robin += 1
+            return (self._n_round_robin - 1) % self._n_shards
+
+    def add(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+            next_state: ndarray[Any, dtype[Any]], done: bool, shard: Optional[int] = None) -> None:
+        """
+        Adds the experience set into one shard.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        :param shard: Optional[int]. Shard of the experience set (e.g. the actor's one). If None, round robin.
+        """
+        start = self._start_timing()
+        shard = self._next_shard(shard)
+        memory = self._shards[shard]
+        max_priority = self._get_max_priority()
+        with self._locks[shard]:
+            memory._max_priority = max(memory._max_priority, max_priority)
+            n_added = memory.get_n_added()
+            memory.add(state, action, reward, next_state, done)
+            self._stamp_slots(shard, n_added)
+        self._record_add(start)
+
+    def add_batch(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]], shard: Optional[int] = None) -> None:
+        """
+        Adds many experience sets at once into one shard, see PrioritizedReplayBuffer.add_batch.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param shard: Optional[int]. Shard of the experience sets. If None, round robin.
+        """
+        start = self._start_timing()
+        shard = self._next_shard(shard)
+        memory = self._shards[shard]
+        max_priority = self._get_max_priority()
+        with self._locks[shard]:
+            memory._max_priority = max(memory._max_priority, max_priority)
+            n_added = memory.get_n_added()
+            memory.add_batch(states, actions, rewards, next_states, dones)
+            self._stamp_slots(shard, n_added)
+        self._record_add(start)
+
+    def _stamp_slots(self, shard: int, n_added: int) -> None:
+        """
+        Stamps the slots written by the last add into the shard with the next global numbers. Called under the shard's
+        lock.
+        :param shard: int. Shard.
+        :param n_added: int. Number of the experience sets added into the shard before the add.
+        """
+        memory = self._shards[shard]
+        n_new = memory.get_n_added() - n_added
+        if n_new == 1 or memory._slot_steps is None:
+            # the pointer is right after the written slots, only the last shard_size ones are kept
+            n_written = min(n_new, self._shard_size)
+            slots = (memory._pointer - n_written + arange(n_written)) % self._shard_size
+        else:
+            # the priority eviction writes into the evicted slots, found by their step numbers
+            slots = flatnonzero(memory._slot_steps[:memory.get_current_size()] >= n_added)
+            slots = slots[argsort(memory._slot_steps[slots])]
+        with self._n_added_lock:
+            self._n_added += n_new
+            self._slot_stamps[shard * self._shard_size + slots] = self._n_added - len(slots) + 1 + arange(len(slots))
+
+    def _get_max_priority(self) -> float:
+        """
+        Gets the maximal priority of all the shards.
+        :return: float.
+        """
+        with self._max_priority_lock:
+            return self._max_priority
+
+    def get_current_size(self) -> int:
+        """
+        Gets the current size, total of all the shards.
+        """
+        return sum(shard.get_current_size() for shard in self._shards)
+
+    def get_n_added(self) -> int:
+        """
+        Gets the total number of the experience sets added into all the shards.
+        :return: int.
+        """
+        with self._n_added_lock:
+            return self._n_added
+
+    def get_not_overwritten(self, indices: ndarray[Any, dtype[Any]], n_added: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Says which slots still hold the experience sets they held when n_added experience sets were added. The empty
+        slots of the partially filled shards hold none.
+        :param indices: ndarray[Any, dtype[Any]]. Global indices of the transitions.
+        :param n_added: int. Value of get_n_added at the time.
+        :return: ndarray[Any, dtype[Any]]. Boolean array.
+        """
+        with self._n_added_lock:
+            stamps = self._slot_stamps[asarray(indices)]
+        return (stamps > 0) & (stamps <= n_added)
+
+    def _get_root_sums(self) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the total priority mass of each shard. The roots are read without the locks, a root changed before its
+        shard is locked only shifts the bounds of the shard, which are clipped to its current mass.
+        :return: ndarray[Any, dtype[Any]]. (n_shards,) array.
+        """
+        return array([memory._priority_tree.sum() for memory in self._shards], dtype=float64)
+
+    # pylint: disable=too-many-locals
+    def sample(self, beta: float) -> Tuple[Any, ...]:
+        """
+        Samples the batch proportionally to the priorities of all the shards.
+        NOTE: The weights are written into the preallocated array, which is reused by the next call.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh, weights, indices), indices
+                 are global.
+        """
+        start = self._start_timing()
+        root_sums = self._get_root_sums()
+        shard_starts = cumsum(root_sums) - root_sums
+        total_mass = float(root_sums.sum())
+        upper_bounds = (arange(self._batch_size) + self._rng.random(self._batch_size)) * total_mass / self._batch_size
+        # empty shards are skipped, bounds are increasing, so each shard gets a contiguous part of the batch
+        shards_used = flatnonzero(root_sums > 0)
+        shards = shards_used[minimum(searchsorted(cumsum(root_sums[shards_used]), upper_bounds, side="right"),
+                                     shards_used.size - 1)]
+
+        min_priority = min(self._shards[shard]._priority_tree.min() for shard in shards_used)
+        shards_in_batch = unique(shards)
+        selections = [flatnonzero(shards == shard) for shard in shards_in_batch]
+        bounds = [upper_bounds[selected] - shard_starts[shard] for shard, selected in zip(shards_in_batch, selections)]
+        if self._executor is None or shards_in_batch.size == 1:
+            shard_samples = list(map(self._sample_shard, shards_in_batch, bounds))
+        else:
+            shard_samples = list(self._executor.map(self._sample_shard, shards_in_batch, bounds))
+
+        indices = empty(self._batch_size, dtype="int64")
+        leaf_priorities = empty(self._batch_size, dtype=float64)
+        for shard, selected, shard_sample in zip(shards_in_batch, selections, shard_samples):
+            indices[selected] = shard * self._shard_size + shard_sample[0]
+            leaf_priorities[selected] = shard_sample[1]
+
+        # probability ratio to the least probable transition, the total mass cancels out
+        min_priority = min(min_priority, leaf_priorities.min())
+        power(leaf_priorities / min_priority, -beta, out=self._weights[:, 0])
+        batch_parts = [batch_part for _, _, batch_part in shard_samples]
+        batch = [None if parts[0] is None else concatenate(parts) for parts in zip(*batch_parts)]
+        if self._do_ooh:
+            batch[5] = self._ooh.transform(batch[1])
+        self._record_sample(start, indices, self._weights)
+        return tuple(batch) + (self._weights, indices)
+    # pylint: enable=too-many-locals
+
+    def sample_many(self, n_batches: int, beta: float) -> Tuple[Any, ...]:
+        """
+        Samples n_batches batches, one after another by sample, see PrioritizedReplayBuffer.sample_many.
+        :param n_batches: int. Number of the batches.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh, weights, indices), each of
+                 shape (n_batches, batch_size, ...).
+        """
+        batches = []
+        for _ in range(n_batches):
+            *batch, weights, indices = self.sample(beta)
+            # the weights array is reused by the next sample
+            batches.append(tuple(batch) + (weights.copy(), indices))
+        return tuple(None if parts[0] is None else stack(parts) for parts in zip(*batches))
+
+    def get_transitions(self, indices: ndarray[Any, dtype[Any]]) -> Tuple[Any, ...]:
+        """
+        Gets the stored transitions in the slots, each shard's part under its own lock, see
+        ReplayBuffer.get_transitions.
+        :param indices: ndarray[Any, dtype[Any]]. Global indices of the transitions.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh).
+        """
+        indices = asarray(indices)
+        shards = indices // self._shard_size
+        selections = [flatnonzero(shards == shard) for shard in unique(shards)]
+        batch_parts = []
+        for selected in selections:
+            shard = int(shards[selected[0]])
+            with self._locks[shard]:
+                batch_parts.append(self._shards[shard]._get_batch(indices[selected] % self._shard_size))
+        # the parts are concatenated shard by shard, the order puts the transitions back in the order of the indices
+        order = argsort(concatenate(selections))
+        batch = [None if parts[0] is None else concatenate(parts)[order] for parts in zip(*batch_parts)]
+        if self._do_ooh:
+            batch[5] = self._ooh.transform(batch[1])
+        return tuple(batch)
+
+    def _sample_shard(self, shard: int, bounds: ndarray[Any, dtype[Any]]) -> Tuple[Any, Any, Tuple[Any, ...]]:
+        """
+        Descends the tree of the shard for its part of the batch under the shard's lock. Runs in the sampling threads.
+        :param shard: int. Shard.
+        :param bounds: ndarray[Any, dtype[Any]]. Upper bounds relative to the start of the shard's mass.
+        :return: Tuple[Any, Any, Tuple[Any, ...]]. Indices in the shard, their leaf priorities and the batch part.
+        """
+        memory = self._shards[shard]
+        with self._locks[shard]:
+            mass = memory._priority_tree.sum()
+            bounds = minimum(bounds, mass * (1 - 1e-12))
+            local_indices = minimum(memory._priority_tree.find_prefixsum_idx_batch(bounds.clip(0)),
+                                    memory._current_size - 1)
+            return local_indices, memory._priority_tree[local_indices], memory._get_batch(local_indices)
+
+    def update_priorities(self, indices: ndarray[Any, dtype[Any]], priorities: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Updates the priorities, each shard under its own lock.
+        :param indices: ndarray[Any, dtype[Any]]. Array of global indices to be updated.
+        :param priorities: ndarray[Any, dtype[Any]]. (k, 1) array.
+        """
+        indices = asarray(indices)
+        priorities = asarray(priorities, dtype=float).reshape(-1)
+        with self._max_priority_lock:
+            self._max_priority = max(self._max_priority, float(priorities.max()))
+        shards = indices // self._shard_size
+        for shard in unique(shards):
+            selected = shards == shard
+            with self._locks[shard]:
+                self._shards[shard].update_priorities(indices[selected] % self._shard_size, priorities[selected])
+
+    def _start_timing(self) -> int:
+        """
+        Gets the start time of the measured operation, if the telemetry is recorded.
+        :return: int. Time in nanoseconds, 0 without the telemetry.
+        """
+        return perf_counter_ns() if self._telemetry is not None else 0
+
+    def _record_add(self, start: int) -> None:
+        """
+        Records the add into the telemetry, if it is recorded.
+        :param start: int. Start time from _start_timing.
+        """
+        if self._telemetry is not None:
+            self._telemetry.record_add(perf_counter_ns() - start)
+
+    def _record_sample(self, start: int, indices: ndarray[Any, dtype[Any]], weights: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Records the sampling into the telemetry, if it is recorded. The ages are the numbers of the experience sets
+        added after the sampled ones.
+        :param start: int. Start time from _start_timing.
+        :param indices: ndarray[Any, dtype[Any]]. Global indices of the sampled transitions.
+        :param weights: ndarray[Any, dtype[Any]]. Importance sampling weights of the batch.
+        """
+        if self._telemetry is not None:
+            with self._n_added_lock:
+                ages = self._n_added - self._slot_stamps[indices]
+            self._telemetry.record_sample(perf_counter_ns() - start, ages, weights)
+
+    def get_telemetry_report(self) -> Dict[str, Any]:
+        """
+        Gets the telemetry of all the shards together, see ReplayBuffer.get_telemetry_report.
+        :return: Dict[str, Any].
+        """
+        if self._telemetry is None:
+            raise NoProperOptionInIf("Telemetry needs the buffer created with telemetry=True.")
+        priorities = []
+        memory_bytes = 0
+        for shard, memory in enumerate(self._shards):
+            with self._locks[shard]:
+                priorities.append(memory._get_priorities())
+                memory_bytes += memory.get_n_bytes()
+        return {
+            **self._telemetry.get_report(),
+            "size": self.get_current_size(),
+            "fill_level": self.get_current_size() / (self._n_shards * self._shard_size),
+            "memory_bytes": memory_bytes,
+            **self._telemetry.get_priority_report(concatenate(priorities))
+        }
+
+    def log_telemetry(self, reset: bool = True) -> None:
+        """
+        Logs the telemetry report by the Logger.
+        :param reset: bool. If True, the counters are reset after logging, so each report covers one period.
+        """
+        log_report(self.get_telemetry_report(), type(self).__name__)
+        if reset:
+            self._telemetry.reset()  # type:ignore
+
+    def save(self, folder: str) -> None:
+        """
+        Saves the whole state of all the shards into the subfolders of the folder.
+        :param folder: str. Folder for the checkpoint.
+        """
+        makedirs(folder, exist_ok=True)
+        for shard, memory in enumerate(self._shards):
+            with self._locks[shard]:
+                memory.save(join(folder, str(shard)))
+        save(join(folder, "slot_stamps.npy"), self._slot_stamps)
+        with open(join(folder, CHECKPOINT_STATE_FILE), "w", encoding="utf-8") as file:
+            dump(self._get_scalars(), file)
+
+    def load(self, folder: str, mmap_mode: Optional[str] = None) -> None:
+        """
+        Loads the state saved by save method. The buffer has to be created with the same parameters.
+        :param folder: str. Folder with the checkpoint.
+        :param mmap_mode: Optional[str]. See ReplayBuffer.load.
+        """
+        for shard, memory in enumerate(self._shards):
+            with self._locks[shard]:
+                memory.load(join(folder, str(shard)), mmap_mode)
+        self._slot_stamps[:] = load_array(join(folder, "slot_stamps.npy"))
+        with open(join(folder, CHECKPOINT_STATE_FILE), "r", encoding="utf-8") as file:
+            self._set_scalars(load(file))
+
+    def _get_scalars(self) -> Dict[str, Any]:
+        """
+        Gets the scalar state of the sharding, which has to be saved in the checkpoint.
+        :return: Dict[str, Any].
+        """
+        return {"n_round_robin": self._n_round_robin, "max_priority": self._max_priority, "n_added": self._n_added,
+                "rng_state": self._rng.bit_generator.state}
+
+    def _set_scalars(self, scalars: Dict[str, Any]) -> None:
+        """
+        Sets the scalar state loaded from the checkpoint.
+        :param scalars: Dict[str, Any].
+        """
+        self._n_round_robin = scalars["n_round_robin"]
+        self._max_priority = scalars["max_priority"]
+        self._n_added = scalars["n_added"]
+        self._rng.bit_generator.state = scalars["rng_state"]
+# pylint: enable=too-many-instance-attributes,protected-access
@@ -0,0 +1,648 @@
+"""
+Shared replay buffer.
+
+Variants of the replay buffers from src/data/replay_buffer.py with the storage in multiprocessing.shared_memory, so
+many actor processes can add the transitions into one buffer sampled by a learner process. Only the names of the
+shared memory blocks and the lock are pickled when the buffer is passed to a process, the transitions never go through
+pipes.
+
+Concurrency:
+- The shared header holds the number of the added transitions (the pointer is this modulo buffer size) and the size,
+  which counts only the committed slots.
+- Adding reserves the slots atomically under the lock and marks them as being written. The rows are written without
+  the lock, so the actors write in parallel, and the slots are committed under the lock again (with the maximal
+  priority for the prioritized buffer).
+- Sampling is done under the lock. A batch hitting a slot being written is redrawn a few times, then it is drawn from
+  the committed slots only (O(buffer size)), so the sampling never waits for a commit of another process.
+- get_not_overwritten uses the slot stamps, so the learner drops the priority updates of the slots overwritten since
+  the batch was read: n_added = memory.get_n_added() before the sample, then
+  fresh = memory.get_not_overwritten(indices, n_added) and memory.update_priorities(indices[fresh], ...).
+- Telemetry (telemetry=True) is recorded by each process separately, e.g. the learner's report covers the sampling.
+
+Usage:
+    memory = SharedReplayBuffer(state_dim, actions_dim, buffer_size, batch_size, n_actions)
+    actors = [Process(target=run_actor, args=(memory,)) for _ in range(n_actors)]  # run_actor calls memory.add
+    ...
+    memory.close()  # in every process, the creating one frees the shared memory
+The lock is created in the default multiprocessing context, the actor processes have to be started in the same one.
+"""
+from multiprocessing import Lock
+from os import getpid
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Tuple, Callable
+
+from numpy import ndarray, dtype, arange, int64, float64, full, prod, asarray, flatnonzero, count_nonzero
+
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, EVICTION_FIFO, PRIORITY_SAMPLING_TREE, \
+    SAMPLING_REPLACEMENT
+from src.exceptions.development_exception import NoProperOptionInIf
+
+HEADER_N_ADDED = 0
+HEADER_CURRENT_SIZE = 1  # number of the committed slots
+MAX_REDRAWS = 3  # redraws of the batch hitting a slot being written before drawing from the committed slots only
+
+
+class SharedArrays:
+    """
+    Numpy arrays in the shared memory blocks. The creating process owns the blocks, the other processes attach them by
+    names after unpickling (spawned processes) or inherit them (forked processes).
+    """
+
+    def __init__(self) -> None:
+        self._owner_pid = getpid()
+        self._blocks: Dict[str, SharedMemory] = {}
+        self._arrays: Dict[str, ndarray[Any, dtype[Any]]] = {}
+        self._descriptions: Dict[str, Tuple[str, Tuple[int, ...], Any]] = {}
+
+    def allocate(self, name: str, shape: Tuple[int, ...], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Allocates zero-filled array in a new shared memory block.
+        :param name: str. Name of the array.
+        :param shape: Tuple[int, ...]. Shape of the array.
+        :param data_type: Any. Data type of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        block = SharedMemory(create=True, size=max(1, int(prod(shape)) * dtype(data_type).itemsize))
+        self._blocks[name] = block
+        self._descriptions[name] = (block.name, shape, data_type)
+        self._arrays[name] = ndarray(shape, dtype=data_type, buffer=block.buf)
+        self._arrays[name][...] = 0
+        return self._arrays[name]
+
+    def get(self, name: str) -> ndarray[Any, dtype[Any]]:
+        """
+        Gets the shared array.
+        :param name: str. Name of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._arrays[name]
+
+    def get_name(self, storage_array: Any) -> Any:
+        """
+        Gets the name of the shared array.
+        :param storage_array: Any. Any object.
+        :return: Any. Name of the array, None if the object is not one of the shared arrays.
+        """
+        for name, shared_array in self._arrays.items():
+            if storage_array is shared_array:
+                return name
+        return None
+
+    def close(self) -> None:
+        """
+        Closes the blocks in this process. The owner frees them as well.
+        """
+        self._arrays = {}
+        for block in self._blocks.values():
+            block.close()
+            if getpid() == self._owner_pid:
+                block.unlink()
+        self._blocks = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Pickles only the names of the blocks.
+        :return: Dict[str, Any].
+        """
+        return {"descriptions": self._descriptions, "owner_pid": self._owner_pid}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Attaches the blocks by names.
+        :param state: Dict[str, Any].
+        """
+        self._owner_pid = state["owner_pid"]
+        self._descriptions = state["descriptions"]
+        self._blocks = {}
+        self._arrays = {}
+        for name, (block_name, shape, data_type) in self._descriptions.items():
+            self._blocks[name] = SharedMemory(name=block_name)
+            self._arrays[name] = ndarray(shape, dtype=data_type, buffer=self._blocks[name].buf)
+
+
+def _check_options(kwargs: Dict[str, Any]) -> None:
+    """
+    Checks that no option keeping the state in one process only is used.
+    :param kwargs: Dict[str, Any]. Other parameters of the buffer.
+    """
+    for option in ["deduplicate_next_states", "sequence_length", "storage_folder"]:
+        if kwargs.get(option):
+            raise NoProperOptionInIf(f"Option {option} is not supported by the shared buffer.")
+    if kwargs.get("observation_codec") is not None and kwargs["observation_codec"].is_compressed():
+        raise NoProperOptionInIf("Compressed observations are not supported by the shared buffer.")
+    if kwargs.get("eviction", EVICTION_FIFO) != EVICTION_FIFO:
+        raise NoProperOptionInIf("Only the oldest transitions can be overwritten in the shared buffer.")
+    if kwargs.get("priority_sampling", PRIORITY_SAMPLING_TREE) != PRIORITY_SAMPLING_TREE:
+        raise NoProperOptionInIf("Alias table does not see the transitions added by the other processes.")
+
+
+def _reserve(memory: Any, n_transitions: int) -> ndarray[Any, dtype[Any]]:
+    """
+    Reserves the slots for the transitions being added and marks them as being written. The process-local pointer is
+    set to the first slot, so the rows can be written by the methods of ReplayBuffer.
+    :param memory: Any. Shared buffer.
+    :param n_transitions: int. Number of the transitions.
+    :return: ndarray[Any, dtype[Any]]. Numbers of the stored transitions (the last buffer_size at most).
+    """
+    # pylint: disable=protected-access
+    with memory._lock:
+        n_added = int(memory._header[HEADER_N_ADDED])
+        memory._header[HEADER_N_ADDED] = n_added + n_transitions
+        numbers = arange(max(n_added, n_added + n_transitions - memory._buffer_size), n_added + n_transitions)
+        slots = numbers % memory._buffer_size
+        memory._header[HEADER_CURRENT_SIZE] -= count_nonzero(memory._slot_stamps[slots] > 0)
+        memory._slot_stamps[slots] = -1
+    memory._pointer = n_added % memory._buffer_size
+    return numbers
+    # pylint: enable=protected-access
+
+
+def _mark_committed(memory: Any, numbers: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+    """
+    Marks the written slots as ready for sampling and counts them into the size. Has to be called under the lock.
+    :param memory: Any. Shared buffer.
+    :param numbers: ndarray[Any, dtype[Any]]. Numbers of the stored transitions.
+    :return: ndarray[Any, dtype[Any]]. Committed slots.
+    """
+    # pylint: disable=protected-access
+    slots = numbers % memory._buffer_size
+    memory._header[HEADER_CURRENT_SIZE] += count_nonzero(memory._slot_stamps[slots] < 0)
+    memory._slot_stamps[slots] = numbers + 1
+    return slots
+    # pylint: enable=protected-access
+
+
+def _sync(memory: Any) -> None:
+    """
+    Copies the shared header into the process-local counters. Has to be called under the lock. The local size is the
+    range of the slots ever reserved, the indices are drawn from it.
+    :param memory: Any. Shared buffer.
+    """
+    # pylint: disable=protected-access
+    memory._n_added = int(memory._header[HEADER_N_ADDED])
+    memory._current_size = min(memory._n_added, memory._buffer_size)
+    memory._pointer = memory._n_added % memory._buffer_size
+    # pylint: enable=protected-access
+
+
+def _sample_written(memory: Any, sample_indices: Callable[[], ndarray[Any, dtype[Any]]], \
+                    sample_committed: Callable[[ndarray[Any, dtype[Any]]], ndarray[Any, dtype[Any]]]) \
+        -> ndarray[Any, dtype[Any]]:
+    """
+    Samples the indices, redraws if any slot is being written. Has to be called under the lock, so the slots being
+    written cannot be committed meanwhile and the batch is drawn from the committed slots after MAX_REDRAWS redraws.
+    :param memory: Any. Shared buffer.
+    :param sample_indices: Callable[[], ndarray[Any, dtype[Any]]]. Sampling method of the buffer.
+    :param sample_committed: Callable[[ndarray[Any, dtype[Any]]], ndarray[Any, dtype[Any]]]. Sampling from the given
+                             committed slots.
+    :return: ndarray[Any, dtype[Any]].
+    """
+    # pylint: disable=protected-access
+    for _ in range(1 + MAX_REDRAWS):
+        indices = sample_indices()
+        if not (memory._slot_stamps[indices] < 0).any():
+            return indices
+    return sample_committed(flatnonzero(memory._slot_stamps[:memory._current_size] > 0))
+    # pylint: enable=protected-access
+
+
+def _get_not_overwritten(memory: Any, indices: ndarray[Any, dtype[Any]], n_added: int) -> ndarray[Any, dtype[Any]]:
+    """
+    Says which slots still hold the committed experience sets they held when n_added experience sets were reserved.
+    :param memory: Any. Shared buffer.
+    :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+    :param n_added: int. Value of get_n_added at the time.
+    :return: ndarray[Any, dtype[Any]]. Boolean array.
+    """
+    # pylint: disable=protected-access
+    with memory._lock:
+        stamps = memory._slot_stamps[asarray(indices)]
+    # stamp is the number of the stored transition + 1, it is not positive while the slot is being written
+    return (stamps > 0) & (stamps <= n_added)
+    # pylint: enable=protected-access
+
+
+def _get_state(memory: Any) -> Dict[str, Any]:
+    """
+    Gets the state for pickling, the shared arrays are replaced by their names.
+    :param memory: Any. Shared buffer.
+    :return: Dict[str, Any].
+    """
+    # pylint: disable=protected-access
+    state = memory.__dict__.copy()
+    state["_shared_attributes"] = {}
+    for attribute, value in memory.__dict__.items():
+        name = memory._shared_arrays.get_name(value)
+        if name is not None:
+            state["_shared_attributes"][attribute] = name
+            state[attribute] = None
+    return state
+    # pylint: enable=protected-access
+
+
+def _set_state(memory: Any, state: Dict[str, Any]) -> None:
+    """
+    Sets the unpickled state, the shared arrays are attached.
+    :param memory: Any. Shared buffer.
+    :param state: Dict[str, Any].
+    """
+    shared_attributes = state.pop("_shared_attributes")
+    memory.__dict__.update(state)
+    for attribute, name in shared_attributes.items():
+        setattr(memory, attribute, state["_shared_arrays"].get(name))
+
+
+# pylint: disable=too-many-instance-attributes
+class SharedReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer in the shared memory for many actor processes and one learner process.
+    """
+
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 **kwargs: Any) -> None:
+        """
+        :param state_dim: int. Dimension of state space.
+        :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
+        :param buffer_size: int. Size of the buffer's memory.
+        :param batch_size: int. Size of the batch generated.
+        :param n_actions: int. Number of distinct actions.
+        :param kwargs: Any. Other parameters of ReplayBuffer. N-step transitions are aggregated in each actor. Options
+                       keeping the state in one process (deduplicate_next_states, sequence_length, storage_folder)
+                       are not supported.
+        """
+        _check_options(kwargs)
+        self._shared_arrays = SharedArrays()
+        self._lock = Lock()
+        ReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions, **kwargs)
+        self._header = self._allocate("header", (2,), int64)
+        # number of the stored transition + 1, -1 if the slot is being written
+        self._slot_stamps = self._allocate("slot_stamps", (buffer_size,), int64)
+
+    def _allocate(self, name: str, shape: Tuple[int, ...], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Allocates zero-filled storage array in the shared memory.
+        :param name: str. Name of the array.
+        :param shape: Tuple[int, ...]. Shape of the array.
+        :param data_type: Any. Data type of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._shared_arrays.allocate(name, shape, data_type)
+
+    def _store(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+               next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Stores one experience set in the reserved slot.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        """
+        numbers = _reserve(self, 1)
+        ReplayBuffer._store(self, state, action, reward, next_state, done)
+        self._commit(numbers)
+
+    def _add_rows(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]], discounts: Any = None) -> None:
+        """
+        Stores many experience sets in the reserved slots.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param discounts: Any. (n,) array of the n-step discounts, if n-step buffer.
+        """
+        numbers = _reserve(self, len(states))
+        ReplayBuffer._add_rows(self, states, actions, rewards, next_states, dones, discounts)
+        self._commit(numbers)
+
+    def _commit(self, numbers: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Marks the written slots as ready for sampling.
+        :param numbers: ndarray[Any, dtype[Any]]. Numbers of the stored transitions.
+        """
+        with self._lock:
+            _mark_committed(self, numbers)
+
+    def _sample_committed(self, committed: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Samples the indices uniformly from the committed slots, in the buffer's sampling mode.
+        :param committed: ndarray[Any, dtype[Any]]. Committed slots.
+        :return: ndarray[Any, dtype[Any]]. Array of indices.
+        """
+        return committed[self._rng.choice(committed.size, size=self._batch_size,
+                                          replace=self._sampling == SAMPLING_REPLACEMENT)]
+
+    def sample(self) -> Tuple[Any, ...]:
+        """
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh), followed by discounts if
+                 n-step buffer.
+        """
+        start = self._start_timing()
+        with self._lock:
+            _sync(self)
+            indices = _sample_written(self, self._sample_uniform_indices, self._sample_committed)
+            batch = self._get_batch(indices)
+            self._record_sample(start, indices)
+            return batch
+
+    def sample_many(self, n_batches: int) -> Tuple[Any, ...]:
+        """
+        Multi-batch sampling is not supported, the batches are sampled one by one under the lock.
+        :param n_batches: int. Number of the batches.
+        :return: Tuple[Any, ...].
+        """
+        raise NoProperOptionInIf("Multi-batch sampling is not supported by the shared buffer.")
+
+    def get_current_size(self) -> int:
+        """
+        Gets the current size.
+        """
+        return int(self._header[HEADER_CURRENT_SIZE])
+
+    def get_n_added(self) -> int:
+        """
+        Gets the total number of the experience sets added by all the processes.
+        :return: int.
+        """
+        return int(self._header[HEADER_N_ADDED])
+
+    def get_not_overwritten(self, indices: ndarray[Any, dtype[Any]], n_added: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Says which slots still hold the experience sets they held when n_added experience sets were added by all the
+        processes, the slots being written are overwritten.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :param n_added: int. Value of get_n_added at the time.
+        :return: ndarray[Any, dtype[Any]]. Boolean array.
+        """
+        return _get_not_overwritten(self, indices, n_added)
+
+    def _get_arrays(self) -> Dict[str, ndarray[Any, dtype[Any]]]:
+        """
+        Gets the storage arrays, the slot stamps included, which have to be saved in the checkpoint.
+        :return: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        arrays = ReplayBuffer._get_arrays(self)
+        arrays["slot_stamps"] = self._slot_stamps
+        return arrays
+
+    def _set_arrays(self, arrays: Dict[str, ndarray[Any, dtype[Any]]]) -> None:
+        """
+        Copies the arrays loaded from the checkpoint into the shared memory (mmap_mode has no effect).
+        :param arrays: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        for name, storage_array in self._get_arrays().items():
+            storage_array[...] = arrays[name]
+
+    def save(self, folder: str) -> None:
+        """
+        Saves the whole state of the buffer into the folder.
+        :param folder: str. Folder for the checkpoint.
+        """
+        with self._lock:
+            _sync(self)
+            ReplayBuffer.save(self, folder)
+
+    def load(self, folder: str, mmap_mode: Any = None) -> None:
+        """
+        Loads the state of the buffer saved by save method into the shared memory.
+        :param folder: str. Folder with the checkpoint.
+        :param mmap_mode: Any. Not used, the arrays are copied into the shared memory.
+        """
+        with self._lock:
+            ReplayBuffer.load(self, folder, mmap_mode)
+            self._header[HEADER_N_ADDED] = self._n_added
+            self._header[HEADER_CURRENT_SIZE] = count_nonzero(self._slot_stamps > 0)
+
+    def close(self) -> None:
+        """
+        Closes the shared memory in this process, the creating process frees it.
+        """
+        self._shared_arrays.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Pickles the buffer without the shared arrays, only their names.
+        :return: Dict[str, Any].
+        """
+        return _get_state(self)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Attaches the shared arrays.
+        :param state: Dict[str, Any].
+        """
+        _set_state(self, state)
+
+
+class SharedPrioritizedReplayBuffer(PrioritizedReplayBuffer):
+    """
+    Prioritized replay buffer in the shared memory for many actor processes and one learner process. The priority tree
+    and the maximal priority are shared as well.
+    """
+
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 alpha: float, **kwargs: Any) -> None:
+        """
+        :param state_dim: int. Dimension of state space.
+        :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
+        :param buffer_size: int. Size of the buffer's memory.
+        :param batch_size: int. Size of the batch generated.
+        :param n_actions: int. Number of distinct actions.
+        :param alpha: float. Prioritisation alpha parameter.
+        :param kwargs: Any. Other parameters of PrioritizedReplayBuffer, see SharedReplayBuffer.
+        """
+        _check_options(kwargs)
+        self._shared_arrays = SharedArrays()
+        self._lock = Lock()
+        PrioritizedReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions, alpha,
+                                         **kwargs)
+        self._header = self._allocate("header", (2,), int64)
+        self._slot_stamps = self._allocate("slot_stamps", (buffer_size,), int64)
+        self._shared_max_priority = self._allocate("max_priority", (1,), float64)
+        self._shared_max_priority[0] = self._max_priority
+
+    def _allocate(self, name: str, shape: Tuple[int, ...], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Allocates zero-filled storage array in the shared memory.
+        :param name: str. Name of the array.
+        :param shape: Tuple[int, ...]. Shape of the array.
+        :param data_type: Any. Data type of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        return self._shared_arrays.allocate(name, shape, data_type)
+
+    def _store(self, state: ndarray[Any, dtype[Any]], action: ndarray[Any, dtype[Any]], reward: float, \
+               next_state: ndarray[Any, dtype[Any]], done: bool) -> None:
+        """
+        Stores one experience set in the reserved slot.
+        :param state: ndarray[Any, dtype[Any]].
+        :param action: ndarray[Any, dtype[Any]].
+        :param reward: float.
+        :param next_state: ndarray[Any, dtype[Any]].
+        :param done: bool.
+        """
+        numbers = _reserve(self, 1)
+        ReplayBuffer._store(self, state, action, reward, next_state, done)
+        self._commit(numbers)
+
+    def _add_rows(self, states: ndarray[Any, dtype[Any]], actions: ndarray[Any, dtype[Any]], \
+                  rewards: ndarray[Any, dtype[Any]], next_states: ndarray[Any, dtype[Any]], \
+                  dones: ndarray[Any, dtype[Any]], discounts: Any = None) -> None:
+        """
+        Stores many experience sets in the reserved slots.
+        :param states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param actions: ndarray[Any, dtype[Any]]. (n, actions_dim) or (n,) array.
+        :param rewards: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param next_states: ndarray[Any, dtype[Any]]. (n, state_dim) array.
+        :param dones: ndarray[Any, dtype[Any]]. (n, 1) or (n,) array.
+        :param discounts: Any. (n,) array of the n-step discounts, if n-step buffer.
+        """
+        numbers = _reserve(self, len(states))
+        ReplayBuffer._add_rows(self, states, actions, rewards, next_states, dones, discounts)
+        self._commit(numbers)
+
+    def _commit(self, numbers: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Marks the written slots as ready for sampling and sets their maximal priority.
+        :param numbers: ndarray[Any, dtype[Any]]. Numbers of the stored transitions.
+        """
+        with self._lock:
+            slots = _mark_committed(self, numbers)
+            self._priority_tree.update_batch(slots, full(len(slots), self._shared_max_priority[0] ** self._alpha))
+
+    def _sample_committed(self, committed: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+        """
+        Samples the indices from the committed slots proportionally to their priorities, with replacement.
+        :param committed: ndarray[Any, dtype[Any]]. Committed slots.
+        :return: ndarray[Any, dtype[Any]]. Array of indices.
+        """
+        priorities = self._priority_tree[committed]
+        return committed[self._rng.choice(committed.size, size=self._batch_size, p=priorities / priorities.sum())]
+
+    # pylint: disable=arguments-differ
+    def sample(self, beta: float) -> Tuple[Any, ...]:  # type:ignore
+        """
+        Sample the batch from the buffer.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh, weights, indices),
+                 discounts follow actions_oh if n-step buffer.
+        """
+        start = self._start_timing()
+        with self._lock:
+            _sync(self)
+            indices = _sample_written(self, self._sample_indices, self._sample_committed)
+            batch = self._get_batch(indices) + (self._calculate_weights(indices, beta), indices)
+            self._record_sample(start, indices, batch[-2])
+            return batch
+
+    def sample_many(self, n_batches: int, beta: float) -> Tuple[Any, ...]:  # type:ignore
+        """
+        Multi-batch sampling is not supported, the batches are sampled one by one under the lock.
+        :param n_batches: int. Number of the batches.
+        :param beta: float. Beta parameter for calculation.
+        :return: Tuple[Any, ...].
+        """
+        raise NoProperOptionInIf("Multi-batch sampling is not supported by the shared buffer.")
+
+    # pylint: enable=arguments-differ
+
+    def update_priorities(self, indices: ndarray[Any, dtype[Any]], priorities: ndarray[Any, dtype[Any]]) -> None:
+        """
+        Updates the priorities in the shared tree and the shared maximal priority.
+        :param indices: ndarray[Any, dtype[Any]]. Array of indices to be updated.
+        :param priorities: ndarray[Any, dtype[Any]]. (k, 1) array.
+        """
+        with self._lock:
+            self._max_priority = float(self._shared_max_priority[0])
+            PrioritizedReplayBuffer.update_priorities(self, indices, priorities)
+            self._shared_max_priority[0] = self._max_priority
+
+    def get_current_size(self) -> int:
+        """
+        Gets the current size.
+        """
+        return int(self._header[HEADER_CURRENT_SIZE])
+
+    def get_n_added(self) -> int:
+        """
+        Gets the total number of the experience sets added by all the processes.
+        :return: int.
+        """
+        return int(self._header[HEADER_N_ADDED])
+
+    def get_not_overwritten(self, indices: ndarray[Any, dtype[Any]], n_added: int) -> ndarray[Any, dtype[Any]]:
+        """
+        Says which slots still hold the experience sets they held when n_added experience sets were added by all the
+        processes, the slots being written are overwritten.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :param n_added: int. Value of get_n_added at the time.
+        :return: ndarray[Any, dtype[Any]]. Boolean array.
+        """
+        return _get_not_overwritten(self, indices, n_added)
+
+    def _get_arrays(self) -> Dict[str, ndarray[Any, dtype[Any]]]:
+        """
+        Gets the storage arrays, the slot stamps included, which have to be saved in the checkpoint.
+        :return: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        arrays = PrioritizedReplayBuffer._get_arrays(self)
+        arrays["slot_stamps"] = self._slot_stamps
+        return arrays
+
+    def _set_arrays(self, arrays: Dict[str, ndarray[Any, dtype[Any]]]) -> None:
+        """
+        Copies the arrays loaded from the checkpoint into the shared memory (mmap_mode has no effect).
+        :param arrays: Dict[str, ndarray[Any, dtype[Any]]]. Name of the array and the array.
+        """
+        for name, storage_array in self._get_arrays().items():
+            storage_array[...] = arrays[name]
+
+    def save(self, folder: str) -> None:
+        """
+        Saves the whole state of the buffer into the folder.
+        :param folder: str. Folder for the checkpoint.
+        """
+        with self._lock:
+            _sync(self)
+            self._max_priority = float(self._shared_max_priority[0])
+            PrioritizedReplayBuffer.save(self, folder)
+
+    def load(self, folder: str, mmap_mode: Any = None) -> None:
+        """
+        Loads the state of the buffer saved by save method into the shared memory.
+        :param folder: str. Folder with the checkpoint.
+        :param mmap_mode: Any. Not used, the arrays are copied into the shared memory.
+        """
+        with self._lock:
+            PrioritizedReplayBuffer.load(self, folder, mmap_mode)
+            self._header[HEADER_N_ADDED] = self._n_added
+            self._header[HEADER_CURRENT_SIZE] = count_nonzero(self._slot_stamps > 0)
+            self._shared_max_priority[0] = self._max_priority
+
+    def close(self) -> None:
+        """
+        Closes the shared memory in this process, the creating process frees it.
+        """
+        self._shared_arrays.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Pickles the buffer without the shared arrays (the priority tree's nodes included), only their names.
+        :return: Dict[str, Any].
+        """
+        state = _get_state(self)
+        state["_priority_tree"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Attaches the shared arrays and the priority tree.
+        :param state: Dict[str, Any].
+        """
+        _set_state(self, state)
+        self._priority_tree = self._create_priority_tree()
+        self._priority_tree.set_nodes(self._shared_arrays.get("priority_tree"))
+# pylint: enable=too-many-instance-attributes
@@ -0,0 +1,287 @@
+"""
+Torch replay buffer.
+
+Variants of the replay buffers from src/data/replay_buffer.py delivering ready-to-train batches of torch tensors. The
+storage is shared between numpy (writing the transitions) and torch (gathering the batches) without copies, it is
+allocated in pinned memory when a CUDA device is used. Batches are gathered with index_select into reusable output
+tensors and copied to the device asynchronously, so a learn step does no numpy to torch conversion. Encoded states
+(see src/data/observation_codec.py) are copied encoded and decoded on the device, compressed storage is not supported.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from numpy import ndarray, dtype, flatnonzero, empty
+
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from src.exceptions.development_exception import NoProperOptionInIf
+
+
+# pylint: disable=no-member
+class TorchBatchGatherer:
+    """
+    Gathers rows of the storage arrays into reusable output tensors on the device.
+
+    NOTE: Returned tensors are reused by the next gathering of the same array and batch size, they must not be kept
+    between the samples.
+    """
+
+    def __init__(self, device: torch.device) -> None:
+        """
+        :param device: torch.device. Device the batches are delivered to.
+        """
+        self._device = device
+        self._pin_memory = device.type == "cuda"
+        self._host_outputs: Dict[Tuple[str, int], torch.Tensor] = {}
+        self._device_outputs: Dict[Tuple[str, int], torch.Tensor] = {}
+        self._copy_events: Dict[Tuple[str, int], Any] = {}
+
+    def is_pinning_memory(self) -> bool:
+        """
+        Says if the memory should be pinned for faster asynchronous copies to the device.
+        :return: bool.
+        """
+        return self._pin_memory
+
+    def _get_host_output(self, name: str, rows: int, like: torch.Tensor) -> torch.Tensor:
+        """
+        Gets the reusable host output tensor. Waits until its previous copy to the device finishes.
+        :param name: str. Name of the array.
+        :param rows: int. Number of rows of the output.
+        :param like: torch.Tensor. Tensor with the data type and row shape of the output.
+        :return: torch.Tensor.
+        """
+        key = (name, rows)
+        if key not in self._host_outputs:
+            self._host_outputs[key] = torch.empty((rows,) + tuple(like.shape[1:]), dtype=like.dtype,
+                                                  pin_memory=self._pin_memory)
+            self._device_outputs[key] = self._host_outputs[key] if self._device.type == "cpu" else \
+                torch.empty_like(self._host_outputs[key], device=self._device)
+        elif key in self._copy_events:
+            self._copy_events[key].synchronize()
+        return self._host_outputs[key]
+
+    def gather_host(self, name: str, storage: ndarray[Any, dtype[Any]], indices: torch.Tensor) -> torch.Tensor:
+        """
+        Gathers the rows of the storage into the reusable host output tensor.
+        :param name: str. Name of the array.
+        :param storage: ndarray[Any, dtype[Any]]. Storage array, viewed as tensor without copy.
+        :param indices: torch.Tensor. Int64 indices of the rows.
+        :return: torch.Tensor. Host output tensor.
+        """
+        source = torch.from_numpy(storage)
+        return torch.index_select(source, 0, indices, out=self._get_host_output(name, indices.shape[0], source))
+
+    def host_to_device(self, name: str, host_output: torch.Tensor) -> torch.Tensor:
+        """
+        Copies the host output tensor to its reusable device output tensor.
+        :param name: str. Name of the array.
+        :param host_output: torch.Tensor. Tensor returned by gather_host or from_host.
+        :return: torch.Tensor. Device output tensor.
+        """
+        key = (name, host_output.shape[0])
+        device_output = self._device_outputs[key]
+        if device_output is host_output:
+            return device_output
+        device_output.copy_(host_output, non_blocking=True)
+        self._copy_events[key] = torch.cuda.Event()
+        self._copy_events[key].record()
+        return device_output
+
+    def gather(self, name: str, storage: ndarray[Any, dtype[Any]], indices: torch.Tensor) -> torch.Tensor:
+        """
+        Gathers the rows of the storage and delivers them to the device.
+        :param name: str. Name of the array.
+        :param storage: ndarray[Any, dtype[Any]]. Storage array.
+        :param indices: torch.Tensor. Int64 indices of the rows.
+        :return: torch.Tensor. Device output tensor.
+        """
+        return self.host_to_device(name, self.gather_host(name, storage, indices))
+
+    def from_host(self, name: str, host_array: ndarray[Any, dtype[Any]]) -> torch.Tensor:
+        """
+        Delivers small host array computed per batch (e.g. weights) to the device.
+        :param name: str. Name of the array.
+        :param host_array: ndarray[Any, dtype[Any]].
+        :return: torch.Tensor. Device output tensor.
+        """
+        source = torch.from_numpy(host_array)
+        host_output = self._get_host_output(name, source.shape[0], source)
+        host_output.copy_(source)
+        return self.host_to_device(name, host_output)
+
+
+def _allocate_pinned(storage: ndarray[Any, dtype[Any]]) -> ndarray[Any, dtype[Any]]:
+    """
+    Moves the storage array into pinned memory, the returned numpy array is a view of the pinned tensor.
+    :param storage: ndarray[Any, dtype[Any]].
+    :return: ndarray[Any, dtype[Any]].
+    """
+    return torch.from_numpy(storage).pin_memory().numpy()  # type:ignore
+
+
+def _check_observation_codec(memory: ReplayBuffer) -> None:
+    """
+    Checks that the observations can be gathered from the storage array.
+    :param memory: ReplayBuffer.
+    """
+    if memory._observation_codec.is_compressed():  # pylint: disable=protected-access
+        raise NoProperOptionInIf("Compressed observations are not supported by the torch buffer.")
+
+
+def _decode_observations(memory: ReplayBuffer, observations: torch.Tensor) -> torch.Tensor:
+    """
+    Decodes the gathered observations on the device.
+    :param memory: ReplayBuffer. Buffer with the codec.
+    :param observations: torch.Tensor. Encoded observations.
+    :return: torch.Tensor. Observations in the data type of the states.
+    """
+    # pylint: disable=protected-access
+    codec = memory._observation_codec
+    if codec.is_identity(memory._data_types.states):
+        return observations
+    decoded = observations.to(torch.from_numpy(empty(0, dtype=memory._data_types.states)).dtype)
+    if codec.scale != 1. or codec.offset != 0.:
+        decoded = decoded * codec.scale + codec.offset
+    return decoded
+    # pylint: enable=protected-access
+
+
+def _get_torch_batch(memory: ReplayBuffer, gatherer: TorchBatchGatherer, indices: ndarray[Any, dtype[Any]]) -> \
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Gathers the transitions of the buffer as tensors on the device.
+    :param memory: ReplayBuffer. Buffer with the storage.
+    :param gatherer: TorchBatchGatherer.
+    :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+    :return: Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor]].
+             (states, actions, rewards, next_states, dons, actions_oh), followed by discounts if n-step buffer.
+    """
+    # pylint: disable=protected-access
+    indices_tensor = torch.from_numpy(indices.astype("int64", copy=False))
+    actions = gatherer.gather("actions", memory._actions_buffer, indices_tensor)
+    if memory._next_states_buffer is not None:
+        next_states = gatherer.gather("next_states", memory._next_states_buffer, indices_tensor)
+    else:
+        next_states_host = gatherer.gather_host("next_states", memory._states_buffer,
+                                                (indices_tensor + 1) % memory._buffer_size)
+        for position in flatnonzero(memory._next_state_in_side_store[indices]):
+            next_states_host[position] = torch.from_numpy(memory._side_next_states[int(indices[position])])
+        next_states = gatherer.host_to_device("next_states", next_states_host)
+    actions_ooh = None
+    if memory._do_ooh:
+        actions_ooh = F.one_hot(actions[:, 0].long(), memory._n_actions).float()
+    batch = (
+        _decode_observations(memory, gatherer.gather("states", memory._states_buffer, indices_tensor)),
+        actions,
+        gatherer.gather("rewards", memory._rewards_buffer, indices_tensor),
+        _decode_observations(memory, next_states),
+        gatherer.gather("dones", memory._done_buffer, indices_tensor),
+        actions_ooh
+    )
+    if memory._discounts_buffer is not None:
+        return batch + (gatherer.gather("discounts", memory._discounts_buffer, indices_tensor),)  # type:ignore
+    return batch
+    # pylint: enable=protected-access
+
+
+class TorchReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer sampling batches as torch tensors on the device.
+    """
+
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 device: Optional[torch.device] = None, **kwargs: Any) -> None:
+        """
+        :param state_dim: int. Dimension of state space.
+        :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
+        :param buffer_size: int. Size of the buffer's memory.
+        :param batch_size: int. Size of the batch generated.
+        :param n_actions: int. Number of distinct actions.
+        :param device: Optional[torch.device]. Device of the batches. If None, cuda:0 if available, otherwise cpu.
+        :param kwargs: Any. Other parameters of ReplayBuffer.
+        """
+        self._gatherer = TorchBatchGatherer(
+            device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        )
+        ReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions, **kwargs)
+        _check_observation_codec(self)
+
+    def _allocate(self, name: str, shape: Tuple[int, ...], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Allocates the storage array, in pinned memory if the device is CUDA and the storage is in RAM.
+        :param name: str. Name of the array, used as file name.
+        :param shape: Tuple[int, ...]. Shape of the array.
+        :param data_type: Any. Data type of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        storage = ReplayBuffer._allocate(self, name, shape, data_type)
+        if self._gatherer.is_pinning_memory() and self._storage_folder is None:
+            return _allocate_pinned(storage)
+        return storage
+
+    def _get_batch(self, indices: ndarray[Any, dtype[Any]]) -> Tuple[Any, Any, Any, Any, Any, Any]:
+        """
+        Gets the transitions from the storage as torch tensors on the device.
+        NOTE: Tensors are reused by the next sample.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: Tuple[Any, Any, Any, Any, Any, Any]. (states, actions, rewards, next_states, dons, actions_oh).
+        """
+        return _get_torch_batch(self, self._gatherer, indices)
+
+
+class TorchPrioritizedReplayBuffer(PrioritizedReplayBuffer):
+    """
+    Prioritized replay buffer sampling batches and weights as torch tensors on the device. Indices stay numpy array.
+    """
+
+    def __init__(self, state_dim: int, actions_dim: Any, buffer_size: int, batch_size: int, n_actions: int, \
+                 alpha: float, device: Optional[torch.device] = None, **kwargs: Any) -> None:
+        """
+        :param state_dim: int. Dimension of state space.
+        :param actions_dim: int. Dimension of actions dim (not the amount of actions!!).
+        :param buffer_size: int. Size of the buffer's memory.
+        :param batch_size: int. Size of the batch generated.
+        :param n_actions: int. Number of distinct actions.
+        :param alpha: float. Prioritisation alpha parameter.
+        :param device: Optional[torch.device]. Device of the batches. If None, cuda:0 if available, otherwise cpu.
+        :param kwargs: Any. Other parameters of PrioritizedReplayBuffer.
+        """
+        self._gatherer = TorchBatchGatherer(
+            device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        )
+        PrioritizedReplayBuffer.__init__(self, state_dim, actions_dim, buffer_size, batch_size, n_actions, alpha,
+                                         **kwargs)
+        _check_observation_codec(self)
+
+    def _allocate(self, name: str, shape: Tuple[int, ...], data_type: Any) -> ndarray[Any, dtype[Any]]:
+        """
+        Allocates the storage array, in pinned memory if the device is CUDA and the storage is in RAM.
+        :param name: str. Name of the array, used as file name.
+        :param shape: Tuple[int, ...]. Shape of the array.
+        :param data_type: Any. Data type of the array.
+        :return: ndarray[Any, dtype[Any]].
+        """
+        storage = PrioritizedReplayBuffer._allocate(self, name, shape, data_type)
+        if self._gatherer.is_pinning_memory() and self._storage_folder is None and name != "priority_tree":
+            return _allocate_pinned(storage)
+        return storage
+
+    def _get_batch(self, indices: ndarray[Any, dtype[Any]]) -> Tuple[Any, Any, Any, Any, Any, Any]:
+        """
+        Gets the transitions from the storage as torch tensors on the device.
+        NOTE: Tensors are reused by the next sample.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the transitions.
+        :return: Tuple[Any, Any, Any, Any, Any, Any]. (states, actions, rewards, next_states, dons, actions_oh).
+        """
+        return _get_torch_batch(self, self._gatherer, indices)
+
+    def _calculate_weights(self, indices: ndarray[Any, dtype[Any]], beta: float) -> Any:
+        """
+        Calculates the weights for the whole batch and delivers them to the device.
+        :param indices: ndarray[Any, dtype[Any]]. Indices of the experiences for which it has to be calculated.
+        :param beta: float. Beta parameter for calculation.
+        :return: Any. (batch_size, 1) tensor of weights.
+        """
+        return self._gatherer.from_host("weights", PrioritizedReplayBuffer._calculate_weights(self, indices, beta))
+# pylint: enable=no-member
@@ -3,19 +3,29 @@ Agents
 """
 from abc import abstractmethod, ABC
 from datetime import datetime
-from typing import Any, List, Tuple
+from typing import Any, Iterator, List, Tuple, Optional
 
 import torch
 import torch.nn.functional as F
-from numpy import argmax, ndarray, dtype
+from numpy import argmax, ndarray, dtype, float32, int64, arange
 from numpy.random import random
 from torch import optim
 from torch.nn.utils import clip_grad_norm_  # type:ignore
 
-from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from src.data.prefetching_sampler import PrefetchingSampler
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, ReplayBufferDataTypes
+from src.exceptions.development_exception import NoProperOptionInIf
 from src.utils.date_time_functions import convert_datetime_to_string_date
 
 
+# storage data types matching the networks' inputs, so sampled batches need no conversion (gather needs int64)
+AGENT_DATA_TYPES = ReplayBufferDataTypes(states=float32, actions=int64, rewards=float32, dones=float32)
+# transitions per forward pass of the priority refresh
+DEFAULT_REFRESH_BATCH_SIZE = 4096
+# methods of the buffer read by the priority refresh
+REFRESH_METHODS = ["get_transitions", "get_n_added", "get_not_overwritten"]
+
+
 # pylint: disable = no-member
 class BaseAgent(ABC):
     """
@@ -25,6 +35,8 @@ class BaseAgent(ABC):
     def __init__(self, env: Any, replay_buffer: Any, gamma: float) -> None:
         self._env = env
         self._memory = replay_buffer
+        # buffers without multi-batch sampling are sampled batch by batch
+        self._sample_many_supported = hasattr(replay_buffer, "sample_many")
 
         self._experience: List[Any]  # variable for collecting one-step experience
 
@@ -87,6 +99,27 @@ class BaseAgent(ABC):
         Learns from the experience collected.
         """
 
+    def _sample_minibatches(self, n_batches: int, *sample_arguments: Any) -> Iterator[Tuple[Any, ...]]:
+        """
+        Samples the minibatches of one learning step. More batches are sampled by one call of the buffer's sample_many
+        and iterated as views, the prefetching sampler delivers them one by one from its queue. The buffers without
+        multi-batch sampling (e.g. the shared ones) are sampled by sample for each batch.
+        :param n_batches: int. Number of the minibatches (gradient steps).
+        :param sample_arguments: Any. Arguments of the buffer's sample (beta for the prioritized buffer).
+        :return: Iterator[Tuple[Any, ...]]. Batches as returned by the buffer's sample.
+        """
+        if n_batches > 1 and self._sample_many_supported and not isinstance(self._memory, PrefetchingSampler):
+            try:
+                batches = self._memory.sample_many(n_batches, *sample_arguments)
+            except NoProperOptionInIf:
+                self._sample_many_supported = False
+            else:
+                for batch in range(n_batches):
+                    yield tuple(None if part is None else part[batch] for part in batches)
+                return
+        for _ in range(n_batches):
+            yield self._memory.sample(*sample_arguments)
+
     def save_model(self) -> str:
         """
         Saves the model.
@@ -97,6 +130,22 @@ class BaseAgent(ABC):
 
         return file_name
 
+    def save_memory(self, folder: str) -> None:
+        """
+        Saves the whole replay buffer (arrays, pointers and priorities), so a preempted run can be resumed.
+        :param folder: str. Folder for the checkpoint.
+        """
+        self._memory.save(folder)
+
+    def load_memory(self, folder: str, mmap_mode: Optional[str] = None) -> None:
+        """
+        Loads the replay buffer saved by save_memory.
+        :param folder: str. Folder with the checkpoint.
+        :param mmap_mode: Optional[str]. If None, arrays are read into RAM, otherwise they are memory-mapped (see
+                          ReplayBuffer.load).
+        """
+        self._memory.load(folder, mmap_mode)
+
 
 # pylint: disable=too-many-instance-attributes
 class DQNAgent(BaseAgent):
@@ -105,14 +154,21 @@ class DQNAgent(BaseAgent):
     """
 
     def __init__(self, env: Any, actions_dim: int, memory_size: int, batch_size: int, q_network_class: Any, \
-                 gamma: float) -> None:
-        replay_buffer = ReplayBuffer(
+                 gamma: float, replay_buffer_class: Any = ReplayBuffer, n_step: int = 1, \
+                 prefetch_batches: int = 0, gradient_steps: int = 1) -> None:
+        replay_buffer = replay_buffer_class(
             state_dim=env.observation_space.shape[0],
             actions_dim=actions_dim,
             buffer_size=memory_size,
             batch_size=batch_size,
-            n_actions=env.action_space.n
+            n_actions=env.action_space.n,
+            data_types=AGENT_DATA_TYPES,
+            n_step=n_step,
+            gamma=gamma
         )
+        if prefetch_batches > 0:
+            # batches are sampled in the background thread while the agent steps the environment
+            replay_buffer = PrefetchingSampler(replay_buffer, n_batches=prefetch_batches, batch_size=batch_size)
         BaseAgent.__init__(self, env=env, replay_buffer=replay_buffer, gamma=gamma)
 
         self._q_network_local = q_network_class(
@@ -129,6 +185,8 @@ class DQNAgent(BaseAgent):
 
         self._steps = 0
         self._batch_size = batch_size
+        # minibatches (gradient steps) of one learning step, a higher replay ratio
+        self._gradient_steps = gradient_steps
 
         self._update_every_steps = 2
         self._hard_update_every_steps = 8
@@ -163,34 +221,44 @@ class DQNAgent(BaseAgent):
         self._steps = (self._steps + 1) % (self._update_every_steps * self._hard_update_every_steps)
         if self._steps % self._update_every_steps == 0:
             if self._memory.get_current_size() >= self._batch_size:
-                states, actions, rewards, next_states, dons, _ = self._memory.sample()
-
-                states = torch.from_numpy(states).float().to(self._device)
-                actions = torch.from_numpy(actions).long().to(self._device)
-                rewards = torch.from_numpy(rewards).float().to(self._device)
-                next_states = torch.from_numpy(next_states).float().to(self._device)
-                dons = torch.from_numpy(dons).float().to(self._device)
-
-                # Get max predicted Q values (for next states) from target model
-                q_targets_next = self._q_network_target(next_states).detach().max(1)[0].unsqueeze(1)
-                # Compute Q targets for current states
-                q_targets = rewards + (self._gamma * q_targets_next * (1 - dons))
-
-                # Get expected Q values from local model
-                q_expected = self._q_network_local(states).gather(1, actions)
-
-                # Compute loss
-                loss = F.mse_loss(q_expected, q_targets)
-                # Minimize the loss
-                self._optimizer.zero_grad()
-                loss.backward()  # type:ignore
-                # gradient clipping
-                clip_grad_norm_(self._q_network_local.parameters(), 10.0)
-                self._optimizer.step()
+                for batch in self._sample_minibatches(self._gradient_steps):
+                    self._learn_from_batch(batch)
 
         if self._steps % self._hard_update_every_steps == 0:
             self._hard_update(self._q_network_local, self._q_network_target, self._tau)
 
+    def _learn_from_batch(self, batch: Tuple[Any, ...]) -> None:
+        """
+        Makes one gradient step on the batch.
+        :param batch: Tuple[Any, ...]. Batch of the buffer's sample.
+        """
+        states, actions, rewards, next_states, dons, _, *discounts = batch
+
+        states = torch.as_tensor(states, device=self._device)
+        actions = torch.as_tensor(actions, device=self._device)
+        rewards = torch.as_tensor(rewards, device=self._device)
+        next_states = torch.as_tensor(next_states, device=self._device)
+        dons = torch.as_tensor(dons, device=self._device)
+        # discounts of the bootstrapped values, gamma ** n for the n-step transitions
+        discount = torch.as_tensor(discounts[0], device=self._device) if discounts else self._gamma
+
+        # Get max predicted Q values (for next states) from target model
+        q_targets_next = self._q_network_target(next_states).detach().max(1)[0].unsqueeze(1)
+        # Compute Q targets for current states
+        q_targets = rewards + (discount * q_targets_next * (1 - dons))
+
+        # Get expected Q values from local model
+        q_expected = self._q_network_local(states).gather(1, actions)
+
+        # Compute loss
+        loss = F.mse_loss(q_expected, q_targets)
+        # Minimize the loss
+        self._optimizer.zero_grad()
+        loss.backward()  # type:ignore
+        # gradient clipping
+        clip_grad_norm_(self._q_network_local.parameters(), 10.0)
+        self._optimizer.step()
+
     @staticmethod
     def _hard_update(local_model: Any, target_model: Any, tau: float) -> None:
         """
@@ -211,15 +279,25 @@ class DQNAgentPER(BaseAgent):
     """
 
     def __init__(self, env: Any, actions_dim: int, memory_size: int, batch_size: int, q_network_class: Any, \
-                 gamma: float, alpha: float) -> None:
-        replay_buffer = PrioritizedReplayBuffer(
+                 gamma: float, alpha: float, replay_buffer_class: Any = PrioritizedReplayBuffer, \
+                 n_step: int = 1, prefetch_batches: int = 0, gradient_steps: int = 1, refresh_every: int = 0, \
+                 refresh_budget: Optional[int] = None, refresh_batch_size: int = DEFAULT_REFRESH_BATCH_SIZE) -> None:
+        replay_buffer = replay_buffer_class(
             state_dim=env.observation_space.shape[0],
             actions_dim=actions_dim,
             buffer_size=memory_size,
             batch_size=batch_size,
             n_actions=env.action_space.n,
-            alpha=alpha
+            alpha=alpha,
+            data_types=AGENT_DATA_TYPES,
+            n_step=n_step,
+            gamma=gamma
         )
+        if refresh_every > 0 and not all(hasattr(replay_buffer, method) for method in REFRESH_METHODS):
+            raise NoProperOptionInIf(f"Priority refresh needs the buffer with {', '.join(REFRESH_METHODS)}.")
+        if prefetch_batches > 0:
+            # batches are sampled in the background thread while the agent steps the environment
+            replay_buffer = PrefetchingSampler(replay_buffer, n_batches=prefetch_batches, batch_size=batch_size)
         BaseAgent.__init__(self, env=env, replay_buffer=replay_buffer, gamma=gamma)
 
         self._q_network_local = q_network_class(
@@ -236,6 +314,8 @@ class DQNAgentPER(BaseAgent):
 
         self._steps = 0
         self._batch_size = batch_size
+        # minibatches (gradient steps) of one learning step, a higher replay ratio
+        self._gradient_steps = gradient_steps
 
         self._update_every_steps = 2
         self._hard_update_every_steps = 8
@@ -243,6 +323,14 @@ class DQNAgentPER(BaseAgent):
 
         self._per_epsilon = 1e-6
 
+        # priority refresh - every refresh_every learning steps the priorities of refresh_budget stored transitions
+        # (all of them if None) are recomputed by the current networks, in chunks of refresh_batch_size
+        self._refresh_every = refresh_every
+        self._refresh_budget = refresh_budget
+        self._refresh_batch_size = refresh_batch_size
+        self._n_learn_calls = 0
+        self._refresh_cursor = 0
+
     def set_optimizing_parameters(self, update_every_steps: int, hard_update_every_steps: int, tau: float) -> None:
         """
         Sets neural network training parameters.
@@ -276,46 +364,100 @@ class DQNAgentPER(BaseAgent):
         self._steps = (self._steps + 1) % (self._update_every_steps * self._hard_update_every_steps)
         if self._steps % self._update_every_steps == 0:
             if self._memory.get_current_size() >= self._batch_size:
-                states, actions, rewards, next_states, dons, _, weights, indices = self._memory.sample(beta)
-
-                states = torch.from_numpy(states).float().to(self._device)
-                actions = torch.from_numpy(actions).long().to(self._device)
-                rewards = torch.from_numpy(rewards).float().to(self._device)
-                next_states = torch.from_numpy(next_states).float().to(self._device)
-                dons = torch.from_numpy(dons).float().to(self._device)
-                weights = torch.from_numpy(weights).float().to(self._device)
-
-                # Get max predicted Q values (for next states) from target model
-                q_targets_next = self._q_network_target(next_states).detach().max(1)[0].unsqueeze(1)
-                # Compute Q targets for current states
-                # q_targets = rewards + (self._gamma * q_targets_next * (1 - dons))
-                q_targets = rewards + (self._gamma * q_targets_next * (1 - dons))
-
-                # Get expected Q values from local model
-                q_expected = self._q_network_local(states).gather(1, actions)
-
-                # compute element-wise loss + per importance sampling (PER)
-                # loss = F.mse_loss(q_expected, q_targets) # not element
-                loss_elements = F.smooth_l1_loss(q_expected, q_targets, reduction="none")
-                loss = torch.mean(loss_elements * weights)
-
-                # Minimize the loss
-                self._optimizer.zero_grad()
-                loss.backward()  # type:ignore
-                # gradient clipping
-                clip_grad_norm_(self._q_network_local.parameters(), 10.0)
-                self._optimizer.step()
-
-                # PER - update priorities
-                loss_for_prior = loss_elements.detach().cpu().numpy()
-                new_priorities = loss_for_prior + self._per_epsilon
-                self._memory.update_priorities(indices, new_priorities)
+                for batch in self._sample_minibatches(self._gradient_steps, beta):
+                    self._learn_from_batch(batch)
 
         if self._steps % self._hard_update_every_steps == 0:
             self._hard_update(self._q_network_local, self._q_network_target, self._tau)
 
+        self._n_learn_calls += 1
+        if self._refresh_every > 0 and self._n_learn_calls % self._refresh_every == 0:
+            self.refresh_priorities()
+
     # pylint: enable=arguments-differ
 
+    def refresh_priorities(self) -> None:
+        """
+        Recomputes the priorities of the next refresh_budget stored transitions (all of them if None) by the current
+        networks and writes them into the buffer, so the transitions not sampled for a long time do not keep their
+        stale priorities. The transitions are streamed in chunks of refresh_batch_size, rounded up to whole chunks, and
+        the next refresh continues where this one stopped. The chunks are not larger than the filled part of the buffer.
+        The priorities of the slots overwritten since the chunk was read (by the actors of the shared or sharded buffer
+        or by the adds between the prefetched batches) are not updated.
+        """
+        size = self._memory.get_current_size()
+        if size == 0:
+            return
+        batch_size = min(self._refresh_batch_size, size)
+        budget = size if self._refresh_budget is None else min(self._refresh_budget, size)
+        n_chunks = -(-budget // batch_size)
+        slots = (self._refresh_cursor + arange(n_chunks * batch_size)) % size
+        self._refresh_cursor = int((self._refresh_cursor + slots.size) % size)
+        with torch.inference_mode():
+            for indices in slots.reshape((n_chunks, batch_size)):
+                n_added = self._memory.get_n_added()
+                loss_elements = self._get_loss_elements(self._memory.get_transitions(indices))
+                priorities = loss_elements.cpu().numpy() + self._per_epsilon
+                if isinstance(self._memory, PrefetchingSampler):
+                    self._memory.update_priorities(indices, priorities, n_added=n_added)
+                else:
+                    fresh = self._memory.get_not_overwritten(indices, n_added)
+                    self._memory.update_priorities(indices[fresh], priorities[fresh])
+
+    def _get_loss_elements(self, transitions: Tuple[Any, ...]) -> torch.Tensor:
+        """
+        Calculates the element-wise loss of the TD errors of the transitions.
+        :param transitions: Tuple[Any, ...]. (states, actions, rewards, next_states, dons, actions_oh), followed by
+                            discounts if n-step buffer.
+        :return: torch.Tensor. (n, 1) tensor.
+        """
+        states, actions, rewards, next_states, dons, _, *discounts = transitions
+
+        states = torch.as_tensor(states, device=self._device)
+        actions = torch.as_tensor(actions, device=self._device)
+        rewards = torch.as_tensor(rewards, device=self._device)
+        next_states = torch.as_tensor(next_states, device=self._device)
+        dons = torch.as_tensor(dons, device=self._device)
+        # discounts of the bootstrapped values, gamma ** n for the n-step transitions
+        discount = torch.as_tensor(discounts[0], device=self._device) if discounts else self._gamma
+
+        # Get max predicted Q values (for next states) from target model
+        q_targets_next = self._q_network_target(next_states).detach().max(1)[0].unsqueeze(1)
+        # Compute Q targets for current states
+        # q_targets = rewards + (self._gamma * q_targets_next * (1 - dons))
+        q_targets = rewards + (discount * q_targets_next * (1 - dons))
+
+        # Get expected Q values from local model
+        q_expected = self._q_network_local(states).gather(1, actions)
+
+        # compute element-wise loss
+        # loss = F.mse_loss(q_expected, q_targets) # not element
+        return F.smooth_l1_loss(q_expected, q_targets, reduction="none")
+
+    def _learn_from_batch(self, batch: Tuple[Any, ...]) -> None:
+        """
+        Makes one gradient step on the batch and updates the priorities of its transitions.
+        :param batch: Tuple[Any, ...]. Batch of the buffer's sample.
+        """
+        *transitions, weights, indices = batch
+        weights = torch.as_tensor(weights, device=self._device)
+
+        # element-wise loss + per importance sampling (PER)
+        loss_elements = self._get_loss_elements(tuple(transitions))
+        loss = torch.mean(loss_elements * weights)
+
+        # Minimize the loss
+        self._optimizer.zero_grad()
+        loss.backward()  # type:ignore
+        # gradient clipping
+        clip_grad_norm_(self._q_network_local.parameters(), 10.0)
+        self._optimizer.step()
+
+        # PER - update priorities
+        loss_for_prior = loss_elements.detach().cpu().numpy()
+        new_priorities = loss_for_prior + self._per_epsilon
+        self._memory.update_priorities(indices, new_priorities)
+
     @staticmethod
     def _hard_update(local_model: Any, target_model: Any, tau: float) -> None:
         """
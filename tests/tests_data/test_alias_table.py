@@ -0,0 +1,59 @@
+"""
+Tests
+"""
+import pytest
+from numpy import array, arange, allclose, bincount, zeros
+from numpy.random import default_rng
+
+from src.data.alias_table import AliasTable
+from src.exceptions.development_exception import NoProperOptionInIf
+
+
+@pytest.mark.parametrize("weights", [
+    array([1., 2., 3., 4.]),
+    array([5.]),
+    array([0., 0., 7., 0., 1.]),
+    array([1., 1., 1.]),
+    default_rng(0).pareto(1., 1000),
+    array([0., 4., 4., 2., 2., 2., 1., 0., 0., 0., 4., 3., 4., 2., 4., 3., 2., 1., 4., 2., 4., 3., 3., 1., 0.]),
+    array([.1] * 10),
+])
+def test_probabilities(weights: array) -> None:
+    """
+    Tests that the table gives exactly the probabilities proportional to the weights, also with the zero weights and
+    the large columns exhausted by one another.
+    """
+    assert allclose(AliasTable(weights).get_probabilities(), weights / weights.sum(), rtol=0., atol=1e-12)
+
+
+@pytest.mark.parametrize("size", [5, 25, 100, 1000])
+def test_probabilities_of_tied_weights(size: int) -> None:
+    """
+    Tests the probabilities of many tied integer weights, whose cumulative deficits and surpluses meet up to the float
+    rounding.
+    """
+    rng = default_rng(size)
+    for _ in range(100):
+        weights = rng.integers(0, 5, size).astype(float)
+        if weights.sum() > 0:
+            assert allclose(AliasTable(weights).get_probabilities(), weights / weights.sum(), rtol=0., atol=1e-12)
+
+
+def test_sampling() -> None:
+    """
+    Tests the frequencies of the sampled elements and that the elements with zero weight are never sampled.
+    """
+    weights = array([1., 0., 2., 3., 4., 0.])
+    samples = AliasTable(weights).sample(default_rng(1), 200000)
+    counts = bincount(samples, minlength=6)
+    assert counts[1] == 0 and counts[5] == 0 and counts.sum() == 200000
+    assert allclose(counts / 200000, weights / weights.sum(), atol=0.005)
+
+
+def test_no_positive_weight() -> None:
+    """
+    Tests that the table of zero weights raises the exception.
+    """
+    with pytest.raises(NoProperOptionInIf):
+        AliasTable(zeros(4))
+    assert AliasTable(arange(3.)).sample(default_rng(2), 10).min() >= 1
@@ -0,0 +1,64 @@
+"""
+Tests
+"""
+import pytest
+from numpy import array, array_equal, arange, uint8, float16, float32, zeros, full, tile, allclose
+from numpy.random import default_rng
+
+from src.data.observation_codec import ObservationCodec, CompressedObservationStorage
+from src.exceptions.development_exception import NoProperOptionInIf
+
+STATE_DIM = 6
+
+
+def test_quantization() -> None:
+    """
+    Tests that the quantized observations are decoded with the error of half of the step at most and the values out of
+    the range are clipped.
+    """
+    codec = ObservationCodec(uint8, low=-1., high=1.)
+    observations = default_rng(0).uniform(-1., 1., size=(100, STATE_DIM))
+    encoded = codec.encode(observations)
+    assert encoded.dtype == uint8
+    assert allclose(codec.decode(encoded, float32), observations, rtol=0, atol=1. / 255 + 1e-6)
+    assert array_equal(codec.encode(array([-5., 5.])), array([0, 255]))
+    assert not codec.is_identity(float32) and ObservationCodec(float16).decode(array([0.5], dtype=float16),
+                                                                                float32).dtype == float32
+    with pytest.raises(NoProperOptionInIf):
+        ObservationCodec(float16, low=0., high=1.)
+
+
+@pytest.mark.parametrize("buffer_size,chunk_size", [(10, 4), (12, 3), (7, 7), (5, 1)])
+def test_compressed_storage(buffer_size: int, chunk_size: int) -> None:
+    """
+    Tests that the compressed storage reads the same rows as the plain array written the same way, also after the
+    checkpoint arrays are set.
+    """
+    storage = CompressedObservationStorage(buffer_size, STATE_DIM, ObservationCodec(uint8, chunk_size=chunk_size))
+    plain = zeros((buffer_size, STATE_DIM), dtype=uint8)
+    rng = default_rng(1)
+    pointer = 0
+    for n_rows in [1, 3, buffer_size, 2, 1, buffer_size - 1, 4]:
+        rows = rng.integers(0, 256, size=(min(n_rows, buffer_size), STATE_DIM)).astype(uint8)
+        storage.write(pointer, rows)
+        for row in rows:
+            plain[pointer] = row
+            pointer = (pointer + 1) % buffer_size
+        indices = rng.integers(0, buffer_size, size=(3, 4))
+        assert array_equal(storage.read(indices), plain[indices])
+
+    restored = CompressedObservationStorage(buffer_size, STATE_DIM, ObservationCodec(uint8, chunk_size=chunk_size))
+    restored.set_arrays(*storage.get_arrays())
+    assert array_equal(restored.read(arange(buffer_size)), plain)
+
+
+def test_compression_of_redundant_observations() -> None:
+    """
+    Tests that the chunks of frames with a constant background take a fraction of their raw size.
+    """
+    storage = CompressedObservationStorage(256, 84 * 84, ObservationCodec(uint8, chunk_size=16))
+    frames = tile(full((84, 84), 90, dtype=uint8), (256, 1, 1))
+    for i, frame in enumerate(frames):
+        frame[i % 80:i % 80 + 4, 40:44] = 255
+    storage.write(0, frames.reshape(256, -1))
+    assert storage.get_n_bytes() < 256 * 84 * 84 / 10
@@ -0,0 +1,103 @@
+"""
+Tests
+"""
+import pytest
+import torch
+from numpy import array, array_equal, allclose
+
+from src.data.prefetching_sampler import PrefetchingSampler
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.2
+BETA = 0.9
+
+
+def add_transitions(memory: PrefetchingSampler, start: int, n_transitions: int) -> None:
+    """
+    Adds the transitions through the sampler.
+    :param memory: PrefetchingSampler.
+    :param start: int. Number of the first transition.
+    :param n_transitions: int. Number of transitions added.
+    """
+    for i in range(start, start + n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+
+
+def test_prefetched_batches() -> None:
+    """
+    Tests that the prefetched batches are tensors of the transitions stored in the buffer, not changed by the later
+    sampling.
+    """
+    memory = PrefetchingSampler(ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=50,
+                                             batch_size=8, n_actions=N_ACTIONS, seed=1),
+                                n_batches=3, batch_size=8, device=torch.device("cpu"))
+    add_transitions(memory, 0, 30)
+    batches = [memory.sample() for _ in range(10)]
+    memory.close()
+    for states, actions, rewards, next_states, dones, actions_oh in batches:
+        assert isinstance(states, torch.Tensor) and states.shape == (8, STATE_DIM) and actions_oh.shape == (8, 10)
+        assert array_equal(rewards[:, 0].numpy(), states[:, 0].numpy()) and \
+               array_equal(actions[:, 0].numpy(), states[:, 0].numpy() % N_ACTIONS) and \
+               array_equal(next_states[:, 0].numpy(), states[:, 0].numpy() + 1) and not dones.any()
+
+
+def test_prefetched_priority_updates() -> None:
+    """
+    Tests that the priorities of the prefetched batch are updated only for the slots not overwritten since it was
+    sampled.
+    """
+    prioritized_memory = PrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                 batch_size=16, n_actions=N_ACTIONS, alpha=ALPHA, seed=2)
+    memory = PrefetchingSampler(prioritized_memory, n_batches=1, batch_size=16, device=torch.device("cpu"))
+    add_transitions(memory, 0, 16)
+    states, _, _, _, _, _, weights, indices = memory.sample(BETA)
+    memory.close()
+    assert weights.shape == (16, 1) and array_equal(states[:, 0].numpy(), indices)
+
+    add_transitions(memory, 16, 4)  # overwrites the slots 0, ..., 3
+    memory.update_priorities(indices, array([10.] * 16))
+    priorities = prioritized_memory._priority_tree[array(range(16))]  # pylint: disable=protected-access
+    assert allclose(priorities, [10. ** ALPHA if slot in indices and slot >= 4 else 1. for slot in range(16)])
+
+
+def test_priority_updates_of_read_transitions() -> None:
+    """
+    Tests that the priorities of the transitions read by get_transitions are filtered by the number of the stored
+    experience sets at the reading, not by the one of the last returned batch.
+    """
+    prioritized_memory = PrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                 batch_size=16, n_actions=N_ACTIONS, alpha=ALPHA, seed=3)
+    memory = PrefetchingSampler(prioritized_memory, n_batches=1, batch_size=16, device=torch.device("cpu"))
+    add_transitions(memory, 0, 16)
+    memory.sample(BETA)
+    memory.close()
+
+    add_transitions(memory, 16, 4)  # overwrites the slots 0, ..., 3 after the last returned batch
+    indices = array(range(16))
+    n_added = memory.get_n_added()
+    states, *_ = memory.get_transitions(indices)
+    assert n_added == 20 and array_equal(states[:4, 0].numpy(), [16, 17, 18, 19])
+    add_transitions(memory, 20, 2)  # overwrites the slots 4 and 5 after the reading
+    memory.update_priorities(indices, array([10.] * 16), n_added=n_added)
+    priorities = prioritized_memory._priority_tree[indices]  # pylint: disable=protected-access
+    assert allclose(priorities, [1. if slot in (4, 5) else 10. ** ALPHA for slot in range(16)])
+
+
+def test_sampling_exception() -> None:
+    """
+    Tests that the exception of the sampling in the background thread is raised by sample instead of waiting forever,
+    and that the sampling can be started again.
+    """
+    memory = PrefetchingSampler(ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=50,
+                                             batch_size=8, n_actions=N_ACTIONS, seed=4),
+                                n_batches=2, batch_size=4, device=torch.device("cpu"))
+    add_transitions(memory, 0, 5)  # enough for the sampler, too few for the batch of the buffer
+    with pytest.raises(ValueError):
+        memory.sample()
+    add_transitions(memory, 5, 10)
+    states, *_ = memory.sample()
+    memory.close()
+    assert states.shape == (8, STATE_DIM)
@@ -0,0 +1,121 @@
+"""
+Tests
+"""
+from tempfile import TemporaryDirectory
+
+from numpy import array, array_equal, allclose, arange, bincount, zeros
+
+from src.data.rank_based_replay_buffer import RankBasedPrioritizedReplayBuffer
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.7
+BETA = 0.5
+
+
+def create_memory(buffer_size: int, batch_size: int, n_transitions: int, merge_every: int = 1) -> \
+        RankBasedPrioritizedReplayBuffer:
+    """
+    Creates the buffer with the transitions number 0, ..., n_transitions - 1.
+    :param buffer_size: int.
+    :param batch_size: int.
+    :param n_transitions: int.
+    :param merge_every: int.
+    :return: RankBasedPrioritizedReplayBuffer.
+    """
+    memory = RankBasedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size,
+                                              batch_size=batch_size, n_actions=N_ACTIONS, alpha=ALPHA,
+                                              merge_every=merge_every, seed=3)
+    for i in range(n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    return memory
+
+
+def test_rank_order() -> None:
+    """
+    Tests that the merges keep the slots sorted by the priorities, also when the slots are overwritten.
+    """
+    memory = create_memory(buffer_size=20, batch_size=4, n_transitions=20)
+    memory.update_priorities(arange(20), (arange(20) % 7 + 1.)[:, None])
+    memory.sample(BETA)
+    order = memory._order[:memory._order_size]  # pylint: disable=protected-access
+    priorities = memory._priorities[order]  # pylint: disable=protected-access
+    assert order.size == 20 and all(priorities[:-1] >= priorities[1:])
+
+    memory.update_priorities(array([0, 1]), array([[100.], [0.5]]))
+    memory.add(array([20, 200]), 0, 20, array([21, 210]), False)  # overwrites the slot 0 with the maximal priority
+    memory.sample(BETA)
+    order = memory._order[:memory._order_size]  # pylint: disable=protected-access
+    priorities = memory._priorities[order]  # pylint: disable=protected-access
+    assert order[0] == 0 and order[-1] == 1 and len(set(order)) == 20 and all(priorities[:-1] >= priorities[1:])
+
+
+def test_rank_based_sampling() -> None:
+    """
+    Tests that the batch has one transition from each stratum, the weights follow the ranks and the transitions with
+    higher priorities are sampled more often.
+    """
+    memory = create_memory(buffer_size=64, batch_size=8, n_transitions=64)
+    memory.update_priorities(arange(64), arange(64, dtype=float)[:, None] + 1.)
+    counts = zeros(64)
+    for _ in range(200):
+        states, actions, rewards, next_states, _, _, weights, indices = memory.sample(BETA)
+        assert array_equal(states[:, 0], indices) and array_equal(rewards[:, 0], indices) and \
+               array_equal(actions[:, 0], indices % N_ACTIONS) and array_equal(next_states[:, 0], indices + 1)
+        ranks = 64 - indices
+        # one rank from each stratum, strata are ordered from the highest priority
+        assert all(ranks[:-1] <= ranks[1:])
+        total = (arange(1, 65) ** -ALPHA).sum()
+        expected_weights = (ranks ** -ALPHA / total * 64) ** -BETA / (64 ** -ALPHA / total * 64) ** -BETA
+        assert allclose(weights[:, 0], expected_weights) and weights.max() <= 1.
+        counts += bincount(indices, minlength=64)
+    assert counts[48:].sum() > 2 * counts[:16].sum()
+
+
+def test_small_rank_based_buffer() -> None:
+    """
+    Tests that the buffer smaller than the batch samples only the stored transitions and the new transitions are
+    sampled after the merge.
+    """
+    memory = create_memory(buffer_size=10, batch_size=8, n_transitions=3, merge_every=2)
+    _, _, _, _, _, _, weights, indices = memory.sample(BETA)
+    assert set(indices) <= {0, 1, 2} and weights.shape == (8, 1)
+    memory.add(array([3, 30]), 3, 3, array([4, 40]), False)
+    assert set(memory.sample(BETA)[-1]) <= {0, 1, 2}
+    assert 3 in set(memory.sample(BETA)[-1]) | set(memory.sample(BETA)[-1])
+
+
+def test_rank_based_checkpoint() -> None:
+    """
+    Tests that the loaded buffer samples the same batches as the saved one.
+    """
+    memory = create_memory(buffer_size=16, batch_size=4, n_transitions=20, merge_every=3)
+    memory.update_priorities(arange(16), arange(16, dtype=float)[:, None] % 5 + 1.)
+    memory.sample(BETA)
+    memory.update_priorities(array([4]), array([[50.]]))
+    with TemporaryDirectory() as folder:
+        memory.save(folder)
+        loaded = create_memory(buffer_size=16, batch_size=4, n_transitions=0, merge_every=3)
+        loaded.load(folder)
+    for _ in range(5):
+        batch, loaded_batch = memory.sample(BETA), loaded.sample(BETA)
+        assert all(array_equal(item, loaded_item) for item, loaded_item in zip(batch, loaded_batch) if item is not None)
+
+
+def test_rank_based_sample_many() -> None:
+    """
+    Tests that each of the batches sampled at once has one transition from each stratum and the weights of its ranks.
+    """
+    memory = create_memory(buffer_size=64, batch_size=8, n_transitions=64)
+    memory.update_priorities(arange(64), arange(64, dtype=float)[:, None] + 1.)
+    memory.sample(BETA)
+    _, _, rewards, _, _, _, weights, indices = memory.sample_many(5, BETA)
+    assert rewards.shape == (5, 8, 1) and weights.shape == (5, 8, 1) and indices.shape == (5, 8)
+    assert array_equal(rewards[:, :, 0], indices)
+    ranks = 64 - indices
+    # one rank from each stratum in every batch, strata are ordered from the highest priority
+    assert (ranks[:, :-1] <= ranks[:, 1:]).all()
+    total = (arange(1, 65) ** -ALPHA).sum()
+    expected_weights = (ranks ** -ALPHA / total * 64) ** -BETA / (64 ** -ALPHA / total * 64) ** -BETA
+    assert allclose(weights[:, :, 0], expected_weights)
@@ -0,0 +1,518 @@
+"""
+Tests
+"""
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from numpy import array, array_equal, unique, arange, allclose, float32, int16, bool_, stack, zeros, uint8, float16, \
+    flatnonzero, bincount, diff
+from numpy.random import seed
+
+from src.data.observation_codec import ObservationCodec
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, ReplayBufferDataTypes, \
+    SAMPLING_REPLACEMENT, SAMPLING_REJECTION, EVICTION_FIFO, EVICTION_PRIORITY, EVICTION_HYBRID, PRIORITY_SAMPLING_ALIAS
+from src.exceptions.data_exception import MismatchedDimension
+from src.exceptions.development_exception import NoProperOptionInIf
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.2
+BETA = 0.9
+
+
+def create_buffer(buffer_size: int, batch_size: int, n_transitions: int, **kwargs: object) -> ReplayBuffer:
+    """
+    Creates the replay buffer and fills it with transitions.
+    :param buffer_size: int. Size of the buffer's memory.
+    :param batch_size: int. Size of the batch generated.
+    :param n_transitions: int. Number of transitions added.
+    :return: ReplayBuffer.
+    """
+    memory = ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size,
+                          batch_size=batch_size, n_actions=N_ACTIONS, **kwargs)  # type:ignore
+    for i in range(n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    return memory
+
+
+def create_prioritized_buffer(buffer_size: int, batch_size: int, n_transitions: int, \
+                              **kwargs: object) -> PrioritizedReplayBuffer:
+    """
+    Creates the prioritized replay buffer and fills it with transitions.
+    :param buffer_size: int. Size of the buffer's memory.
+    :param batch_size: int. Size of the batch generated.
+    :param n_transitions: int. Number of transitions added.
+    :return: PrioritizedReplayBuffer.
+    """
+    memory = PrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size,
+                                     batch_size=batch_size, n_actions=N_ACTIONS, alpha=ALPHA,
+                                     **kwargs)  # type:ignore
+    for i in range(n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    return memory
+
+
+@pytest.mark.parametrize("sampling", [SAMPLING_REPLACEMENT, SAMPLING_REJECTION])
+def test_sample_shapes(sampling: str) -> None:
+    """
+    Tests the shapes of the sampled batch.
+    """
+    memory = create_buffer(100, 8, 150, sampling=sampling, seed=1)
+    states, actions, rewards, next_states, dones, actions_oh = memory.sample()
+    assert states.shape == (8, STATE_DIM) and actions.shape == (8, ACTIONS_DIM) and rewards.shape == (8, 1) and \
+           next_states.shape == (8, STATE_DIM) and dones.shape == (8, 1) and \
+           actions_oh is not None and actions_oh.shape == (8, N_ACTIONS)
+
+
+@pytest.mark.parametrize("buffer_size, batch_size, n_transitions", [(100, 8, 150), (10, 8, 10), (1000, 64, 70)])
+def test_rejection_sampling_without_replacement(buffer_size: int, batch_size: int, n_transitions: int) -> None:
+    """
+    Tests that rejection sampling returns unique indices from the filled range only.
+    """
+    memory = create_buffer(buffer_size, batch_size, n_transitions, sampling=SAMPLING_REJECTION, seed=2)
+    for _ in range(20):
+        states, _, _, _, _, _ = memory.sample()
+        assert unique(states[:, 0]).size == batch_size
+        assert states[:, 0].min() >= max(0, n_transitions - buffer_size) and states[:, 0].max() < n_transitions
+
+
+def test_rejection_sampling_of_too_few_transitions() -> None:
+    """
+    Tests that the batch without replacement larger than the stored transitions raises the exception, also for more
+    batches at once.
+    """
+    memory = create_buffer(100, 8, 5, sampling=SAMPLING_REJECTION, seed=2)
+    with pytest.raises(ValueError):
+        memory.sample()
+    with pytest.raises(ValueError):
+        memory.sample_many(3)
+
+
+def test_seeded_sampling_is_reproducible() -> None:
+    """
+    Tests that two buffers with the same seed sample the same batches.
+    """
+    memory_1 = create_buffer(100, 8, 150, seed=3)
+    memory_2 = create_buffer(100, 8, 150, seed=3)
+    for _ in range(5):
+        assert array_equal(memory_1.sample()[0], memory_2.sample()[0])
+
+
+def test_global_seed_makes_sampling_reproducible() -> None:
+    """
+    Tests that the buffers without the seed sample the same batches after the same numpy.random.seed.
+    """
+    seed(4)
+    memory_1 = create_buffer(100, 8, 150)
+    seed(4)
+    memory_2 = create_buffer(100, 8, 150)
+    for _ in range(5):
+        assert array_equal(memory_1.sample()[0], memory_2.sample()[0])
+
+
+def test_rejection_sampling_keeps_draw_order() -> None:
+    """
+    Tests that the batches of rejection sampling are not sorted by the index.
+    """
+    memory = create_buffer(1000, 64, 1000, sampling=SAMPLING_REJECTION, seed=5)
+    assert not all((diff(memory.sample()[0][:, 0]) > 0).all() for _ in range(5))
+
+
+def test_unknown_sampling_mode() -> None:
+    """
+    Tests that unknown sampling mode raises the exception.
+    """
+    with pytest.raises(NoProperOptionInIf):
+        create_buffer(100, 8, 0, sampling="unknown")
+
+
+def test_prioritized_sample_skips_zero_priorities() -> None:
+    """
+    Tests that the transitions with (almost) zero priority are not sampled and indices are in the filled range.
+    """
+    memory = create_prioritized_buffer(16, 4, 10, seed=4)
+    memory.update_priorities(array(range(0, 10, 2)), array([1e-12] * 5).reshape((5, 1)))
+    for _ in range(20):
+        _, _, _, _, _, _, weights, indices = memory.sample(BETA)
+        assert weights.shape == (4, 1) and indices.shape == (4,)
+        assert all(index % 2 == 1 and index < 10 for index in indices)
+
+
+def test_prioritized_weights() -> None:
+    """
+    Tests the importance sampling weights against the formula w_i = (p_i / p_min) ** (-alpha * beta).
+    """
+    memory = create_prioritized_buffer(16, 8, 10, seed=5)
+    priorities = arange(1, 11, dtype=float)
+    memory.update_priorities(arange(10), priorities.reshape((10, 1)))
+    _, _, _, _, _, _, weights, indices = memory.sample(BETA)
+    assert allclose(weights[:, 0], (priorities[indices] / priorities.min()) ** (-ALPHA * BETA))
+
+
+def test_alias_sampling() -> None:
+    """
+    Tests that the alias sampling follows the priorities of its table with the weights of the tree formula and the
+    table is rebuilt only after the given fraction of the transitions changed.
+    """
+    memory = create_prioritized_buffer(16, 8, 10, seed=7, priority_sampling=PRIORITY_SAMPLING_ALIAS,
+                                       alias_rebuild_fraction=0.3)
+    priorities = arange(1, 11, dtype=float)
+    memory.update_priorities(arange(10), priorities.reshape((10, 1)))
+    _, _, _, _, _, _, weights, indices = memory.sample(BETA)
+    assert indices.max() < 10 and allclose(weights[:, 0], (priorities[indices] / priorities.min()) ** (-ALPHA * BETA))
+    # 3 changes of 10 transitions keep the table, the fourth one rebuilds it
+    memory.update_priorities(array([0, 1, 2]), array([[1000.], [1000.], [1000.]]))
+    _, _, _, _, _, _, weights, indices = memory.sample(BETA)
+    assert allclose(weights[:, 0], (priorities[indices] / priorities.min()) ** (-ALPHA * BETA))
+    memory.add(array([10, 100]), 0, 10, array([11, 110]), False)
+    priorities = array([1000.] * 3 + list(range(4, 11)) + [1000.])
+    counts = zeros(11)
+    for _ in range(30):
+        _, _, _, _, _, _, weights, indices = memory.sample(BETA)
+        assert allclose(weights[:, 0], (priorities[indices] / priorities.min()) ** (-ALPHA * BETA))
+        counts += bincount(indices, minlength=11)
+    assert counts[10] > 0 and counts[[0, 1, 2, 10]].sum() > counts[3:10].sum()
+    with pytest.raises(NoProperOptionInIf):
+        create_prioritized_buffer(16, 8, 0, priority_sampling="unknown")
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_priority_eviction(batched: bool) -> None:
+    """
+    Tests that the full buffer with the priority eviction overwrites the lowest priorities and keeps the rest, while
+    the fifo one overwrites the oldest transitions.
+    """
+    for eviction, kept in [(EVICTION_FIFO, [2, 3, 4, 5, 6, 7]), (EVICTION_PRIORITY, [0, 1, 3, 4, 6, 7])]:
+        memory = create_prioritized_buffer(8, 4, 8, seed=7, eviction=eviction, telemetry=True)
+        memory.update_priorities(arange(8), array([[4.], [4.], [1.], [4.], [4.], [2.], [4.], [4.]]))
+        if batched:
+            memory.add_batch(array([[8, 80], [9, 90]]), array([0, 1]), array([8, 9]), array([[9, 90], [10, 100]]),
+                             array([False, False]))
+        else:
+            for i in [8, 9]:
+                memory.add(array([i, 10 * i]), 0, i, array([i + 1, 10 * (i + 1)]), False)
+        # pylint: disable=protected-access
+        rewards = memory._rewards_buffer[:, 0]
+        assert sorted(rewards.tolist()) == kept + [8, 9]
+        assert array_equal(memory._get_ages(arange(8)), 9 - rewards)
+        assert array_equal(memory.get_not_overwritten(arange(8), 8), rewards < 8)
+
+
+def test_hybrid_eviction(tmp_path: Path) -> None:
+    """
+    Tests that the hybrid eviction keeps the old transition with the high priority only until its age halves it
+    enough, and the state is restored from the checkpoint.
+    """
+    saved = create_prioritized_buffer(4, 2, 4, eviction=EVICTION_HYBRID, eviction_half_life=4)
+    # priority ** alpha is 2 for the oldest transition, 1 for the others
+    saved.update_priorities(arange(4), array([[2. ** (1 / ALPHA)], [1.], [1.], [1.]]))
+    saved.save(str(tmp_path))
+    memory = create_prioritized_buffer(4, 2, 0, eviction=EVICTION_HYBRID, eviction_half_life=4)
+    memory.load(str(tmp_path))
+    evicted = []
+    for i in range(4, 8):
+        memory.add(array([i, 10 * i]), 0, i, array([i + 1, 10 * (i + 1)]), False)
+        evicted.append(int(flatnonzero(memory._rewards_buffer[:, 0] == i)[0]))  # pylint: disable=protected-access
+    assert evicted == [1, 2, 3, 0]
+    with pytest.raises(NoProperOptionInIf):
+        create_prioritized_buffer(4, 2, 0, eviction="unknown")
+    with pytest.raises(NoProperOptionInIf):
+        create_prioritized_buffer(4, 2, 0, eviction=EVICTION_PRIORITY, deduplicate_next_states=True)
+
+
+@pytest.mark.parametrize("prioritized", [False, True])
+@pytest.mark.parametrize("sampling", [SAMPLING_REPLACEMENT, SAMPLING_REJECTION])
+def test_sample_many(prioritized: bool, sampling: str) -> None:
+    """
+    Tests the shapes of the batches sampled at once, the rows of the transitions and that each batch is sampled as by
+    sample.
+    """
+    if prioritized:
+        memory = create_prioritized_buffer(32, 8, 20, seed=6)
+        memory.update_priorities(arange(20), arange(1., 21.)[:, None])
+        states, actions, rewards, next_states, dones, actions_oh, weights, indices = memory.sample_many(3, BETA)
+        assert weights.shape == (3, 8, 1) and indices.shape == (3, 8)
+        assert allclose(weights[:, :, 0], ((indices + 1.) / 1.) ** (-ALPHA * BETA))
+    else:
+        memory = create_buffer(32, 8, 20, sampling=sampling, seed=6)
+        states, actions, rewards, next_states, dones, actions_oh = memory.sample_many(3)
+        if sampling == SAMPLING_REJECTION:
+            assert all(unique(batch).size == 8 for batch in rewards[:, :, 0])
+    assert states.shape == (3, 8, STATE_DIM) and actions.shape == (3, 8, ACTIONS_DIM) and rewards.shape == (3, 8, 1) \
+           and next_states.shape == (3, 8, STATE_DIM) and dones.shape == (3, 8, 1) and \
+           actions_oh.shape == (3, 8, N_ACTIONS)
+    assert array_equal(states[:, :, 0], rewards[:, :, 0]) and array_equal(next_states[:, :, 0], rewards[:, :, 0] + 1)
+    assert array_equal(actions_oh.argmax(axis=2), actions[:, :, 0])
+
+
+@pytest.mark.parametrize("n_transitions, batch_size", [(10, 8), (20, 8), (100, 16)])
+def test_sample_many_rejection(n_transitions: int, batch_size: int) -> None:
+    """
+    Tests that the batches sampled at once are without replacement within each batch and uniform over the filled range.
+    """
+    memory = create_buffer(1000, batch_size, n_transitions, sampling=SAMPLING_REJECTION, seed=7)
+    rewards = memory.sample_many(2000)[2][:, :, 0].astype(int)
+    assert all(unique(batch).size == batch_size for batch in rewards)
+    counts = bincount(rewards.reshape(-1), minlength=n_transitions)
+    assert counts.size == n_transitions and allclose(counts / counts.sum(), 1. / n_transitions, rtol=0.25)
+
+
+def test_kary_priority_tree(tmp_path: Path) -> None:
+    """
+    Tests that the buffer with the k-ary priority tree samples the same batches as the one with the binary tree, also
+    after the checkpoint of the memory-mapped tree.
+    """
+    memory = create_prioritized_buffer(64, 8, 50, seed=10)
+    memory_kary = create_prioritized_buffer(64, 8, 50, seed=10, tree_branching=8,
+                                            storage_folder=str(tmp_path / "storage"))
+    for buffer in [memory, memory_kary]:
+        buffer.update_priorities(arange(50), (arange(50) % 7 + 1.)[:, None])
+    for _ in range(5):
+        batch, batch_kary = memory.sample(BETA), memory_kary.sample(BETA)
+        assert array_equal(batch[-1], batch_kary[-1]) and allclose(batch[-2], batch_kary[-2])
+
+    memory_kary.save(str(tmp_path / "checkpoint"))
+    memory_restored = create_prioritized_buffer(64, 8, 0, tree_branching=8)
+    memory_restored.load(str(tmp_path / "checkpoint"))
+    memory_restored.update_priorities(array([3]), array([[20.]]))
+    memory.update_priorities(array([3]), array([[20.]]))
+    assert array_equal(memory.sample(BETA)[-1], memory_restored.sample(BETA)[-1])
+
+
+def test_get_transitions() -> None:
+    """
+    Tests that the transitions are read from the given slots and the reads are not counted as samples.
+    """
+    memory = create_prioritized_buffer(16, 4, 20, telemetry=True)
+    states, actions, rewards, next_states, dones, actions_oh = memory.get_transitions(arange(16))
+    # transitions 16, ..., 19 overwrote the slots 0, ..., 3
+    assert array_equal(rewards[:, 0], arange(16) + 16 * (arange(16) < 4)) and array_equal(states[:, 0], rewards[:, 0])
+    assert array_equal(next_states[:, 0], rewards[:, 0] + 1) and dones.shape == (16, 1)
+    assert array_equal(actions_oh.argmax(axis=1), actions[:, 0])
+    assert memory.get_telemetry_report()["n_samples"] == 0
+
+
+def test_data_types() -> None:
+    """
+    Tests that the batches are sampled in the configured data types.
+    """
+    data_types = ReplayBufferDataTypes(states=float32, actions=int16, rewards=float32, dones=bool_)
+    memory = create_prioritized_buffer(16, 4, 10, seed=6, data_types=data_types)
+    states, actions, rewards, next_states, dones, _, weights, _ = memory.sample(BETA)
+    assert states.dtype == float32 and actions.dtype == int16 and rewards.dtype == float32 and \
+           next_states.dtype == float32 and dones.dtype == bool_ and weights.dtype == float32
+
+
+@pytest.mark.parametrize("buffer_size, n_transitions", [(16, 10), (16, 16), (16, 45)])
+def test_deduplicated_next_states(buffer_size: int, n_transitions: int) -> None:
+    """
+    Tests that the buffer storing each observation once returns the same batches as the standard one. Episodes end
+    either with done or without it (truncation) and the buffer wraps around.
+    """
+    memory = ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size, batch_size=8,
+                          n_actions=N_ACTIONS, seed=7)
+    memory_deduplicated = ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=buffer_size,
+                                       batch_size=8, n_actions=N_ACTIONS, seed=7, deduplicate_next_states=True)
+    state = array([0., 0.])
+    for i in range(n_transitions):
+        next_state = array([i + 1., -i - 1.])
+        done = i % 7 == 6
+        for buffer in [memory, memory_deduplicated]:
+            buffer.add(state, i % N_ACTIONS, i, next_state, done)
+        # new episode after done and after truncation
+        state = array([100. + i, 0.]) if done or i % 11 == 10 else next_state
+    for _ in range(10):
+        for array_1, array_2 in zip(memory.sample(), memory_deduplicated.sample()):
+            assert array_equal(array_1, array_2)
+
+
+@pytest.mark.parametrize("prioritized", [False, True])
+@pytest.mark.parametrize("chunk_size, deduplicate_next_states", [(3, False), (7, False), (40, False), (7, True)])
+def test_add_batch(prioritized: bool, chunk_size: int, deduplicate_next_states: bool) -> None:
+    """
+    Tests that adding the transitions in batches, wrapping around and larger than the buffer, fills the buffer the same
+    way as adding them one by one.
+    """
+    create = create_prioritized_buffer if prioritized else create_buffer
+    memory = create(16, 8, 45, seed=8, deduplicate_next_states=deduplicate_next_states)
+    memory_batched = create(16, 8, 0, seed=8, deduplicate_next_states=deduplicate_next_states)
+    indices = arange(45)
+    for start in range(0, 45, chunk_size):
+        chunk = indices[start:start + chunk_size]
+        memory_batched.add_batch(stack([chunk, 10 * chunk], axis=1), chunk % N_ACTIONS, chunk,
+                                 stack([chunk + 1, 10 * (chunk + 1)], axis=1), zeros(len(chunk), dtype=bool_))
+    assert memory_batched.get_current_size() == memory.get_current_size()
+    for _ in range(5):
+        batch = memory.sample(BETA) if prioritized else memory.sample()  # type:ignore
+        batch_batched = memory_batched.sample(BETA) if prioritized else memory_batched.sample()  # type:ignore
+        assert all(array_equal(item, item_batched) for item, item_batched in zip(batch, batch_batched))
+
+
+@pytest.mark.parametrize("prioritized", [False, True])
+def test_n_step_transitions(prioritized: bool) -> None:
+    """
+    Tests the n-step returns, bootstrap states, dones and discounts of the episodes ending with done, truncated and
+    still running, against the definition.
+    """
+    n_step, gamma = 3, 0.9
+    create = create_prioritized_buffer if prioritized else create_buffer
+    memory = create(32, 9, 0, seed=10, n_step=n_step, gamma=gamma)
+    episodes = [(5, True), (2, False), (4, False)]
+    transitions = []
+    i = 0
+    for length, ends_with_done in episodes:
+        episode = []
+        for step in range(length):
+            last = step == length - 1
+            next_state = array([-i, -i]) if last else array([i + 1, 10 * (i + 1)])
+            episode.append((array([i, 10 * i]), i % N_ACTIONS, float(i), next_state, last and ends_with_done))
+            memory.add(*episode[-1])
+            i += 1
+        transitions.append(episode)
+
+    expected = []
+    for (length, _), episode in zip(episodes, transitions):
+        # the running episode has its last n - 1 transitions still pending
+        for step in range(length if episode is not transitions[-1] else length - n_step + 1):
+            n_rewards = min(n_step, length - step)
+            expected.append((
+                sum(gamma ** k * episode[step + k][2] for k in range(n_rewards)),
+                episode[step + n_rewards - 1][3],
+                episode[step + n_rewards - 1][4],
+                gamma ** n_rewards
+            ))
+    assert memory.get_current_size() == len(expected) == 9
+
+    batch = memory.sample(BETA) if prioritized else memory.sample()  # type:ignore
+    states, _, rewards, next_states, dones, _, discounts = batch[:7]
+    order = states[:, 0].argsort()
+    assert allclose(rewards[order, 0], [transition[0] for transition in expected])
+    assert array_equal(next_states[order], stack([transition[1] for transition in expected]))
+    assert array_equal(dones[order, 0], [transition[2] for transition in expected])
+    assert allclose(discounts[order, 0], [transition[3] for transition in expected])
+
+
+@pytest.mark.parametrize("deduplicate_next_states", [False, True])
+def test_sample_sequences(deduplicate_next_states: bool) -> None:
+    """
+    Tests the sequences and their masks over the wrapped storage with episodes ending with done and truncated.
+    """
+    sequence_length = 4
+    memory = ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=8,
+                          n_actions=N_ACTIONS, seed=11, deduplicate_next_states=deduplicate_next_states,
+                          sequence_length=sequence_length)
+    dones = {5, 17, 29}
+    truncations = {11, 23}
+    episodes = []
+    episode = 0
+    for i in range(40):
+        next_state = array([-i, -i]) if i in dones | truncations else array([i + 1, 10 * (i + 1)])
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, next_state, i in dones)
+        episodes.append(episode)
+        episode += i in dones | truncations
+
+    for _ in range(5):
+        states, actions, rewards, next_states, sampled_dones, mask = memory.sample_sequences()
+        assert states.shape == (8, sequence_length, STATE_DIM) and actions.shape == (8, sequence_length, 1) and \
+               next_states.shape == (8, sequence_length, STATE_DIM) and mask.shape == (8, sequence_length)
+        for sequence in range(8):
+            start = int(states[sequence, 0, 0])
+            expected_mask = [start + k < 40 and episodes[start + k] == episodes[start] for k in range(sequence_length)]
+            assert mask[sequence].tolist() == expected_mask
+            steps = arange(sequence_length)[mask[sequence]]
+            assert array_equal(states[sequence, steps, 0], start + steps)
+            assert array_equal(rewards[sequence, steps, 0], start + steps)
+            assert array_equal(sampled_dones[sequence, steps, 0], [start + k in dones for k in steps])
+            assert array_equal(next_states[sequence, steps, 1],
+                               [-(start + k) if start + k in dones | truncations else 10 * (start + k + 1)
+                                for k in steps])
+
+
+@pytest.mark.parametrize("codec,tolerance,deduplicate_next_states", [
+    (ObservationCodec(uint8), 0., False),
+    (ObservationCodec(uint8, low=0., high=510.), 1., True),
+    (ObservationCodec(float16), 0.25, False),
+    (ObservationCodec(uint8, chunk_size=3), 0., True),
+    (ObservationCodec(float16, chunk_size=4), 0.25, False),
+])
+def test_observation_codec(tmp_path: Path, codec: ObservationCodec, tolerance: float,
+                           deduplicate_next_states: bool) -> None:
+    """
+    Tests that the encoded states are decoded into the data type of the states for the batches, sequences and after
+    loading the checkpoint.
+    """
+    memory = create_buffer(16, 4, 20, seed=4, observation_codec=codec, deduplicate_next_states=deduplicate_next_states,
+                           sequence_length=3, data_types=ReplayBufferDataTypes(states=float32))
+    states, _, rewards, next_states, _, _ = memory.sample()
+    assert states.dtype == float32 and next_states.dtype == float32
+    assert memory.get_observation_n_bytes() < create_buffer(16, 4, 20).get_observation_n_bytes()
+    assert allclose(states, rewards * array([[1, 10]]), rtol=0, atol=tolerance) and \
+           allclose(next_states, (rewards + 1) * array([[1, 10]]), rtol=0, atol=tolerance)
+    states, _, rewards, next_states, _, mask = memory.sample_sequences()
+    assert allclose(states[mask], rewards[mask] * array([[1, 10]]), rtol=0, atol=tolerance) and \
+           allclose(next_states[mask], (rewards[mask] + 1) * array([[1, 10]]), rtol=0, atol=tolerance)
+
+    memory.save(str(tmp_path))
+    memory_restored = create_buffer(16, 4, 0, observation_codec=codec, deduplicate_next_states=deduplicate_next_states,
+                                    sequence_length=3, data_types=ReplayBufferDataTypes(states=float32))
+    memory_restored.load(str(tmp_path))
+    for buffer in [memory, memory_restored]:
+        buffer.add(array([20, 200]), 0, 20, array([21, 210]), False)
+    for array_1, array_2 in zip(memory.sample(), memory_restored.sample()):
+        assert array_equal(array_1, array_2)
+
+
+def test_memory_mapped_storage(tmp_path: Path) -> None:
+    """
+    Tests that the buffers with memory-mapped storage sample the same batches as the ones in RAM.
+    """
+    memory = create_buffer(16, 4, 40, seed=8)
+    memory_mapped = create_buffer(16, 4, 40, seed=8, storage_folder=str(tmp_path / "uniform"))
+    prioritized_memory = create_prioritized_buffer(16, 4, 40, seed=8)
+    prioritized_memory_mapped = create_prioritized_buffer(16, 4, 40, seed=8, storage_folder=str(tmp_path / "per"))
+    for _ in range(5):
+        for array_1, array_2 in zip(memory.sample(), memory_mapped.sample()):
+            assert array_equal(array_1, array_2)
+        for array_1, array_2 in zip(prioritized_memory.sample(BETA), prioritized_memory_mapped.sample(BETA)):
+            assert array_equal(array_1, array_2)
+    assert (tmp_path / "uniform" / "states.dat").exists() and (tmp_path / "per" / "priority_tree.dat").exists()
+
+
+@pytest.mark.parametrize("mmap_mode", [None, "r+", "c"])
+def test_checkpoint(tmp_path: Path, mmap_mode: Optional[str]) -> None:
+    """
+    Tests that the restored buffers continue exactly as the saved ones.
+    """
+    memory = create_buffer(16, 4, 40, seed=9, deduplicate_next_states=True, sequence_length=3)
+    prioritized_memory = create_prioritized_buffer(16, 4, 40, seed=9, n_step=3, gamma=0.9)
+    prioritized_memory.update_priorities(arange(10), arange(1, 11, dtype=float).reshape((10, 1)))
+    memory.save(str(tmp_path / "uniform"))
+    prioritized_memory.save(str(tmp_path / "per"))
+
+    memory_restored = create_buffer(16, 4, 0, deduplicate_next_states=True, sequence_length=3)
+    memory_restored.load(str(tmp_path / "uniform"), mmap_mode)
+    prioritized_memory_restored = create_prioritized_buffer(16, 4, 0, n_step=3, gamma=0.9)
+    prioritized_memory_restored.load(str(tmp_path / "per"), mmap_mode)
+
+    for buffer, buffer_restored in [(memory, memory_restored), (prioritized_memory, prioritized_memory_restored)]:
+        buffer.add(array([1., 1.]), 1, 1., array([2., 2.]), True)
+        buffer_restored.add(array([1., 1.]), 1, 1., array([2., 2.]), True)
+        assert buffer.get_current_size() == buffer_restored.get_current_size()
+    for _ in range(5):
+        for array_1, array_2 in zip(memory.sample(), memory_restored.sample()):
+            assert array_equal(array_1, array_2)
+        for array_1, array_2 in zip(memory.sample_sequences(), memory_restored.sample_sequences()):
+            assert array_equal(array_1, array_2)
+        for array_1, array_2 in zip(prioritized_memory.sample(BETA), prioritized_memory_restored.sample(BETA)):
+            assert array_equal(array_1, array_2)
+
+
+def test_checkpoint_mismatch(tmp_path: Path) -> None:
+    """
+    Tests that loading the checkpoint into the buffer with different shape raises the exception.
+    """
+    create_buffer(16, 4, 10).save(str(tmp_path))
+    with pytest.raises(MismatchedDimension):
+        create_buffer(32, 4, 0).load(str(tmp_path))
@@ -0,0 +1,105 @@
+"""
+Tests
+"""
+import logging
+
+import pytest
+from numpy import array, arange, ones, allclose
+
+from src.data.rank_based_replay_buffer import RankBasedPrioritizedReplayBuffer
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from src.data.replay_buffer_telemetry import ReplayBufferTelemetry
+from src.exceptions.development_exception import NoProperOptionInIf
+from src.utils.envs import Envs
+from src.utils.logger import Logger
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.5
+BETA = 0.9
+
+
+def fill_buffer(memory: ReplayBuffer, n_transitions: int) -> ReplayBuffer:
+    """
+    Fills the buffer with transitions.
+    :param memory: ReplayBuffer.
+    :param n_transitions: int. Number of transitions added.
+    :return: ReplayBuffer.
+    """
+    for i in range(n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    return memory
+
+
+def test_uniform_telemetry() -> None:
+    """
+    Tests the counters, the ages of the sampled transitions and the size of the uniform buffer's report.
+    """
+    memory = fill_buffer(ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=20, batch_size=4,
+                                      n_actions=N_ACTIONS, seed=1, telemetry=True), 25)
+    memory.add_batch(ones((3, STATE_DIM)), arange(3), arange(3), ones((3, STATE_DIM)), arange(3) > 1)
+    for _ in range(6):
+        memory.sample()
+    report = memory.get_telemetry_report()
+    assert report["n_adds"] == 26 and report["n_samples"] == 6 and report["add_max_us"] >= report["add_mean_us"] > 0
+    assert sum(report["sample_age_histogram"]) == 24 and report["sample_age_bin_edges"][-1] == 20
+    assert report["size"] == 20 and report["fill_level"] == 1. and \
+           report["memory_bytes"] == 20 * (2 * STATE_DIM + ACTIONS_DIM + 2) * 8
+    assert "ess_mean" not in report and "priority_max" not in report
+    with pytest.raises(NoProperOptionInIf):
+        fill_buffer(ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=20, batch_size=4,
+                                 n_actions=N_ACTIONS), 5).get_telemetry_report()
+
+
+def test_sample_ages() -> None:
+    """
+    Tests that the age is the number of the transitions added after the sampled one.
+    """
+    telemetry = ReplayBufferTelemetry(buffer_size=10, n_bins=5)
+    telemetry.record_sample(100, array([0, 1, 2, 9]))
+    report = telemetry.get_report()
+    assert report["sample_age_histogram"] == [2, 1, 0, 0, 1] and report["sample_age_mean"] == 3.
+    memory = fill_buffer(ReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=10, batch_size=10,
+                                      n_actions=N_ACTIONS, sampling="replacement", seed=2, telemetry=True), 13)
+    rewards = memory.sample()[2][:, 0]
+    # reward is the number of the transition, the newest one is 12
+    assert allclose(memory.get_telemetry_report()["sample_age_mean"], (12 - rewards).mean())
+
+
+@pytest.mark.parametrize("buffer_class", [PrioritizedReplayBuffer, RankBasedPrioritizedReplayBuffer])
+def test_prioritized_telemetry(buffer_class: type) -> None:
+    """
+    Tests the effective sample size of the weights and the priorities in the report of the prioritized buffers.
+    """
+    memory = fill_buffer(buffer_class(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=8,
+                                      n_actions=N_ACTIONS, alpha=ALPHA, seed=3, telemetry=True), 16)
+    memory.sample(BETA)
+    if buffer_class is PrioritizedReplayBuffer:
+        # equal priorities give the uniform weights, while the ranks are never equal
+        assert allclose(memory.get_telemetry_report()["ess_mean"], 1.)
+    memory.update_priorities(arange(16), (arange(16) + 1.)[:, None] ** 2)
+    for _ in range(3):
+        memory.sample(BETA)
+    report = memory.get_telemetry_report()
+    assert 0 < report["ess_min"] < 1. and report["ess_min"] <= report["ess_mean"] <= 1.
+    exponent = ALPHA if buffer_class is PrioritizedReplayBuffer else 1.
+    assert allclose(report["priority_min"], 1.) and allclose(report["priority_max"], 256. ** exponent)
+    assert sum(report["priority_histogram"]) == 16
+
+
+def test_log_telemetry(caplog: pytest.LogCaptureFixture) -> None:
+    """
+    Tests that the report is logged by the Logger and the counters are reset.
+    """
+    Envs().set_logger("logger_console")
+    memory = fill_buffer(PrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                 batch_size=8, n_actions=N_ACTIONS, alpha=ALPHA, telemetry=True), 10)
+    memory.sample(BETA)
+    logger = Logger().get()
+    logger.addHandler(caplog.handler)
+    with caplog.at_level(logging.INFO):
+        memory.log_telemetry()
+    logger.removeHandler(caplog.handler)
+    assert "PrioritizedReplayBuffer telemetry; n_adds: 10;" in caplog.text and "ess_mean" in caplog.text
+    assert memory.get_telemetry_report()["n_samples"] == 0
@@ -0,0 +1,191 @@
+"""
+Tests
+
+Equivalence of the NumPy array-backed segment trees with the original list-based implementation from src/external
+(unmodified OpenAI baselines code).
+"""
+from typing import Any
+
+import pytest
+from numpy import array, array_equal, allclose, float32, float64, argmin
+from numpy.random import default_rng
+
+from src.data.segment_tree import SumSegmentTreeNumpy, MinSegmentTreeNumpy, PriorityTreeNumpy, KaryPriorityTreeNumpy
+from src.external.segment_tree import SumSegmentTree, MinSegmentTree
+
+
+def fill_trees(tree: Any, tree_numpy: Any, capacity: int, seed: int) -> None:
+    """
+    Fills both trees with the same random values, by single updates and by the batch update of the NumPy tree.
+    :param tree: Any. Original tree, or another NumPy tree.
+    :param tree_numpy: Any. NumPy tree.
+    :param capacity: int. Capacity of the trees.
+    :param seed: int. Seed for the random generator.
+    """
+    rng = default_rng(seed)
+    for index in rng.integers(0, capacity, size=3 * capacity):
+        value = rng.random()
+        tree[index] = value
+        tree_numpy[index] = value
+    indices = rng.integers(0, capacity, size=capacity)
+    values = rng.random(capacity)
+    for index, value in zip(indices, values):
+        tree[index] = value
+    tree_numpy.update_batch(indices, values)
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 16, 128])
+def test_sum_tree_equivalence(capacity: int) -> None:
+    """
+    Tests sums, getters and prefix sum search of the NumPy sum tree against the original one.
+    """
+    tree = SumSegmentTree(capacity)
+    tree_numpy = SumSegmentTreeNumpy(capacity)
+    fill_trees(tree, tree_numpy, capacity, 0)
+
+    ranges = [(start, end) for start in range(capacity) for end in range(start + 1, capacity + 1)]
+    assert allclose([tree.sum(start, end) for start, end in ranges],
+                    [tree_numpy.sum(start, end) for start, end in ranges])
+    assert tree.sum() == tree_numpy.sum()
+    assert array_equal([tree[index] for index in range(capacity)], tree_numpy[array(range(capacity))])
+
+    prefixsums = default_rng(1).uniform(0, tree.sum(), size=100)
+    expected = array([tree.find_prefixsum_idx(prefixsum) for prefixsum in prefixsums])
+    assert array_equal([tree_numpy.find_prefixsum_idx(prefixsum) for prefixsum in prefixsums], expected)
+    assert array_equal(tree_numpy.find_prefixsum_idx_batch(prefixsums), expected)
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 16, 128])
+def test_min_tree_equivalence(capacity: int) -> None:
+    """
+    Tests minimums and getters of the NumPy min tree against the original one.
+    """
+    tree = MinSegmentTree(capacity)
+    tree_numpy = MinSegmentTreeNumpy(capacity)
+    fill_trees(tree, tree_numpy, capacity, 2)
+
+    ranges = [(start, end) for start in range(capacity) for end in range(start + 1, capacity + 1)]
+    assert [tree.min(start, end) for start, end in ranges] == [tree_numpy.min(start, end) for start, end in ranges]
+    assert array_equal([tree[index] for index in range(capacity)], tree_numpy[array(range(capacity))])
+
+
+@pytest.mark.parametrize("tree_class", [SumSegmentTreeNumpy, MinSegmentTreeNumpy, PriorityTreeNumpy])
+def test_update_batch(tree_class: Any) -> None:
+    """
+    Tests that the batch update (with duplicated indices) builds the same tree as consecutive updates.
+    """
+    rng = default_rng(10)
+    tree_batch = tree_class(64)
+    tree_single = tree_class(64)
+    for _ in range(5):
+        indices = rng.integers(0, 50, size=20)
+        values = rng.random(20)
+        tree_batch.update_batch(indices, values)
+        for index, value in zip(indices, values):
+            tree_single[index] = value
+        assert array_equal(tree_batch.get_nodes(), tree_single.get_nodes())
+
+
+@pytest.mark.parametrize("data_type", [float32, float64])
+def test_data_type(data_type: Any) -> None:
+    """
+    Tests that the nodes are stored in the selected data type.
+    """
+    tree = SumSegmentTreeNumpy(8, data_type=data_type)
+    tree[3] = 1.5
+    assert tree.get_nodes().dtype == data_type and tree.sum() == 1.5
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 16, 128])
+def test_priority_tree_equivalence(capacity: int) -> None:
+    """
+    Tests the fused priority tree against the separate sum and min trees.
+    """
+    sum_tree = SumSegmentTreeNumpy(capacity)
+    min_tree = MinSegmentTreeNumpy(capacity)
+    priority_tree = PriorityTreeNumpy(capacity)
+    fill_trees(sum_tree, priority_tree, capacity, 3)
+    fill_trees(min_tree, MinSegmentTreeNumpy(capacity), capacity, 3)
+
+    ranges = [(start, end) for start in range(capacity) for end in range(start + 1, capacity + 1)]
+    assert allclose([sum_tree.sum(start, end) for start, end in ranges],
+                    [priority_tree.sum(start, end) for start, end in ranges])
+    assert [min_tree.min(start, end) for start, end in ranges] == \
+           [priority_tree.min(start, end) for start, end in ranges]
+    assert array_equal(sum_tree[array(range(capacity))], priority_tree[array(range(capacity))])
+
+    prefixsums = default_rng(4).uniform(0, sum_tree.sum(), size=100)
+    assert array_equal(sum_tree.find_prefixsum_idx_batch(prefixsums),
+                       priority_tree.find_prefixsum_idx_batch(prefixsums))
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 16, 128])
+def test_find_min_idx(capacity: int) -> None:
+    """
+    Tests that the descent of the min aggregates finds the first smallest leaf.
+    """
+    min_tree = MinSegmentTreeNumpy(capacity)
+    priority_tree = PriorityTreeNumpy(capacity)
+    values = default_rng(7).integers(1, 5, size=capacity).astype(float64)
+    min_tree.update_batch(array(range(capacity)), values)
+    priority_tree.update_batch(array(range(capacity)), values)
+    assert min_tree.find_min_idx() == priority_tree.find_min_idx() == int(argmin(values))
+    # leaves which were never set are infinite
+    priority_tree = PriorityTreeNumpy(2 * capacity)
+    priority_tree.update_range(0, values)
+    assert priority_tree.find_min_idx() == int(argmin(values))
+
+
+@pytest.mark.parametrize("capacity, start, length", [(1, 0, 1), (16, 0, 16), (16, 5, 7), (128, 127, 1), (128, 3, 0)])
+def test_priority_tree_update_range(capacity: int, start: int, length: int) -> None:
+    """
+    Tests that setting contiguous leaves results in the same nodes as setting them by indices.
+    """
+    tree = PriorityTreeNumpy(capacity)
+    tree_range = PriorityTreeNumpy(capacity)
+    values = default_rng(5).random(capacity)
+    tree.update_batch(array(range(capacity)), values)
+    tree_range.update_range(0, values)
+    new_values = default_rng(6).random(length)
+    tree.update_batch(array(range(start, start + length)), new_values)
+    tree_range.update_range(start, new_values)
+    assert allclose(tree.get_nodes(), tree_range.get_nodes())
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 16, 128, 100])
+@pytest.mark.parametrize("branching", [2, 3, 8, 16])
+def test_kary_priority_tree_equivalence(capacity: int, branching: int) -> None:
+    """
+    Tests the k-ary priority tree against the binary one, also with the leaves padded to full blocks.
+    """
+    binary_capacity = 1 << (capacity - 1).bit_length()
+    priority_tree = PriorityTreeNumpy(binary_capacity)
+    kary_tree = KaryPriorityTreeNumpy(capacity, branching=branching)
+    rng = default_rng(8)
+    for index in rng.integers(0, capacity, size=capacity):
+        value = rng.random()
+        priority_tree[index] = value
+        kary_tree[index] = value
+    indices = rng.integers(0, capacity, size=capacity)
+    values = rng.random(capacity) * (rng.random(capacity) > 0.2)
+    priority_tree.update_batch(indices, values)
+    kary_tree.update_batch(indices, values)
+    start = capacity // 3
+    values = rng.random(capacity - start)
+    priority_tree.update_range(start, values)
+    kary_tree.update_range(start, values)
+
+    ranges = [(start, end) for start in range(0, capacity, 7) for end in range(start + 1, capacity + 1, 5)]
+    assert allclose([priority_tree.sum(start, end) for start, end in ranges],
+                    [kary_tree.sum(start, end) for start, end in ranges])
+    assert [priority_tree.min(start, end) for start, end in ranges] == \
+           [kary_tree.min(start, end) for start, end in ranges]
+    assert allclose(priority_tree.sum(), kary_tree.sum()) and priority_tree.min() == kary_tree.min()
+    assert array_equal(priority_tree[array(range(capacity))], kary_tree[array(range(capacity))])
+    assert priority_tree.find_min_idx() == kary_tree.find_min_idx()
+
+    prefixsums = default_rng(9).uniform(0, kary_tree.sum(), size=100)
+    assert array_equal(priority_tree.find_prefixsum_idx_batch(prefixsums),
+                       kary_tree.find_prefixsum_idx_batch(prefixsums))
+    assert kary_tree.find_prefixsum_idx(float(prefixsums[0])) == priority_tree.find_prefixsum_idx(float(prefixsums[0]))
+    assert kary_tree.get_nodes().shape == KaryPriorityTreeNumpy.get_nodes_shape(capacity, branching)
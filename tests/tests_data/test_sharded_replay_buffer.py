@@ -0,0 +1,240 @@
+"""
+Tests
+"""
+from threading import Thread
+
+import pytest
+import torch
+from numpy import array, arange, bincount, allclose, array_equal, unique, zeros, isin, concatenate
+
+from src.data.prefetching_sampler import PrefetchingSampler
+from src.data.replay_buffer import PrioritizedReplayBuffer, PRIORITY_SAMPLING_ALIAS, EVICTION_PRIORITY
+from src.data.sharded_replay_buffer import ShardedPrioritizedReplayBuffer
+from src.exceptions.development_exception import NoProperOptionInIf
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.5
+BETA = 0.9
+
+
+def fill_buffer(memory: ShardedPrioritizedReplayBuffer, n_transitions: int) -> ShardedPrioritizedReplayBuffer:
+    """
+    Fills the buffer with transitions, reward is the number of the transition.
+    :param memory: ShardedPrioritizedReplayBuffer.
+    :param n_transitions: int. Number of transitions added.
+    :return: ShardedPrioritizedReplayBuffer.
+    """
+    for i in range(n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    return memory
+
+
+def test_global_sampling() -> None:
+    """
+    Tests that the transitions of all the shards are sampled proportionally to their priorities, the batch is
+    assembled in the order of the indices and the weights are the same as the ones of one buffer with the same
+    priorities.
+    """
+    memory = fill_buffer(ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                        batch_size=8, n_actions=N_ACTIONS, alpha=ALPHA, n_shards=4,
+                                                        seed=1), 16)
+    assert memory.get_current_size() == 16
+    # round robin puts the transition i into the slot i // 4 of the shard i % 4
+    transitions = (arange(16) % 4) * 4 + arange(16) // 4
+    priorities = (arange(16) + 1.) ** 2
+    memory.update_priorities(transitions, priorities[:, None])
+
+    counts = zeros(16, dtype=int)
+    n_samples = 1500
+    for _ in range(n_samples):
+        states, actions, rewards, _, _, actions_oh, weights, indices = memory.sample(BETA)
+        assert array_equal(indices, transitions[rewards[:, 0].astype(int)]) and array_equal(states[:, 0], rewards[:, 0])
+        assert array_equal(actions_oh.argmax(axis=1), actions[:, 0])
+        counts += bincount(rewards[:, 0].astype(int), minlength=16)
+    probabilities = priorities ** ALPHA / (priorities ** ALPHA).sum()
+    assert allclose(counts / counts.sum(), probabilities, atol=0.01)
+
+    single = PrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=8,
+                                     n_actions=N_ACTIONS, alpha=ALPHA)
+    single.update_priorities(arange(16), priorities[:, None])
+    # pylint: disable=protected-access
+    assert allclose(weights, single._calculate_weights(rewards[:, 0].astype(int), BETA))
+
+
+def test_sampling_threads() -> None:
+    """
+    Tests that the concurrent descents of the shards sample the same batch as the descents in the calling thread.
+    """
+    memories = [fill_buffer(ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM,
+                                                           buffer_size=64, batch_size=16, n_actions=N_ACTIONS,
+                                                           alpha=ALPHA, n_shards=4, seed=5,
+                                                           n_sampling_threads=n_sampling_threads), 64)
+                for n_sampling_threads in [0, None]]
+    for memory in memories:
+        memory.update_priorities(arange(64), (arange(64) % 7 + 1.)[:, None])
+    for _ in range(10):
+        batch_sequential, batch_threads = [memory.sample(BETA) for memory in memories]
+        for part_sequential, part_threads in zip(batch_sequential, batch_threads):
+            assert array_equal(part_sequential, part_threads)
+
+
+def test_partially_filled_shards() -> None:
+    """
+    Tests that the empty shards are never sampled and the transitions added to one shard keep the maximal priority of
+    all the shards.
+    """
+    memory = ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=32, batch_size=8,
+                                            n_actions=N_ACTIONS, alpha=ALPHA, n_shards=4, seed=2)
+    for i in range(3):
+        memory.add(array([i, i]), 0, i, array([i, i]), False, shard=2)
+    memory.update_priorities(array([16]), array([[9.]]))
+    memory.add(array([3, 3]), 0, 3, array([3, 3]), False, shard=2)
+    indices = memory.sample(BETA)[-1]
+    assert set(indices.tolist()) <= {16, 17, 18, 19}
+    # pylint: disable=protected-access
+    assert allclose(memory._shards[2]._priority_tree[array([0, 3])], 9. ** ALPHA)
+    # the empty slots hold no experience sets
+    assert array_equal(memory.get_not_overwritten(arange(16, 24), memory.get_n_added()), arange(8) < 4)
+
+
+def test_concurrent_adds() -> None:
+    """
+    Tests that the actor threads pinned to their shards and the sampling learner do not lose any transition.
+    """
+    memory = ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=400,
+                                            batch_size=16, n_actions=N_ACTIONS, alpha=ALPHA, n_shards=4, seed=3)
+    fill_buffer(memory, 4)
+
+    def actor(shard: int) -> None:
+        for i in range(90):
+            value = 1000 * shard + i
+            memory.add(array([value, value]), 0, value, array([value, value]), False, shard=shard)
+
+    threads = [Thread(target=actor, args=(shard,)) for shard in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(50):
+        indices = memory.sample(BETA)[-1]
+        memory.update_priorities(indices, arange(1., 17.)[:, None])
+    for thread in threads:
+        thread.join()
+    assert memory.get_current_size() == 364
+    rewards = memory.sample(BETA)[2][:, 0]
+    assert unique(rewards).size > 1
+
+
+def test_checkpoint(tmp_path: str) -> None:
+    """
+    Tests that the loaded buffer samples the same batches.
+    """
+    kwargs = {"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 16, "batch_size": 4,
+              "n_actions": N_ACTIONS, "alpha": ALPHA, "n_shards": 2}
+    memory = fill_buffer(ShardedPrioritizedReplayBuffer(seed=4, **kwargs), 11)
+    memory.update_priorities(arange(8), arange(1., 9.)[:, None])
+    memory.save(str(tmp_path))
+    restored = ShardedPrioritizedReplayBuffer(seed=5, **kwargs)
+    restored.load(str(tmp_path))
+    for expected, loaded in zip(memory.sample(BETA), restored.sample(BETA)):
+        assert (expected is None and loaded is None) or array_equal(expected, loaded)
+    fill_buffer(memory, 1)
+    fill_buffer(restored, 1)
+    assert array_equal(memory.sample(BETA)[-1], restored.sample(BETA)[-1])
+    assert restored.get_n_added() == memory.get_n_added() == 12
+    assert array_equal(restored.get_not_overwritten(arange(16), 11), memory.get_not_overwritten(arange(16), 11))
+
+
+@pytest.mark.parametrize("eviction_kwargs", [{}, {"eviction": EVICTION_PRIORITY}])
+def test_not_overwritten(eviction_kwargs: dict) -> None:
+    """
+    Tests that the global slots written into any shard after get_n_added are found as overwritten, for the batched
+    adds and the priority eviction too.
+    """
+    memory = fill_buffer(ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=8,
+                                                        batch_size=8, n_actions=N_ACTIONS, alpha=ALPHA, n_shards=2,
+                                                        seed=6, **eviction_kwargs), 8)
+    memory.update_priorities(arange(8), arange(2., 10.)[:, None])
+    n_added = memory.get_n_added()
+    assert n_added == 8 and memory.get_not_overwritten(arange(8), n_added).all()
+    # round robin puts the transition 8 into the shard 0 and the batch into the shard 1
+    fill_buffer(memory, 1)
+    memory.add_batch(zeros((2, STATE_DIM)), zeros(2), zeros(2), zeros((2, STATE_DIM)), zeros(2))
+    assert memory.get_n_added() == 11
+    # the oldest slots of the shards are the ones with the lowest priorities too
+    assert array_equal(memory.get_not_overwritten(arange(8), n_added), ~isin(arange(8), [0, 4, 5]))
+    assert array_equal(memory.get_not_overwritten(arange(8), 9), ~isin(arange(8), [4, 5]))
+
+
+def test_get_transitions_and_sample_many() -> None:
+    """
+    Tests that the transitions are got in the order of the global indices and the batches of sample_many keep their
+    own weights.
+    """
+    memory = fill_buffer(ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                        batch_size=8, n_actions=N_ACTIONS, alpha=ALPHA, n_shards=4,
+                                                        seed=7), 16)
+    # round robin puts the transition i into the slot i // 4 of the shard i % 4
+    transitions = (arange(16) % 4) * 4 + arange(16) // 4
+    indices = array([15, 0, 5, 5, 10, 3])
+    states, actions, rewards, _, _, actions_oh = memory.get_transitions(indices)
+    numbers = array([list(transitions).index(index) for index in indices])
+    assert array_equal(rewards[:, 0], numbers) and array_equal(states[:, 0], numbers)
+    assert array_equal(actions_oh.argmax(axis=1), actions[:, 0])
+
+    memory.update_priorities(transitions, (arange(16) + 1.)[:, None])
+    states, _, rewards, _, _, _, weights, indices = memory.sample_many(3, BETA)
+    assert states.shape == (3, 8, STATE_DIM) and weights.shape == (3, 8, 1) and indices.shape == (3, 8)
+    for batch in range(3):
+        assert array_equal(indices[batch], transitions[rewards[batch, :, 0].astype(int)])
+        assert allclose(weights[batch, :, 0], ((rewards[batch, :, 0] + 1.) ** ALPHA) ** -BETA)
+
+
+def test_telemetry() -> None:
+    """
+    Tests that the telemetry counts the adds and samples of all the shards and the ages come from the global numbers.
+    """
+    memory = fill_buffer(ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                        batch_size=8, n_actions=N_ACTIONS, alpha=ALPHA, n_shards=4,
+                                                        seed=8, telemetry=True), 12)
+    _, _, rewards, *_ = memory.sample(BETA)
+    report = memory.get_telemetry_report()
+    assert report["n_adds"] == 12 and report["n_samples"] == 1 and report["size"] == 12
+    assert report["fill_level"] == 0.75 and report["priority_max"] == 1.
+    assert report["sample_age_mean"] == (11 - rewards[:, 0]).mean()
+    with pytest.raises(NoProperOptionInIf):
+        ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=8,
+                                       n_actions=N_ACTIONS, alpha=ALPHA).get_telemetry_report()
+
+
+def test_prefetching_sampler() -> None:
+    """
+    Tests that the prefetching sampler delivers the batches of the sharded buffer and updates the priorities of the
+    slots not overwritten since the batch was sampled.
+    """
+    sharded = fill_buffer(ShardedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                         batch_size=8, n_actions=N_ACTIONS, alpha=ALPHA, n_shards=4,
+                                                         seed=9), 16)
+    memory = PrefetchingSampler(sharded, n_batches=1, batch_size=8, device=torch.device("cpu"))
+    *_, indices = memory.sample(BETA)
+    memory.close()
+    # the transition 16 overwrites the slot 0 of the shard 0
+    fill_buffer(memory, 1)
+    memory.update_priorities(indices, array([4.] * 8))
+    # pylint: disable=protected-access
+    priorities = concatenate([shard._priority_tree[arange(4)] for shard in sharded._shards])
+    assert allclose(priorities, [4. ** ALPHA if index in indices and index != 0 else 1. for index in range(16)])
+
+
+@pytest.mark.parametrize("kwargs", [{"buffer_size": 10}, {"n_step": 3, "gamma": 0.9},
+                                    {"deduplicate_next_states": True}, {"sequence_length": 4},
+                                    {"priority_sampling": PRIORITY_SAMPLING_ALIAS}])
+def test_unsupported_options(kwargs: dict) -> None:
+    """
+    Tests that the buffer size has to be divisible by the number of shards and the options depending on the
+    consecutive transitions or on one tree are rejected.
+    """
+    with pytest.raises(NoProperOptionInIf):
+        ShardedPrioritizedReplayBuffer(**{"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 16,
+                                          "batch_size": 4, "n_actions": N_ACTIONS, "alpha": ALPHA, "n_shards": 4,
+                                          **kwargs})
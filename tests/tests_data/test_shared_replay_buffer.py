@@ -0,0 +1,181 @@
+"""
+Tests
+"""
+from multiprocessing import Process
+from pathlib import Path
+from typing import Any
+
+import pytest
+import torch
+from numpy import array, array_equal, arange, allclose, unique, uint8
+
+from src.data.observation_codec import ObservationCodec
+from src.data.prefetching_sampler import PrefetchingSampler
+from src.data.replay_buffer import EVICTION_PRIORITY, PRIORITY_SAMPLING_ALIAS, SAMPLING_REPLACEMENT, \
+    SAMPLING_REJECTION
+from src.data.shared_replay_buffer import SharedReplayBuffer, SharedPrioritizedReplayBuffer, _reserve
+from src.exceptions.development_exception import NoProperOptionInIf
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.2
+BETA = 0.9
+N_ACTORS = 3
+N_TRANSITIONS = 30
+
+
+def run_actor(memory: Any, actor: int) -> None:
+    """
+    Adds the transitions of the actor, their states are actor * 1000 + i.
+    :param memory: Any. Shared buffer.
+    :param actor: int. Number of the actor.
+    """
+    for i in range(actor * 1000, actor * 1000 + N_TRANSITIONS):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    memory.close()
+
+
+@pytest.mark.parametrize("prioritized, tree_branching", [(False, 2), (True, 2), (True, 8)])
+def test_actor_processes(prioritized: bool, tree_branching: int) -> None:
+    """
+    Tests that the transitions added by the actor processes are all in the buffer sampled by this process, also with
+    the k-ary priority tree in the shared memory.
+    """
+    kwargs = {"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 128, "batch_size": 16,
+              "n_actions": N_ACTIONS, "seed": 1}
+    memory = SharedPrioritizedReplayBuffer(alpha=ALPHA, tree_branching=tree_branching, **kwargs) if prioritized else \
+        SharedReplayBuffer(**kwargs)  # type:ignore
+    actors = [Process(target=run_actor, args=(memory, actor)) for actor in range(N_ACTORS)]
+    for actor in actors:
+        actor.start()
+    for actor in actors:
+        actor.join()
+        assert actor.exitcode == 0
+    assert memory.get_current_size() == memory.get_n_added() == N_ACTORS * N_TRANSITIONS
+
+    sampled = set()
+    for _ in range(50):
+        states, actions, rewards, next_states, _, _, *rest = memory.sample(BETA) if prioritized else \
+            memory.sample()  # type:ignore
+        assert array_equal(rewards[:, 0], states[:, 0]) and array_equal(next_states[:, 0], states[:, 0] + 1) and \
+               array_equal(actions[:, 0], states[:, 0] % N_ACTIONS)
+        sampled |= set(states[:, 0].astype(int).tolist())
+        if prioritized:
+            memory.update_priorities(rest[1], rest[0] * 0. + 2.)
+    assert sampled == {actor * 1000 + i for actor in range(N_ACTORS) for i in range(N_TRANSITIONS)}
+    memory.close()
+
+
+def test_priority_updates_of_overwritten_slots() -> None:
+    """
+    Tests that the slots overwritten or being written since the sampling are found by get_not_overwritten, so their
+    priority updates can be dropped.
+    """
+    memory = SharedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=8, batch_size=8,
+                                           n_actions=N_ACTIONS, alpha=ALPHA, seed=2)
+    for i in range(8):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    n_added = memory.get_n_added()
+    *_, indices = memory.sample(BETA)
+    for i in range(8, 10):  # overwrites the slots 0 and 1
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    _reserve(memory, 1)  # the slot 2 is being overwritten
+    fresh = memory.get_not_overwritten(indices, n_added)
+    assert array_equal(fresh, indices >= 3)
+    memory.update_priorities(indices[fresh], array([5.] * int(fresh.sum())))
+    priorities = memory._priority_tree[arange(8)]  # pylint: disable=protected-access
+    expected = [5. ** ALPHA if slot in indices and slot >= 3 else 1. for slot in range(8)]
+    assert allclose(priorities, expected)
+    memory.close()
+
+
+def test_priority_updates_of_any_slots() -> None:
+    """
+    Tests that the priorities of any slots are updated, not only of the last sampled batch, also through the
+    prefetching sampler.
+    """
+    prioritized_memory = SharedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16,
+                                                       batch_size=4, n_actions=N_ACTIONS, alpha=ALPHA, seed=5)
+    for i in range(16):
+        prioritized_memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    prioritized_memory.sample(BETA)
+    prioritized_memory.update_priorities(array([12, 13, 14, 15]), array([9.] * 4))
+    priorities = prioritized_memory._priority_tree[arange(16)]  # pylint: disable=protected-access
+    assert allclose(priorities, [9. ** ALPHA if slot >= 12 else 1. for slot in range(16)])
+
+    memory = PrefetchingSampler(prioritized_memory, n_batches=1, batch_size=4, device=torch.device("cpu"))
+    *_, indices = memory.sample(BETA)
+    memory.close()
+    memory.update_priorities(indices[:3], array([7.] * 3))
+    assert allclose(prioritized_memory._priority_tree[indices[:3]], 7. ** ALPHA)  # pylint: disable=protected-access
+    assert float(prioritized_memory._shared_max_priority[0]) == 9.  # pylint: disable=protected-access
+    prioritized_memory.close()
+
+
+@pytest.mark.parametrize("prioritized, sampling, batch_size", [
+    (False, SAMPLING_REPLACEMENT, 8), (False, SAMPLING_REJECTION, 7), (True, SAMPLING_REPLACEMENT, 8)
+])
+def test_sampling_with_slot_being_written(prioritized: bool, sampling: str, batch_size: int) -> None:
+    """
+    Tests that the sampling does not wait for the slot reserved but not committed, the batch is drawn from the
+    committed slots and the size counts only them.
+    """
+    kwargs = {"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 8, "batch_size": batch_size,
+              "n_actions": N_ACTIONS, "seed": 4}
+    memory = SharedPrioritizedReplayBuffer(alpha=ALPHA, **kwargs) if prioritized else \
+        SharedReplayBuffer(sampling=sampling, **kwargs)  # type:ignore
+    for i in range(8):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    numbers = _reserve(memory, 1)  # the slot 0 is being overwritten
+    assert memory.get_current_size() == 7 and memory.get_n_added() == 9
+    for _ in range(10):
+        states, *_ = memory.sample(BETA) if prioritized else memory.sample()  # type:ignore
+        assert states.shape[0] == batch_size and 0 not in states[:, 0]
+        if sampling == SAMPLING_REJECTION:
+            assert unique(states[:, 0]).size == batch_size
+    memory._commit(numbers)  # pylint: disable=protected-access
+    assert memory.get_current_size() == 8
+    memory.close()
+
+
+def test_shared_checkpoint(tmp_path: Path) -> None:
+    """
+    Tests that the checkpoint restores the shared header.
+    """
+    memory = SharedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                                n_actions=N_ACTIONS, seed=3)
+    for i in range(20):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    memory.save(str(tmp_path))
+    memory_restored = SharedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                                         n_actions=N_ACTIONS, seed=3)
+    memory_restored.load(str(tmp_path))
+    assert memory_restored.get_current_size() == 16 and memory_restored.get_n_added() == 20
+    states, *_ = memory_restored.sample()
+    assert unique(states[:, 0]).size == 4 and states[:, 0].min() >= 4
+    memory.close()
+    memory_restored.close()
+
+
+def test_unsupported_options() -> None:
+    """
+    Tests that the options keeping the state in one process raise the exception.
+    """
+    with pytest.raises(NoProperOptionInIf):
+        SharedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                           n_actions=N_ACTIONS, deduplicate_next_states=True)
+    with pytest.raises(NoProperOptionInIf):
+        SharedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                           n_actions=N_ACTIONS, observation_codec=ObservationCodec(uint8, chunk_size=4))
+    with pytest.raises(NoProperOptionInIf):
+        SharedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                                      n_actions=N_ACTIONS, alpha=0.5, eviction=EVICTION_PRIORITY)
+    with pytest.raises(NoProperOptionInIf):
+        SharedPrioritizedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                                      n_actions=N_ACTIONS, alpha=0.5, priority_sampling=PRIORITY_SAMPLING_ALIAS)
+    memory = SharedReplayBuffer(state_dim=STATE_DIM, actions_dim=ACTIONS_DIM, buffer_size=16, batch_size=4,
+                                n_actions=N_ACTIONS)
+    with pytest.raises(NoProperOptionInIf):
+        memory.sample_many(2)
+    memory.close()
@@ -0,0 +1,87 @@
+"""
+Tests
+"""
+import pytest
+import torch
+from numpy import array, array_equal, allclose, uint8, float16
+
+from src.data.observation_codec import ObservationCodec
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from src.data.torch_replay_buffer import TorchReplayBuffer, TorchPrioritizedReplayBuffer
+from src.exceptions.development_exception import NoProperOptionInIf
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 10
+ALPHA = 0.2
+BETA = 0.9
+
+
+def fill_buffer(memory: ReplayBuffer, n_transitions: int) -> ReplayBuffer:
+    """
+    Fills the buffer with transitions.
+    :param memory: ReplayBuffer.
+    :param n_transitions: int. Number of transitions added.
+    :return: ReplayBuffer.
+    """
+    for i in range(n_transitions):
+        memory.add(array([i, 10 * i]), i % N_ACTIONS, i, array([i + 1, 10 * (i + 1)]), False)
+    return memory
+
+
+@pytest.mark.parametrize("deduplicate_next_states", [False, True])
+def test_torch_batches_equal_numpy_batches(deduplicate_next_states: bool) -> None:
+    """
+    Tests that the torch buffer samples the same transitions as the numpy buffer with the same seed.
+    """
+    kwargs = {"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 50, "batch_size": 8,
+              "n_actions": N_ACTIONS, "seed": 3, "deduplicate_next_states": deduplicate_next_states}
+    memory = fill_buffer(ReplayBuffer(**kwargs), 70)  # type:ignore
+    memory_torch = fill_buffer(TorchReplayBuffer(device=torch.device("cpu"), **kwargs), 70)  # type:ignore
+    for _ in range(5):
+        batch = memory.sample()
+        batch_torch = memory_torch.sample()
+        assert all(isinstance(item, torch.Tensor) for item in batch_torch)
+        assert all(array_equal(item, item_torch.numpy()) for item, item_torch in zip(batch, batch_torch))
+
+
+@pytest.mark.parametrize("codec,deduplicate_next_states", [
+    (ObservationCodec(uint8, low=0., high=1000.), False), (ObservationCodec(float16), True)
+])
+def test_torch_encoded_observations(codec: ObservationCodec, deduplicate_next_states: bool) -> None:
+    """
+    Tests that the torch buffer decodes the encoded states on the device as the numpy buffer does and rejects the
+    compressed storage.
+    """
+    kwargs = {"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 50, "batch_size": 8,
+              "n_actions": N_ACTIONS, "seed": 5, "deduplicate_next_states": deduplicate_next_states,
+              "observation_codec": codec}
+    memory = fill_buffer(ReplayBuffer(**kwargs), 70)  # type:ignore
+    memory_torch = fill_buffer(TorchReplayBuffer(device=torch.device("cpu"), **kwargs), 70)  # type:ignore
+    for _ in range(5):
+        batch = memory.sample()
+        batch_torch = memory_torch.sample()
+        assert batch_torch[0].dtype == torch.float64 and batch_torch[3].dtype == torch.float64
+        assert all(allclose(item, item_torch.numpy()) for item, item_torch in zip(batch, batch_torch))
+    with pytest.raises(NoProperOptionInIf):
+        TorchReplayBuffer(device=torch.device("cpu"), **{**kwargs, "observation_codec": ObservationCodec(
+            uint8, chunk_size=4)})  # type:ignore
+
+
+def test_torch_prioritized_batches_equal_numpy_batches() -> None:
+    """
+    Tests that the torch prioritized buffer samples the same transitions and weights as the numpy buffer.
+    """
+    kwargs = {"state_dim": STATE_DIM, "actions_dim": ACTIONS_DIM, "buffer_size": 50, "batch_size": 8,
+              "n_actions": N_ACTIONS, "alpha": ALPHA, "seed": 4}
+    memory = fill_buffer(PrioritizedReplayBuffer(**kwargs), 70)  # type:ignore
+    memory_torch = fill_buffer(TorchPrioritizedReplayBuffer(device=torch.device("cpu"), **kwargs), 70)  # type:ignore
+    for step in range(5):
+        batch = memory.sample(BETA)
+        batch_torch = memory_torch.sample(BETA)
+        assert array_equal(batch[-1], batch_torch[-1])
+        assert allclose(batch[-2], batch_torch[-2].numpy())
+        assert all(array_equal(item, item_torch.numpy()) for item, item_torch in zip(batch[:6], batch_torch[:6]))
+        priorities = array([step + 1.] * 8)
+        memory.update_priorities(batch[-1], priorities)
+        memory_torch.update_priorities(batch_torch[-1], priorities)
@@ -0,0 +1,187 @@
+"""
+Tests
+"""
+from typing import Any, Dict, Tuple
+
+from numpy import array, arange, float32, ndarray, dtype
+from numpy.random import default_rng
+
+import pytest
+
+from src.data.prefetching_sampler import PrefetchingSampler
+from src.data.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from src.data.sharded_replay_buffer import ShardedPrioritizedReplayBuffer
+from src.data.shared_replay_buffer import SharedReplayBuffer, SharedPrioritizedReplayBuffer
+from src.exceptions.development_exception import NoProperOptionInIf
+from src.models.agents import DQNAgent, DQNAgentPER
+from src.models.torch_networks import QNetwork
+
+STATE_DIM = 2
+ACTIONS_DIM = 1
+N_ACTIONS = 3
+ALPHA = 0.2
+BETA = 0.9
+GAMMA = 0.99
+
+
+class ObservationSpace:
+    """
+    Observation space of the test environment.
+    """
+    shape = (STATE_DIM,)
+
+
+class ActionSpace:
+    """
+    Action space of the test environment.
+    """
+    n = N_ACTIONS
+
+    def __init__(self) -> None:
+        self._random_generator = default_rng(3)
+
+    def sample(self) -> int:
+        """
+        Samples a random action.
+        :return: int.
+        """
+        return int(self._random_generator.integers(N_ACTIONS))
+
+
+class LineEnvironment:
+    """
+    Environment walking along a line, episode ends after 10 steps.
+    """
+
+    def __init__(self) -> None:
+        self.observation_space = ObservationSpace()
+        self.action_space = ActionSpace()
+        self._n_steps = 0
+
+    def reset(self) -> Tuple[ndarray[Any, dtype[Any]], Dict[str, Any]]:
+        """
+        Resets the environment.
+        :return: Tuple[ndarray[Any, dtype[Any]], Dict[str, Any]]. (state, info).
+        """
+        self._n_steps = 0
+        return array([0., 0.], dtype=float32), {}
+
+    def step(self, action: int) -> Tuple[ndarray[Any, dtype[Any]], float, bool, bool, Dict[str, Any]]:
+        """
+        Makes a step.
+        :param action: int.
+        :return: Tuple[ndarray[Any, dtype[Any]], float, bool, bool, Dict[str, Any]]. (next_state, reward, done,
+                 truncated, info).
+        """
+        self._n_steps += 1
+        next_state = array([self._n_steps, action], dtype=float32)
+        return next_state, float(action == 1), self._n_steps % 10 == 0, False, {}
+
+
+def fill_memory(agent: Any, n_steps: int) -> None:
+    """
+    Steps the environment by random actions, the transitions are stored into the agent's memory.
+    :param agent: Any. Agent.
+    :param n_steps: int. Number of the steps.
+    """
+    state, _ = agent._env.reset()  # pylint: disable=protected-access
+    for _ in range(n_steps):
+        agent.act(state, eps=1.)
+        state, _, done = agent.step(agent._env.action_space.sample())  # pylint: disable=protected-access
+        if done:
+            state, _ = agent._env.reset()  # pylint: disable=protected-access
+
+
+def test_refresh_with_shared_buffer() -> None:
+    """
+    Tests that the priority refresh updates all the slots of the shared prioritized buffer, also through the
+    prefetching sampler.
+    """
+    for prefetch_batches in (0, 2):
+        agent = DQNAgentPER(LineEnvironment(), actions_dim=ACTIONS_DIM, memory_size=32, batch_size=8,
+                            q_network_class=QNetwork, gamma=GAMMA, alpha=ALPHA,
+                            replay_buffer_class=SharedPrioritizedReplayBuffer, prefetch_batches=prefetch_batches,
+                            refresh_every=1, refresh_batch_size=8)
+        fill_memory(agent, 40)
+        for _ in range(4):
+            agent.learn(BETA)
+        memory = agent._memory  # pylint: disable=protected-access
+        if isinstance(memory, PrefetchingSampler):
+            memory.close()
+            memory = memory._memory  # pylint: disable=protected-access
+        priorities = memory._priority_tree[arange(32)]  # pylint: disable=protected-access
+        assert (priorities != 1.).all()
+        memory.close()
+
+
+@pytest.mark.parametrize("replay_buffer_class, sample_many_supported", [
+    (ReplayBuffer, True), (SharedReplayBuffer, False), (PrioritizedReplayBuffer, True),
+    (SharedPrioritizedReplayBuffer, False), (ShardedPrioritizedReplayBuffer, True)
+])
+def test_gradient_steps(replay_buffer_class: Any, sample_many_supported: bool) -> None:
+    """
+    Tests that more gradient steps per learning step are made with the buffers with and without multi-batch sampling.
+    """
+    kwargs = {"actions_dim": ACTIONS_DIM, "memory_size": 32, "batch_size": 8, "q_network_class": QNetwork,
+              "gamma": GAMMA, "replay_buffer_class": replay_buffer_class, "gradient_steps": 3}
+    prioritized = replay_buffer_class not in (ReplayBuffer, SharedReplayBuffer)
+    agent = DQNAgentPER(LineEnvironment(), alpha=ALPHA, **kwargs) if prioritized else \
+        DQNAgent(LineEnvironment(), **kwargs)
+    fill_memory(agent, 20)
+    n_batches = []
+    agent._learn_from_batch = n_batches.append  # type:ignore  # pylint: disable=protected-access
+    for _ in range(2):
+        if prioritized:
+            agent.learn(BETA)
+        else:
+            agent.learn()
+    assert len(n_batches) == 3 and all(len(batch[0]) == 8 for batch in n_batches)
+    assert agent._sample_many_supported == sample_many_supported  # pylint: disable=protected-access
+    if hasattr(agent._memory, "close"):  # pylint: disable=protected-access
+        agent._memory.close()  # pylint: disable=protected-access
+
+
+def test_refresh_with_sharded_buffer() -> None:
+    """
+    Tests that the priority refresh updates the slots of all the shards, except the ones overwritten by an actor while
+    the chunk was read.
+    """
+    agent = DQNAgentPER(LineEnvironment(), actions_dim=ACTIONS_DIM, memory_size=32, batch_size=8,
+                        q_network_class=QNetwork, gamma=GAMMA, alpha=ALPHA,
+                        replay_buffer_class=ShardedPrioritizedReplayBuffer, refresh_every=1, refresh_batch_size=32)
+    memory = agent._memory  # pylint: disable=protected-access
+    fill_memory(agent, 32)
+    get_transitions = memory.get_transitions
+
+    def get_transitions_with_actor(indices: ndarray[Any, dtype[Any]]) -> Tuple[Any, ...]:
+        # the actor overwrites the whole shard 1 after the chunk is read
+        transitions = get_transitions(indices)
+        for _ in range(8):
+            memory.add(array([0., 0.], dtype=float32), 0, 0., array([0., 0.], dtype=float32), False, shard=1)
+        return transitions
+
+    memory.get_transitions = get_transitions_with_actor
+    agent.refresh_priorities()
+    # pylint: disable=protected-access
+    priorities = [memory._shards[shard]._priority_tree[arange(8)] for shard in range(4)]
+    assert (priorities[0] != 1.).all() and (priorities[2] != 1.).all() and (priorities[3] != 1.).all()
+    assert (priorities[1] == 1.).all()
+
+
+def test_refresh_needs_reading_of_transitions() -> None:
+    """
+    Tests that the priority refresh is rejected for the buffer which cannot read the stored transitions.
+    """
+
+    # pylint: disable=too-few-public-methods
+    class SamplingOnlyBuffer:
+        """
+        Buffer without the reading of the stored transitions.
+        """
+
+        def __init__(self, **kwargs: Any) -> None:
+            self.kwargs = kwargs
+
+    with pytest.raises(NoProperOptionInIf):
+        DQNAgentPER(LineEnvironment(), actions_dim=ACTIONS_DIM, memory_size=32, batch_size=8, q_network_class=QNetwork,
+                    gamma=GAMMA, alpha=ALPHA, replay_buffer_class=SamplingOnlyBuffer, refresh_every=1)